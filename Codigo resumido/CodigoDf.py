@@ -1,7 +1,12 @@
 # procesar_citybike_fix.py 
 import pandas as pd
 import numpy as np
+import sys
 from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'data' / 'ARADIEL' / 'backend'))
+from data_processor import resumen_estaciones
 
 INPUT_CSV = "citybike_lima.csv"   # <- tu CSV crudo
 OUTPUT_CSV = "citybike_procesado.csv"     # <- resultado
@@ -20,13 +25,6 @@ def periodo_de_dia(h):
         return "noche"
     return "madrugada"
 
-def safe_mode(series):
-    s = series.dropna()
-    if s.empty:
-        return ""
-    mode = s.mode()
-    return mode.iloc[0] if not mode.empty else s.iloc[0]
-
 # --- 1) Leer CSV ---
 df = pd.read_csv(INPUT_CSV)
 print("Columnas originales:", df.columns.tolist()[:30])
@@ -117,38 +115,9 @@ elif 'codigo_estacion' in df.columns:
 else:
     key = 'nombre_estacion'
 
-grouped = df.groupby(key, observed=True)
-
-station_summary = grouped.agg(
-    nombre_estacion = ('nombre_estacion', lambda s: safe_mode(s) if 'nombre_estacion' in df.columns else ""),
-    obs = (key, 'count'),
-    bicis_promedio = ('bicis_libres', 'mean') if 'bicis_libres' in df.columns else pd.NamedAgg(column=key, aggfunc='count'),
-    capacidad_promedio = ('capacidad', 'mean') if 'capacidad' in df.columns else pd.NamedAgg(column=key, aggfunc='count'),
-    ocupacion_promedio = ('ocupacion', 'mean'),
-    pct_vacia = ('bicis_libres', lambda x: (x == 0).mean() * 100) if 'bicis_libres' in df.columns else pd.NamedAgg(column=key, aggfunc=lambda x: np.nan),
-    pct_llena = ('espacios_vacios', lambda x: (x == 0).mean() * 100) if 'espacios_vacios' in df.columns else pd.NamedAgg(column=key, aggfunc=lambda x: np.nan)
-).reset_index().rename(columns={key: 'id_estacion'})
-
-# hora pico
-if 'hora' in df.columns:
-    hp = (
-        df.groupby([key, 'hora'], observed=True)['ocupacion']
-          .mean()
-          .reset_index()
-          .sort_values([key, 'ocupacion'], ascending=[True, False])
-          .groupby(key, observed=True)
-          .first()
-          .reset_index()[[key,'hora']]
-          .rename(columns={key:'id_estacion','hora':'hora_pico'})
-    )
-    hp['id_estacion'] = hp['id_estacion'].astype(str)
-    station_summary['id_estacion'] = station_summary['id_estacion'].astype(str)
-    station_summary = station_summary.merge(hp, on='id_estacion', how='left')
-
-# redondeos
-for c in ['bicis_promedio','capacidad_promedio','ocupacion_promedio','pct_vacia','pct_llena']:
-    if c in station_summary.columns:
-        station_summary[c] = station_summary[c].round(3)
+# Agregación vectorizada: la misma del backend (data_processor), incluidos
+# hora pico, redondeos y categoría promedio.
+station_summary = resumen_estaciones(df, key)
 
 # --- 9) Categorías (instantánea y promedio) ---
 BINS = [0, 0.35, 0.65, 1.0]
@@ -160,7 +129,6 @@ for col in ['categoria_ocupacion','categoria_ocupacion_promedio','ocup_cat_fixed
         df.drop(columns=[col], inplace=True)
 
 df['categoria_ocupacion'] = pd.cut(df['ocupacion'].fillna(0), bins=BINS, labels=LABELS, include_lowest=True)
-station_summary['categoria_ocupacion_promedio'] = pd.cut(station_summary['ocupacion_promedio'].fillna(0), bins=BINS, labels=LABELS, include_lowest=True)
 
 # unir info de station_summary al df (ocupacion_promedio, categoria_promedio, etc.)
 df['id_estacion'] = df['id_estacion'].astype(str) if 'id_estacion' in df.columns else df[key].astype(str)
@@ -0,0 +1,436 @@
+# ================================================
+# mapas.py — Generación en lote de los mapas folium del EDA
+# ================================================
+# Uso:
+#   python mapas.py                       # lee citybike_lima.csv, escribe aquí
+#   python mapas.py -i otro.csv -o salida/ -p 4 --forzar
+#   python mapas.py -i ../data/ARADIEL/backend/data/historial.sqlite   # almacén SQL del backend
+#
+# Los datos se agrupan una sola vez, cada capa se arma con operaciones
+# vectorizadas y los mapas se renderizan en paralelo. Un mapa cuyo insumo
+# (hash de sus puntos y parámetros) y cuyo código de dibujo (renderizador,
+# helpers, estilos y versión de folium) no cambiaron no se vuelve a generar.
+import argparse
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BINS = [0, 0.35, 0.65, 1]
+LABELS = ['Baja', 'Media', 'Alta']
+COLOR_CATEGORIA = {'Baja': 'red', 'Media': 'orange', 'Alta': 'green'}
+GRADIENTE_DEMANDA = {0.2: 'blue', 0.4: 'lime', 0.6: 'orange', 1.0: 'red'}
+CENTRO_MIRAFLORES = [-12.121, -77.03]
+MANIFIESTO = '.mapas_hash.json'
+VERSION = 1   # subir si cambia el dibujo de algún mapa
+log = logging.getLogger('citybike.eda')
+
+# Umbrales del reabastecimiento (mismos que el notebook)
+THRESHOLD_LOW, THRESHOLD_HIGH, VEHICLE_CAP = 0.35, 0.65, 10
+
+
+# ================================================
+# 1. Carga y preparación (una sola pasada)
+# ================================================
+
+RENOMBRES = {
+    "scrape_timestamp": "timestamp", "station_id": "id_estacion", "station_name": "nombre_estacion",
+    "lat": "latitud", "lon": "longitud", "capacity": "capacidad", "free_bikes": "bicis_libres",
+    "empty_slots": "espacios_vacios",
+}
+
+
+def leer_tabla(path, consulta="SELECT * FROM snapshots"):
+    """CSV, o el almacén SQLite del backend (.sqlite/.db).
+
+    Del almacén se lee la vista 'snapshots' (mismas columnas que el CSV en
+    vivo); `consulta` permite filtrar en la base, p.ej.
+    "SELECT * FROM snapshots WHERE station_id IN ('a1', 'b2')".
+    """
+    if Path(path).suffix in ('.sqlite', '.db'):
+        uri = Path(path).resolve().as_uri() + '?mode=ro'
+        with closing(sqlite3.connect(uri, uri=True)) as conn:
+            return pd.read_sql_query(consulta, conn)
+    return pd.read_csv(path, encoding='utf-8-sig')
+
+
+def cargar(path):
+    """CSV crudo o procesado (o almacén SQLite) -> df con las columnas que usan los mapas."""
+    df = leer_tabla(path).rename(columns=RENOMBRES)
+    for c in ['latitud', 'longitud', 'capacidad', 'bicis_libres']:
+        df[c] = pd.to_numeric(df[c], errors='coerce')
+    df = df.dropna(subset=['bicis_libres', 'capacidad', 'latitud', 'longitud'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601', errors='coerce')
+    df['ocupacion'] = np.where(df['capacidad'] > 0, df['bicis_libres'] / df['capacidad'], np.nan)
+    df['ocupacion'] = df['ocupacion'].clip(0, 1)
+    df['codigo_estacion'] = df['nombre_estacion'].astype(str).str.extract(r"(\d{5})")[0]
+    df = df[df['codigo_estacion'] != "27042"]
+    df['categoria_ocupacion'] = pd.cut(df['ocupacion'], bins=BINS, labels=LABELS, include_lowest=True)
+    df['id_estacion'] = df['id_estacion'].astype(str)
+    return df.reset_index(drop=True)
+
+
+def _por_estacion(df):
+    """Promedio por estación (primer nombre/coordenada, como el notebook)."""
+    g = df.groupby('id_estacion', sort=True)
+    prom = g.agg(
+        nombre_estacion=('nombre_estacion', 'first'),
+        latitud=('latitud', 'first'),
+        longitud=('longitud', 'first'),
+        ocupacion_promedio=('ocupacion', 'mean'),
+    )
+    prom['categoria'] = pd.cut(prom['ocupacion_promedio'].fillna(0), bins=BINS, labels=LABELS,
+                               include_lowest=True).astype(str)
+    prom['demand'] = 1 - prom['ocupacion_promedio']
+    return prom.dropna(subset=['ocupacion_promedio']).reset_index()
+
+
+def _por_franja(df, columna, etiquetas):
+    """{etiqueta: [[lat, lon, ocup_media], ...]} con un único groupby (franja, estación)."""
+    g = (df.groupby([columna, 'id_estacion'], sort=True)
+           .agg(latitud=('latitud', 'first'), longitud=('longitud', 'first'), ocup=('ocupacion', 'mean'))
+           .dropna())
+    out = {e: [] for e in etiquetas}
+    for franja, sub in g.groupby(level=0, sort=True):
+        out[franja] = sub[['latitud', 'longitud', 'ocup']].to_numpy().tolist()
+    return out
+
+
+def _haversine_matriz(lat1, lon1, lat2, lon2):
+    """Distancias km entre todos los pares (vectorizado)."""
+    lat1, lon1 = np.radians(lat1)[:, None], np.radians(lon1)[:, None]
+    lat2, lon2 = np.radians(lat2)[None, :], np.radians(lon2)[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
+
+
+def tabla_transferencias(snapshot):
+    """Greedy del notebook (demanda más severa primero, excedente más cercano),
+    con la matriz de distancias calculada una sola vez. Devuelve el DataFrame
+    de transfers_sugeridos.csv más las coordenadas de cada extremo."""
+    snapshot = snapshot.assign(
+        categoria_ocupacion=pd.cut(snapshot['ocupacion'], bins=BINS, labels=LABELS, include_lowest=True))
+    surplus = snapshot[snapshot['ocupacion'] >= THRESHOLD_HIGH]
+    avail = (surplus['bicis_libres'] - surplus['capacidad'] * 0.5).clip(lower=0).astype(int).to_numpy()
+    orden_s = np.argsort(-avail, kind='stable')
+    surplus, avail = surplus.iloc[orden_s].reset_index(drop=True), avail[orden_s].copy()
+
+    demand = snapshot[snapshot['ocupacion'] <= THRESHOLD_LOW]
+    need = ((demand['capacidad'] * 0.5) - demand['bicis_libres']).clip(lower=1).astype(int).to_numpy()
+    orden_d = np.argsort(-need, kind='stable')
+    demand, need = demand.iloc[orden_d].reset_index(drop=True), need[orden_d]
+
+    columnas = ['from_id', 'from_name', 'from_category', 'to_id', 'to_name', 'to_category',
+                'bikes', 'distance_km', 'from_lat', 'from_lon', 'to_lat', 'to_lon']
+    if demand.empty or surplus.empty:
+        return pd.DataFrame(columns=columnas)
+    dist = _haversine_matriz(demand['latitud'].to_numpy(), demand['longitud'].to_numpy(),
+                             surplus['latitud'].to_numpy(), surplus['longitud'].to_numpy())
+    filas = []
+    for i in range(len(demand)):
+        pendiente = int(need[i])
+        if not (avail > 0).any():
+            break
+        d = demand.iloc[i]
+        for j in np.argsort(dist[i], kind='stable'):
+            if pendiente <= 0:
+                break
+            take = min(pendiente, int(avail[j]), VEHICLE_CAP)
+            if take <= 0:
+                continue
+            s = surplus.iloc[j]
+            filas.append([s['id_estacion'], s['nombre_estacion'], s['categoria_ocupacion'],
+                          d['id_estacion'], d['nombre_estacion'], d['categoria_ocupacion'],
+                          int(take), float(dist[i, j]),
+                          float(s['latitud']), float(s['longitud']), float(d['latitud']), float(d['longitud'])])
+            avail[j] -= take
+            pendiente -= take
+    return pd.DataFrame(filas, columns=columnas)
+
+
+def transferencias(snapshot):
+    """Rutas [lat_origen, lon_origen, lat_destino, lon_destino, bicis, km] para el mapa."""
+    t = tabla_transferencias(snapshot)
+    return [[la1, lo1, la2, lo2, int(b), km] for la1, lo1, la2, lo2, b, km in
+            t[['from_lat', 'from_lon', 'to_lat', 'to_lon', 'bikes', 'distance_km']].itertuples(index=False)]
+
+
+def capas(df):
+    """Insumos (listas serializables) de cada mapa a partir del df, agrupando una vez."""
+    prom = _por_estacion(df)
+    centro = [float(prom['latitud'].mean()), float(prom['longitud'].mean())]
+    estaciones = {
+        'lat': prom['latitud'].tolist(), 'lon': prom['longitud'].tolist(),
+        'nombre': prom['nombre_estacion'].astype(str).tolist(),
+        'ocup': prom['ocupacion_promedio'].round(6).tolist(),
+        'categoria': prom['categoria'].tolist(),
+    }
+    heat_ocup = prom[['latitud', 'longitud', 'ocupacion_promedio']].to_numpy().tolist()
+    heat_demand = prom[['latitud', 'longitud', 'demand']].to_numpy().tolist()
+
+    df = df.assign(fecha=df['timestamp'].dt.date.astype(str), hora=df['timestamp'].dt.hour)
+    fechas = sorted(df['fecha'].dropna().unique())
+    por_dia = _por_franja(df, 'fecha', fechas)
+    por_hora = _por_franja(df.dropna(subset=['hora']).astype({'hora': int}), 'hora', range(24))
+
+    # demanda por (estación, categoría promedio) — heat_demand_categoria
+    cat = df.merge(prom[['id_estacion', 'categoria']], on='id_estacion')
+    heat_cat = (cat.groupby(['id_estacion', 'categoria'])
+                   .agg(latitud=('latitud', 'first'), longitud=('longitud', 'first'), ocup=('ocupacion', 'mean'))
+                   .dropna())
+    heat_cat = np.column_stack([heat_cat['latitud'], heat_cat['longitud'], 1 - heat_cat['ocup']]).tolist()
+
+    # snapshot más reciente + rutas de reabastecimiento
+    snap = df[df['timestamp'] == df['timestamp'].max()].groupby('id_estacion').tail(1)
+    snap = snap.assign(ocupacion=snap['ocupacion'].fillna(0))
+    snapshot = {
+        'lat': snap['latitud'].tolist(), 'lon': snap['longitud'].tolist(),
+        'nombre': snap['nombre_estacion'].astype(str).tolist(), 'ocup': snap['ocupacion'].tolist(),
+    }
+
+    return {
+        'mapa_ocupacion_estaciones.html': {'estaciones': estaciones},
+        'mapa_calor_ocupacion.html': {'puntos': heat_ocup},
+        'heat_ocupacion_global.html': {'puntos': heat_ocup, 'centro': centro},
+        'heat_demand_local.html': {'puntos': heat_demand, 'centro': centro},
+        'heat_demand_categoria.html': {'puntos': heat_cat, 'centro': centro},
+        'heat_time_by_day.html': {'franjas': [[[la, lo, 1 - o] for la, lo, o in por_dia[f]] for f in fechas],
+                                  'indice': fechas, 'centro': centro, 'zoom': 14},
+        'heat_by_hour.html': {'franjas': [[[la, lo, min(max(1 - o, 0), 1) * 5] for la, lo, o in por_hora[h]]
+                                          for h in range(24)],
+                              'indice': [f"{h:02d}:00" for h in range(24)], 'centro': centro, 'zoom': 15},
+        'puntos_cluster.html': {'estaciones': estaciones, 'centro': centro},
+        'heat_local_mejorado.html': {'estaciones': estaciones, 'centro': centro},
+        'reabastecimiento_rutas.html': {'snapshot': snapshot, 'rutas': transferencias(snap), 'centro': centro},
+    }
+
+
+# ================================================
+# 2. Renderizadores (uno por mapa; corren en el pool)
+# ================================================
+
+def _color_ocupacion(o, corte_medio=0.65):
+    return 'red' if o < 0.35 else ('orange' if o < corte_medio else 'green')
+
+
+def _mapa_estaciones(folium, p):
+    m = folium.Map(location=CENTRO_MIRAFLORES, zoom_start=14)
+    e = p['estaciones']
+    for lat, lon, nombre, ocup, cat in zip(e['lat'], e['lon'], e['nombre'], e['ocup'], e['categoria']):
+        popup = f"<b>{nombre}</b><br>Ocupación promedio: {ocup:.2f}<br>Categoría: {cat}"
+        folium.CircleMarker(location=[lat, lon], radius=7, color=COLOR_CATEGORIA.get(cat, 'blue'),
+                            fill=True, fill_opacity=0.7, popup=popup).add_to(m)
+    return m
+
+
+def _mapa_calor(folium, p):
+    from folium.plugins import HeatMap
+    m = folium.Map(location=CENTRO_MIRAFLORES, zoom_start=14)
+    HeatMap(p['puntos'], radius=18, blur=25, max_zoom=13).add_to(m)
+    return m
+
+
+def _heat_global(folium, p):
+    from folium.plugins import HeatMap
+    m = folium.Map(location=p['centro'], zoom_start=12, tiles='CartoDB positron')
+    HeatMap(p['puntos'], radius=15, blur=20, max_zoom=10).add_to(m)
+    return m
+
+
+def _heat_demanda(folium, p):
+    from folium.plugins import HeatMap
+    m = folium.Map(location=p['centro'], zoom_start=15, tiles='CartoDB positron')
+    HeatMap(p['puntos'], radius=10, blur=12, max_zoom=16, gradient=GRADIENTE_DEMANDA).add_to(m)
+    return m
+
+
+def _heat_tiempo(folium, p):
+    from folium.plugins import HeatMapWithTime
+    m = folium.Map(location=p['centro'], zoom_start=p['zoom'], tiles='CartoDB positron')
+    HeatMapWithTime(p['franjas'], index=p['indice'], auto_play=False, max_opacity=0.8, radius=8).add_to(m)
+    return m
+
+
+def _puntos_cluster(folium, p):
+    from folium.plugins import MarkerCluster
+    m = folium.Map(location=p['centro'], zoom_start=14, tiles='CartoDB positron')
+    mc = MarkerCluster().add_to(m)
+    e = p['estaciones']
+    for lat, lon, nombre, ocup in zip(e['lat'], e['lon'], e['nombre'], e['ocup']):
+        folium.CircleMarker(location=[lat, lon], radius=6, color=_color_ocupacion(ocup), fill=True,
+                            fill_opacity=0.7,
+                            popup=f"<b>{nombre}</b><br>Ocupación promedio: {ocup:.2f}").add_to(mc)
+    return m
+
+
+def _heat_local_mejorado(folium, p):
+    from folium.plugins import HeatMap
+    m = folium.Map(location=p['centro'], zoom_start=15, tiles='CartoDB positron')
+    e = p['estaciones']
+    demand = 1 - np.asarray(e['ocup'])
+    peso = np.clip(demand * 5, 0.05, 5)
+    HeatMap(np.column_stack([e['lat'], e['lon'], peso]).tolist(), radius=9, blur=10, max_zoom=16,
+            gradient=GRADIENTE_DEMANDA).add_to(m)
+    for lat, lon, nombre, ocup, d in zip(e['lat'], e['lon'], e['nombre'], e['ocup'], demand):
+        popup = f"<b>{nombre}</b><br>Ocup prom: {ocup:.2f}<br>Demand: {d:.2f}"
+        folium.CircleMarker(location=[lat, lon], radius=4 + d * 12, color=_color_ocupacion(ocup, 0.55),
+                            fill=True, fill_opacity=0.8, popup=popup).add_to(m)
+    return m
+
+
+def _reabastecimiento(folium, p):
+    m = folium.Map(location=p['centro'], zoom_start=14, tiles='CartoDB positron')
+    s = p['snapshot']
+    for lat, lon, nombre, ocup in zip(s['lat'], s['lon'], s['nombre'], s['ocup']):
+        folium.CircleMarker([lat, lon], radius=5, color=_color_ocupacion(ocup), fill=True, fill_opacity=0.7,
+                            popup=f"{nombre}<br>Ocupación: {ocup:.2f}").add_to(m)
+    for lat1, lon1, lat2, lon2, bikes, km in p['rutas']:
+        folium.PolyLine(locations=[[lat1, lon1], [lat2, lon2]], color='blue',
+                        weight=2 + min(bikes, VEHICLE_CAP) / 2, opacity=0.8,
+                        tooltip=f"{bikes} bicicletas, {km:.2f} km").add_to(m)
+    return m
+
+
+RENDERIZADORES = {
+    'mapa_ocupacion_estaciones.html': _mapa_estaciones,
+    'mapa_calor_ocupacion.html': _mapa_calor,
+    'heat_ocupacion_global.html': _heat_global,
+    'heat_demand_local.html': _heat_demanda,
+    'heat_demand_categoria.html': _heat_demanda,
+    'heat_time_by_day.html': _heat_tiempo,
+    'heat_by_hour.html': _heat_tiempo,
+    'puntos_cluster.html': _puntos_cluster,
+    'heat_local_mejorado.html': _heat_local_mejorado,
+    'reabastecimiento_rutas.html': _reabastecimiento,
+}
+
+
+def _renderizar(args):
+    nombre, insumo, salida = args
+    import folium
+    t0 = time.perf_counter()
+    RENDERIZADORES[nombre](folium, insumo).save(str(salida))
+    return nombre, time.perf_counter() - t0
+
+
+# ================================================
+# 3. Lote con hash de insumos
+# ================================================
+
+def _nombres(codigo):
+    """Nombres globales y atributos usados por un code object (incluye lambdas y comprensiones)."""
+    nombres = set(codigo.co_names)
+    for c in codigo.co_consts:
+        if inspect.iscode(c):
+            nombres |= _nombres(c)
+    return nombres
+
+
+def fuentes(fn, modulos=(), vistos=None):
+    """Fuente de fn y, recursivamente, de las funciones y constantes (MAYÚSCULAS, serializables)
+    de su módulo o de `modulos` que usa. Sirve de huella del código en las cachés."""
+    vistos = set() if vistos is None else vistos
+    if fn in vistos:
+        return []
+    vistos.add(fn)
+    espacios = [fn.__globals__, *(vars(m) for m in modulos if vars(m) is not fn.__globals__)]
+    propios = {e['__name__'] for e in espacios}
+    partes = [inspect.getsource(fn)]
+    for nombre in sorted(_nombres(fn.__code__)):
+        for espacio in espacios:
+            valor = espacio.get(nombre)
+            if inspect.isfunction(valor) and valor.__module__ in propios:
+                partes += fuentes(valor, modulos, vistos)
+            elif nombre.isupper() and not callable(valor) and valor is not None:
+                try:
+                    partes.append(f'{nombre} = {json.dumps(valor, sort_keys=True)}')
+                except TypeError:   # p.ej. RENDERIZADORES (funciones): se sigue por nombre
+                    pass
+    return partes
+
+
+@lru_cache(maxsize=None)
+def _huella_render(nombre):
+    """Hash del código que dibuja el mapa: _renderizar, su renderizador y lo que usan, más folium."""
+    try:
+        version_folium = metadata.version('folium')
+    except metadata.PackageNotFoundError:
+        version_folium = None
+    datos = json.dumps([version_folium, fuentes(_renderizar), fuentes(RENDERIZADORES[nombre])])
+    return hashlib.md5(datos.encode()).hexdigest()
+
+
+def hash_insumo(nombre, insumo):
+    datos = json.dumps([VERSION, nombre, _huella_render(nombre), insumo], sort_keys=True, default=str)
+    return hashlib.md5(datos.encode()).hexdigest()
+
+
+def generar(df, salida='.', procesos=None, forzar=False, mapas=None, insumos=None):
+    """Genera los mapas pedidos (todos por defecto). Devuelve {mapa: 'generado'|'sin cambios'}.
+
+    insumos: resultado de capas(df) ya calculado (p.ej. desde la caché de pipeline.py).
+    """
+    salida = Path(salida)
+    salida.mkdir(parents=True, exist_ok=True)
+    ruta_manifiesto = salida / MANIFIESTO
+    manifiesto = json.loads(ruta_manifiesto.read_text()) if ruta_manifiesto.exists() else {}
+
+    if insumos is None:
+        insumos = capas(df)
+    tareas, estado = [], {}
+    for nombre, insumo in insumos.items():
+        if mapas and nombre not in mapas:
+            continue
+        h = hash_insumo(nombre, insumo)
+        if not forzar and manifiesto.get(nombre) == h and (salida / nombre).exists():
+            estado[nombre] = 'sin cambios'
+            continue
+        manifiesto[nombre] = h
+        tareas.append((nombre, insumo, salida / nombre))
+
+    if tareas:
+        procesos = procesos or min(len(tareas), os.cpu_count() or 1)
+        if procesos == 1:
+            hechos = list(map(_renderizar, tareas))
+        else:
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                hechos = list(pool.map(_renderizar, tareas))
+        for nombre, seg in hechos:
+            estado[nombre] = 'generado'
+            log.info(f"🗺️ {nombre} ({seg:.2f}s)")
+        ruta_manifiesto.write_text(json.dumps(manifiesto, indent=2, sort_keys=True))
+    return estado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera los mapas folium del EDA en lote.")
+    parser.add_argument('-i', '--entrada', default='citybike_lima.csv', help="CSV crudo o procesado, o historial.sqlite")
+    parser.add_argument('-o', '--salida', default='.', help="carpeta de salida de los .html")
+    parser.add_argument('-p', '--procesos', type=int, default=None, help="procesos (por defecto: núcleos)")
+    parser.add_argument('-m', '--mapa', action='append', choices=sorted(RENDERIZADORES),
+                        help="generar solo este mapa (repetible)")
+    parser.add_argument('--forzar', action='store_true', help="regenerar aunque el insumo no cambió")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('CITYBIKE_LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+
+    t0 = time.perf_counter()
+    df = cargar(args.entrada)
+    estado = generar(df, args.salida, args.procesos, args.forzar, args.mapa)
+    sin_cambios = sum(v == 'sin cambios' for v in estado.values())
+    log.info(f"✅ {len(estado) - sin_cambios} mapas generados, {sin_cambios} sin cambios "
+             f"({time.perf_counter() - t0:.1f}s, {len(df)} filas)")
+
+
+if __name__ == '__main__':
+    main()
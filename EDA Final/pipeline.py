@@ -0,0 +1,353 @@
+# ================================================
+# pipeline.py — Análisis del notebook como DAG con caché por contenido
+# ================================================
+# Uso:
+#   python pipeline.py                        # lee citybike_lima.csv, escribe aquí
+#   python pipeline.py -i otro.csv -o salida/ -p 4
+#   python pipeline.py --etapa pivot_hora_categoria --sin-mapas
+#
+# Cada etapa del notebook (limpieza -> station_summary -> categorías ->
+# pivots -> mapas -> transferencias) es una función pura de sus entradas.
+# La salida de cada etapa se guarda en disco con una clave = hash(hash del
+# CSV de entrada o de las etapas previas, parámetros, código de la función y
+# de las funciones/constantes de pipeline.py y mapas.py que usa):
+# al cambiar un parámetro solo se recalcula esa etapa y las que dependen de
+# ella. Las etapas independientes de un mismo nivel corren en paralelo.
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import mapas
+
+CACHE = '.cache_pipeline'
+VERSION = 1   # subir para invalidar toda la caché
+log = logging.getLogger('citybike.eda')
+DIAS_ORDEN = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
+PATRON_AVENIDA = r'(?i)((?:Av\.|Avenida|Ca\.|Calle|Malecón|Parque)\s+[A-Za-zÁÉÍÓÚáéíóúñÑ\s]+)'
+
+
+# ================================================
+# 1. Etapas (funciones puras: entradas -> salida)
+# ================================================
+
+def limpiar(ruta, excluir=("27042",)):
+    """Celdas 2–7 del notebook: renombres, tipos, timestamp, ocupación y exclusión de estaciones."""
+    df = pd.read_excel(ruta) if str(ruta).endswith(('.xlsx', '.xls')) else mapas.leer_tabla(ruta)
+    df = df.rename(columns={
+        **mapas.RENOMBRES,
+        "day_of_week": "dia_semana", "weather_main": "clima_general", "weather_desc": "clima_detalle",
+        "temp_C": "temp_c", "wind_speed": "vel_viento", "in_miraflores": "en_miraflores",
+    })
+    df = df.dropna(subset=["bicis_libres", "espacios_vacios", "capacidad"])
+    for c in ['bicis_libres', 'capacidad', 'espacios_vacios', 'temp_c', 'latitud', 'longitud']:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format='ISO8601')
+    df["hora"] = df["timestamp"].dt.hour
+    df["fecha"] = df["timestamp"].dt.date
+    df["dia_semana"] = df["dia_semana"].astype(str).str.strip()
+    if df["dia_semana"].nunique() <= 1:
+        # sin depender del locale del sistema (el notebook usaba es_ES)
+        df["dia_semana"] = pd.Categorical(df["timestamp"].dt.dayofweek.map(dict(enumerate(DIAS_ORDEN))),
+                                          categories=DIAS_ORDEN, ordered=True)
+
+    df['ocupacion'] = np.where(df['capacidad'] > 0, df['bicis_libres'] / df['capacidad'], np.nan)
+    df['ocupacion'] = df['ocupacion'].clip(0, 1)
+    df["espacios_vacios"] = (df["capacidad"] - df["bicis_libres"]).clip(lower=0)
+    df["id_estacion"] = df["id_estacion"].astype(str)
+    df["codigo_estacion"] = df["nombre_estacion"].astype(str).str.extract(r"(\d{5})")[0]
+    df = df[~df["codigo_estacion"].isin(list(excluir))]
+    return df.reset_index(drop=True)
+
+
+def resumen_estaciones(df):
+    """Celda 6: station_summary con hora pico (mayor ocupación media; empate -> hora menor)."""
+    g = df.groupby("id_estacion")
+    resumen = g.agg(
+        nombre_estacion=("nombre_estacion", "first"),
+        obs=("id_estacion", "count"),
+        bicis_promedio=("bicis_libres", "mean"),
+        capacidad_promedio=("capacidad", "mean"),
+        ocupacion_promedio=("ocupacion", "mean"),
+    )
+    resumen["pct_vacia"] = (df["bicis_libres"] == 0).groupby(df["id_estacion"]).mean() * 100
+    resumen["pct_llena"] = (df["espacios_vacios"] == 0).groupby(df["id_estacion"]).mean() * 100
+    medias = df.groupby(["id_estacion", "hora"])["ocupacion"].mean().reset_index()
+    pico = (medias.sort_values(["id_estacion", "ocupacion"], ascending=[True, False], kind='stable')
+                  .drop_duplicates("id_estacion").set_index("id_estacion")["hora"])
+    resumen["hora_pico"] = pico
+    cols = ["bicis_promedio", "capacidad_promedio", "ocupacion_promedio", "pct_vacia", "pct_llena"]
+    resumen[cols] = resumen[cols].round(2)
+    return resumen.reset_index().sort_values("ocupacion_promedio", ascending=False, kind='stable')
+
+
+def categorizar(df, resumen, bins=tuple(mapas.BINS), labels=tuple(mapas.LABELS)):
+    """Celdas 13 y 15: categoría instantánea y categoría por ocupación promedio de la estación.
+
+    Reemplaza el `if 'bins' not in globals()` del notebook: bins/labels son
+    parámetros explícitos de la etapa (y entran en su clave de caché).
+    """
+    bins, labels = list(bins), list(labels)
+    out = df[['id_estacion', 'nombre_estacion', 'timestamp', 'hora', 'ocupacion']].copy()
+    out['ocup_cat_fixed'] = pd.Categorical(pd.cut(out['ocupacion'], bins=bins, labels=labels, include_lowest=True),
+                                           categories=labels, ordered=True)
+    out['categoria_ocupacion'] = pd.cut(out['ocupacion'].fillna(0), bins=bins, labels=labels, include_lowest=True)
+    est = resumen[['id_estacion', 'ocupacion_promedio']].assign(
+        categoria_ocupacion_promedio=pd.cut(resumen['ocupacion_promedio'].fillna(0), bins=bins, labels=labels,
+                                            include_lowest=True))
+    return out.merge(est, on='id_estacion', how='left', validate='many_to_one')
+
+
+def pivot_hora_categoria(categorias):
+    """Celda 14: ocupación media por hora y categoría fija (24 horas, interpoladas)."""
+    agg = (categorias.dropna(subset=['ocup_cat_fixed', 'ocupacion'])
+                     .groupby(['ocup_cat_fixed', 'hora'], observed=True)['ocupacion'].mean()
+                     .reset_index())
+    pivot = agg.pivot(index='hora', columns='ocup_cat_fixed', values='ocupacion')
+    pivot = pivot.reindex(range(24)).interpolate(method='linear')
+    pivot.index.name, pivot.columns.name = 'hora', None
+    pivot.columns = pivot.columns.astype(str)
+    return pivot
+
+
+def pivot_hora_dia(df):
+    """Celda 10: heatmap hora x día de semana."""
+    return df.pivot_table(index="hora", columns="dia_semana", values="ocupacion", aggfunc="mean", observed=True)
+
+
+def series_temporales(df):
+    """Celda 8: bicis libres promedio por hora y total por día."""
+    return {
+        'bikes_por_hora': df.groupby("hora")["bicis_libres"].mean(),
+        'bikes_por_dia': df.groupby("fecha")["bicis_libres"].sum(),
+    }
+
+
+def estadisticas_avenida(df, min_obs=40):
+    """Celda 22: ocupación media por avenida (estaciones con >= min_obs observaciones)."""
+    obs = df.groupby('id_estacion')['ocupacion'].count()
+    filtrado = df[df['id_estacion'].isin(obs[obs >= min_obs].index)]
+    avenida = filtrado['nombre_estacion'].str.extract(PATRON_AVENIDA)[0].str.strip()
+    filtrado = filtrado.assign(avenida=avenida).dropna(subset=['avenida'])
+    return {
+        'avenida_stats': (filtrado.groupby('avenida')['ocupacion'].mean().sort_values()
+                                  .reset_index().rename(columns={'ocupacion': 'ocupacion_promedio'})),
+        'pivot_hora': filtrado.pivot_table(index='avenida', columns='hora', values='ocupacion',
+                                           aggfunc='mean').dropna(how='all'),
+    }
+
+
+def snapshot_reciente(df):
+    """Celda 27: última lectura de cada estación en el timestamp más reciente."""
+    snap = df[df['timestamp'] == df['timestamp'].max()].groupby('id_estacion').tail(1)
+    snap = snap.dropna(subset=['latitud', 'longitud']).copy()
+    for c in ['bicis_libres', 'capacidad', 'ocupacion']:
+        snap[c] = pd.to_numeric(snap[c], errors='coerce').fillna(0)
+    return snap.reset_index(drop=True)
+
+
+def transferencias(snapshot):
+    """Celda 27: transfers_sugeridos (greedy de mapas.py)."""
+    return mapas.tabla_transferencias(snapshot)
+
+
+def insumos_mapas(df):
+    """Celdas 23–30: puntos y parámetros de cada mapa (mapas.capas)."""
+    return mapas.capas(df.dropna(subset=['latitud', 'longitud']))
+
+
+# ================================================
+# 2. DAG: etapa -> (función, dependencias, parámetros)
+# ================================================
+# 'entrada' es el archivo crudo; su hash es el de su contenido.
+
+ETAPAS = {
+    'limpio': (limpiar, ['entrada'], {'excluir': ["27042"]}),
+    'resumen': (resumen_estaciones, ['limpio'], {}),
+    'categorias': (categorizar, ['limpio', 'resumen'], {'bins': mapas.BINS, 'labels': mapas.LABELS}),
+    'pivot_hora_categoria': (pivot_hora_categoria, ['categorias'], {}),
+    'pivot_hora_dia': (pivot_hora_dia, ['limpio'], {}),
+    'series': (series_temporales, ['limpio'], {}),
+    'avenidas': (estadisticas_avenida, ['limpio'], {'min_obs': 40}),
+    'snapshot': (snapshot_reciente, ['limpio'], {}),
+    'transferencias': (transferencias, ['snapshot'], {}),
+    'mapas': (insumos_mapas, ['limpio'], {}),
+}
+
+# Salidas del notebook: etapa -> (archivo, cómo escribirla)
+EXPORTAR = {
+    'pivot_hora_categoria': ('pivot_hour_mean_ocup.csv', lambda r, p: r.to_csv(p, index=True)),
+    'transferencias': ('transfers_sugeridos.csv',
+                       lambda r, p: r.drop(columns=['from_lat', 'from_lon', 'to_lat', 'to_lon'])
+                                     .to_csv(p, index=False)),
+}
+
+
+def hash_archivo(ruta, bloque=1 << 20):
+    h = hashlib.md5()
+    with open(ruta, 'rb') as f:
+        for parte in iter(lambda: f.read(bloque), b''):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def _niveles(objetivos):
+    """Etapas necesarias para los objetivos, agrupadas por profundidad en el DAG."""
+    profundidad = {}
+
+    def _visitar(nombre):
+        if nombre == 'entrada':
+            return -1
+        if nombre not in profundidad:
+            profundidad[nombre] = 1 + max(_visitar(d) for d in ETAPAS[nombre][1])
+        return profundidad[nombre]
+
+    for nombre in objetivos:
+        _visitar(nombre)
+    niveles = [[] for _ in range(max(profundidad.values()) + 1)] if profundidad else []
+    for nombre, p in profundidad.items():
+        niveles[p].append(nombre)
+    return niveles
+
+
+def claves(hash_entrada, params=None):
+    """Clave de caché de cada etapa: hash(versión, nombre, parámetros, código, claves de dependencias).
+
+    El código incluye el de los ayudantes de mapas.py que llama la etapa
+    (leer_tabla, tabla_transferencias, capas, ...): cambiarlos invalida la caché.
+    """
+    params = params or {}
+    out = {'entrada': hash_entrada}
+    for nivel in _niveles(ETAPAS):
+        for nombre in nivel:
+            fn, deps, defecto = ETAPAS[nombre]
+            p = {**defecto, **params.get(nombre, {})}
+            datos = json.dumps([VERSION, nombre, p, mapas.fuentes(fn, (mapas,)), [out[d] for d in deps]],
+                               sort_keys=True, default=str)
+            out[nombre] = hashlib.md5(datos.encode()).hexdigest()
+    return out
+
+
+# ================================================
+# 3. Ejecución con caché en disco
+# ================================================
+
+def _ruta_cache(cache, nombre, clave):
+    return Path(cache) / f'{nombre}-{clave[:16]}.pkl'
+
+
+def _ejecutar(args):
+    """Corre una etapa leyendo sus dependencias de la caché (en el pool o en línea)."""
+    nombre, entradas, params, destino = args
+    fn = ETAPAS[nombre][0]
+    t0 = time.perf_counter()
+    valores = [pd.read_pickle(ruta) if en_cache else ruta for en_cache, ruta in entradas]
+    resultado = fn(*valores, **params)
+    tmp = Path(str(destino) + '.tmp')
+    pd.to_pickle(resultado, tmp)
+    os.replace(tmp, destino)
+    return nombre, time.perf_counter() - t0
+
+
+def ejecutar(entrada, objetivos=None, params=None, cache=CACHE, procesos=None, forzar=False, podar=False):
+    """Calcula las etapas pedidas (todas por defecto) reutilizando la caché.
+
+    params: {etapa: {parámetro: valor}} para sobrescribir los del DAG.
+    podar: borra de la caché las salidas que ya no corresponden a ninguna clave vigente.
+    Devuelve (resultados {etapa: salida}, estado {etapa: 'calculado'|'en caché'}).
+    """
+    params = params or {}
+    objetivos = list(objetivos or ETAPAS)
+    cache = Path(cache)
+    cache.mkdir(parents=True, exist_ok=True)
+
+    clave = claves(hash_archivo(entrada), params)
+    estado = {}
+    for nivel in _niveles(objetivos):
+        tareas = []
+        for nombre in nivel:
+            ruta = _ruta_cache(cache, nombre, clave[nombre])
+            if ruta.exists() and not forzar:
+                estado[nombre] = 'en caché'
+                continue
+            fn, deps, defecto = ETAPAS[nombre]
+            entradas = [(False, str(entrada)) if d == 'entrada' else (True, _ruta_cache(cache, d, clave[d]))
+                        for d in deps]
+            tareas.append((nombre, entradas, {**defecto, **params.get(nombre, {})}, ruta))
+
+        n = min(len(tareas), procesos or os.cpu_count() or 1)
+        if n > 1:
+            with ProcessPoolExecutor(max_workers=n) as pool:
+                hechos = list(pool.map(_ejecutar, tareas))
+        else:
+            hechos = map(_ejecutar, tareas)
+        for nombre, seg in hechos:
+            estado[nombre] = 'calculado'
+            log.info(f"⚙️ {nombre} ({seg:.2f}s)")
+
+    if podar:
+        _podar(cache, clave)
+    resultados = {n: pd.read_pickle(_ruta_cache(cache, n, clave[n])) for n in objetivos}
+    return resultados, estado
+
+
+def _podar(cache, clave):
+    """Borra salidas de claves que ya no son vigentes (parámetros o datos anteriores)."""
+    vigentes = {_ruta_cache(cache, n, c).name for n, c in clave.items() if n != 'entrada'}
+    borrados = 0
+    for p in Path(cache).glob('*.pkl'):
+        if p.name not in vigentes:
+            p.unlink()
+            borrados += 1
+    return borrados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ejecuta el análisis del notebook con caché por etapa.")
+    parser.add_argument('-i', '--entrada', default='citybike_lima.csv', help="CSV (o XLSX) crudo, o historial.sqlite")
+    parser.add_argument('-o', '--salida', default='.', help="carpeta de los CSV y mapas exportados")
+    parser.add_argument('-p', '--procesos', type=int, default=None, help="procesos (por defecto: núcleos)")
+    parser.add_argument('-e', '--etapa', action='append', choices=sorted(ETAPAS),
+                        help="calcular solo esta etapa y sus dependencias (repetible)")
+    parser.add_argument('--min-obs', type=int, default=None, help="mínimo de observaciones por avenida")
+    parser.add_argument('--cache', default=CACHE, help="carpeta de la caché")
+    parser.add_argument('--forzar', action='store_true', help="recalcular aunque haya caché")
+    parser.add_argument('--podar', action='store_true', help="borrar salidas en caché ya no vigentes")
+    parser.add_argument('--sin-mapas', action='store_true', help="no renderizar los .html")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('CITYBIKE_LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+
+    params = {'avenidas': {'min_obs': args.min_obs}} if args.min_obs is not None else {}
+    objetivos = args.etapa or list(ETAPAS)
+    if args.sin_mapas and not args.etapa:
+        objetivos.remove('mapas')
+
+    t0 = time.perf_counter()
+    resultados, estado = ejecutar(args.entrada, objetivos, params, args.cache, args.procesos,
+                                  args.forzar, args.podar)
+
+    salida = Path(args.salida)
+    salida.mkdir(parents=True, exist_ok=True)
+    for nombre, (archivo, escribir) in EXPORTAR.items():
+        if nombre in resultados:
+            escribir(resultados[nombre], salida / archivo)
+            log.info(f"💾 {salida / archivo}")
+    if 'mapas' in resultados and not args.sin_mapas:
+        mapas.generar(None, salida, args.procesos, insumos=resultados['mapas'])
+
+    calculadas = sum(v == 'calculado' for v in estado.values())
+    log.info(f"✅ {calculadas} etapas calculadas, {len(estado) - calculadas} en caché "
+             f"({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,24 +5,29 @@ from prueba_5 import collect_snapshot
 # Carpeta de salida
 os.makedirs("data", exist_ok=True)
 
-EXCEL_PATH = "data/citybike_lima.xlsx"
+EXCEL_PATH = "data/citybike_lima.xlsx"   # histórico anterior (solo lectura, ver abajo)
 CSV_PATH = "data/citybike_lima.csv"
 
 # 1. Capturar snapshot
 rows = collect_snapshot(owm_key=os.getenv("OWM_API_KEY"))
 
-# 2. Guardar/actualizar Excel y CSV
+# 2. Agregar al CSV (sin reescribir el histórico). El Excel ya no se
+#    regenera en cada corrida: se exporta bajo pedido desde el backend
+#    (python excel_export.py o GET /api/export).
 if rows:
     df_new = pd.DataFrame(rows)
 
-    if os.path.exists(EXCEL_PATH):
-        df_old = pd.read_excel(EXCEL_PATH)
-        df = pd.concat([df_old, df_new], ignore_index=True)
-    else:
-        df = df_new
+    if not os.path.exists(CSV_PATH) and os.path.exists(EXCEL_PATH):
+        # una sola vez: el CSV arranca con lo que había en el Excel
+        pd.read_excel(EXCEL_PATH).to_csv(CSV_PATH, index=False, encoding="utf-8")
 
-    df.to_excel(EXCEL_PATH, index=False)
-    df.to_csv(CSV_PATH, index=False, encoding="utf-8")
+    if os.path.exists(CSV_PATH):
+        # mismas columnas y orden que el encabezado existente
+        columnas = pd.read_csv(CSV_PATH, nrows=0).columns
+        df_new = df_new.reindex(columns=columnas)
+        df_new.to_csv(CSV_PATH, mode="a", header=False, index=False, encoding="utf-8")
+    else:
+        df_new.to_csv(CSV_PATH, index=False, encoding="utf-8")
 
     print(f"✅ Datos agregados: {len(rows)} filas nuevas.")
 else:
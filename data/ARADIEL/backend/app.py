@@ -2,14 +2,28 @@
 # app.py — Backend principal del proyecto CityBike Lima
 # ============================================================
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_file, send_from_directory
 from flask_cors import CORS
 import mysql.connector 
 from models import init_db, check_user
 from scraper import collect_snapshot, append_to_csv
-from data_utils import load_full_history, station_average_occupancy, DATA_DIR
+from data_utils import load_full_history, latest_readings, DATA_DIR, PROCESSED_DIR
+from data_utils import load_station_state, load_cube, load_distributions, ingest_snapshot, rebuild_aggregates
+from data_utils import load_station_dim, load_forecast, load_station_health, load_flows, stations_at
+from data_utils import compact_retention, load_series, retention_summary, load_history_store, history_summary
+from data_utils import HISTORY_DB, compacted_dates, station_metadata, station_state_arrays
+from excel_export import exportar as exportar_excel, nombre_archivo as nombre_excel
+from flows import perfil_hora_flujos, resumen_flujos
+from geofence import geocerca_actual, perfil_hora_por_zona, resumen_por_zona
+from station_health import ESTANCADA_H, OFFLINE_H, TOLERANCIA_DOCKS, ABIERTO
 from pathlib import Path
 from data_processor import procesar_citybike_csv
+from heatmap_tiles import get_heatmap
+from metrics import exponer, llamada_externa, log, peticion
+import os
+import tempfile
+import time
+import numpy as np
 import pandas as pd
 import requests
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -23,6 +37,24 @@ CORS(app)
 
 DATA_DIR = Path(DATA_DIR)
 LIVE_CSV = DATA_DIR / 'citybike_live.csv'
+# Servidor OSRM y frecuencia del snapshot automático (configurables para pruebas de carga)
+OSRM_URL = os.environ.get('CITYBIKE_OSRM_URL', "http://router.project-osrm.org").rstrip('/')
+SNAPSHOT_MINUTOS = float(os.environ.get('CITYBIKE_SNAPSHOT_MIN', 5))
+
+
+@app.before_request
+def _iniciar_medicion():
+    g.t0 = time.perf_counter()
+    g.inicio = time.time()
+
+
+@app.after_request
+def _registrar_peticion(respuesta):
+    """Latencia por endpoint (la regla de la ruta, no la URL, para acotar etiquetas)."""
+    if 't0' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        peticion(endpoint, request.method, respuesta.status_code, time.perf_counter() - g.t0, g.inicio)
+    return respuesta
 
 # ============================================================
 # 🔗 Conexión a MySQL
@@ -118,13 +150,16 @@ def login_page():
 
 @app.route('/api/snapshot', methods=['POST'])
 def api_snapshot():
-    """Ejecuta scraping de CityBike y guarda en CSV"""
+    """Ejecuta scraping de CityBike y guarda en CSV.
+
+    No reprocesa el histórico: load_full_history ya lee el CSV en vivo junto
+    al Parquet y ingest_snapshot mantiene los agregados al día. Reescribir
+    PROCESSED_DIR con solo el CSV en vivo borraría el histórico procesado
+    (y devolvería al crudo fechas ya compactadas por la retención).
+    """
     rows = collect_snapshot()
     append_to_csv(rows, str(LIVE_CSV))
-    # Procesar historico actualizado
-    input_file = str(LIVE_CSV)
-    output_file = str(DATA_DIR / 'citybike_procesado.csv')
-    procesar_citybike_csv(input_file, output_file)
+    ingest_snapshot(rows)
     return jsonify({'saved': len(rows)})
 
 
@@ -134,43 +169,23 @@ def api_snapshot():
 
 @app.route('/api/stations', methods=['GET'])
 def api_stations():
-    print("🔍 Cargando histórico desde Excel y generando lista de estaciones...")
+    """Última lectura de cada estación + ocupación promedio.
+
+    ?at=<timestamp> devuelve la red en ese instante (última lectura <= at y
+    promedio hasta at); ?max_age=<minutos> descarta lecturas más viejas
+    (por defecto las horas de OFFLINE_H).
+    """
+    if request.args.get('at'):
+        return _stations_at(request.args['at'], request.args.get('max_age'))
 
-    df = load_full_history()
+    # Última lectura por estación desde el almacén SQL (no lee el histórico completo)
+    df = latest_readings()
     if df.empty:
-        print("⚠️ Dataset vacío, no se pueden generar estaciones.")
+        log.warning("⚠️ Dataset vacío, no se pueden generar estaciones.")
         return jsonify([])
 
-    # Asegurar nombres coherentes
-    rename_map = {
-        "scrape_timestamp": "scrape_timestamp",
-        "station_id": "station_id",
-        "station_name": "station_name",
-        "lat": "lat",
-        "lon": "lon",
-        "capacity": "capacity",
-        "free_bikes": "free_bikes",
-        "empty_slots": "empty_slots"
-    }
-    df = df.rename(columns=rename_map)
-
-    # Forzar tipos numéricos
-    for col in ['lat', 'lon', 'capacity', 'free_bikes', 'empty_slots']:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # Verificar existencia de columna de tiempo
-    if 'scrape_timestamp' not in df.columns:
-        print("⚠️ No se encontró 'scrape_timestamp', se usará un timestamp simulado.")
-        df['scrape_timestamp'] = pd.Timestamp.now()
-
-    # Calcular promedios de ocupación por estación
-    averages = station_average_occupancy(df)
-
-    # Quitar duplicados y ordenar
-    df = df.sort_values('scrape_timestamp').drop_duplicates('station_id', keep='last')
+    averages = df.set_index('station_id')['avg_occupancy'].fillna(0).to_dict()
     df = df.dropna(subset=['lat', 'lon'])
-    df['station_id'] = df['station_id'].astype(str)
 
     # Crear lista de estaciones con ocupación promedio real
     stations = []
@@ -194,23 +209,120 @@ def api_stations():
         }
         stations.append(station)
 
-    print(f"✅ Estaciones procesadas: {len(stations)} con ocupación promedio calculada.")
+    log.debug(f"✅ Estaciones procesadas: {len(stations)} con ocupación promedio calculada.")
     return jsonify(stations)
 
 
+def _stations_at(at, max_age=None):
+    """Modo ?at= de /api/stations (índice as-of, sin leer el histórico completo)."""
+    try:
+        antiguedad = pd.Timedelta(minutes=float(max_age)) if max_age else pd.Timedelta(hours=OFFLINE_H)
+        df = stations_at(at, max_antiguedad=antiguedad)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro inválido: {e}"}), 400
+    df = df.dropna(subset=['latitud', 'longitud'])
+    nulo = lambda v: None if pd.isna(v) else float(v)
+    return jsonify([{
+        'station_id': r.id_estacion,
+        'station_name': r.nombre_estacion,
+        'lat': float(r.latitud),
+        'lon': float(r.longitud),
+        'free_bikes': nulo(r.bicis_libres),
+        'empty_slots': nulo(r.espacios_vacios),
+        'capacity': nulo(r.capacidad),
+        'avg_occupancy': 0 if pd.isna(r.ocupacion_promedio) else float(r.ocupacion_promedio),
+        'scrape_timestamp': r.timestamp.isoformat(),
+    } for r in df.itertuples(index=False)])
+
+
+# ============================================================
+# 5.1 Endpoints: estaciones en dos partes (metadatos + estado)
+# ============================================================
+# /api/stations/meta cambia solo cuando aparece una estación: se versiona
+# y se cachea. /api/stations/state trae únicamente lo que cambia, como
+# arrays paralelos en el orden de meta (JSON o binario).
+
+CACHE_META_S = 365 * 24 * 3600
+SIN_DATO_I16 = -1        # binario: bicis/espacios sin lectura
+SIN_DATO_U16 = 0xFFFF    # binario: ocupación sin dato (escala 1/10000)
+
+
+@app.route('/api/stations/meta', methods=['GET'])
+def api_stations_meta():
+    """Nombre, coordenadas y capacidad de cada estación (arrays paralelos, índice = posición).
+
+    ETag = versión. Con ?v=<versión> vigente la respuesta es inmutable y
+    se cachea un año; sin ?v se revalida con If-None-Match (304).
+    """
+    version, tabla = station_metadata()
+    if request.if_none_match.contains(version):
+        respuesta = Response(status=304)
+    else:
+        nulo = lambda s, nd=None: [None if pd.isna(v) else (round(float(v), nd) if nd else int(v)) for v in s]
+        respuesta = jsonify({
+            'version': version,
+            'station_id': tabla['id_estacion'].astype(str).tolist(),
+            'station_name': tabla['nombre_estacion'].fillna('').astype(str).tolist(),
+            'lat': nulo(tabla['latitud'], 6),
+            'lon': nulo(tabla['longitud'], 6),
+            'capacity': nulo(tabla['capacidad']),
+        })
+    respuesta.set_etag(version)
+    respuesta.cache_control.public = True
+    if request.args.get('v') == version:
+        respuesta.cache_control.max_age = CACHE_META_S
+        respuesta.cache_control.immutable = True
+    else:
+        respuesta.cache_control.no_cache = True
+    return respuesta
+
+
+@app.route('/api/stations/state', methods=['GET'])
+def api_stations_state():
+    """free_bikes, empty_slots y avg_occupancy en el orden de /api/stations/meta.
+
+    ?format=json (defecto): {"version", "free_bikes", "empty_slots", "avg_occupancy"}
+    con null donde no hay lectura.
+    ?format=bin: int16 free_bikes[n] + int16 empty_slots[n] + uint16
+    avg_occupancy[n] (x10000), little-endian, sin dato = -1 / 0xFFFF; la
+    versión va en la cabecera X-Stations-Version.
+    """
+    version, arrays = station_state_arrays()
+    formato = request.args.get('format', 'json')
+    if formato == 'bin':
+        cuerpo = b''.join([
+            np.where(np.isnan(arrays['free_bikes']), SIN_DATO_I16, arrays['free_bikes']).astype('<i2').tobytes(),
+            np.where(np.isnan(arrays['empty_slots']), SIN_DATO_I16, arrays['empty_slots']).astype('<i2').tobytes(),
+            np.where(np.isnan(arrays['avg_occupancy']), SIN_DATO_U16,
+                     np.round(np.clip(arrays['avg_occupancy'], 0, 1) * 10000)).astype('<u2').tobytes(),
+        ])
+        respuesta = Response(cuerpo, mimetype='application/octet-stream')
+    elif formato == 'json':
+        entero = lambda a: [None if np.isnan(v) else int(v) for v in a]
+        respuesta = jsonify({
+            'version': version,
+            'free_bikes': entero(arrays['free_bikes']),
+            'empty_slots': entero(arrays['empty_slots']),
+            'avg_occupancy': [None if np.isnan(v) else round(float(v), 3) for v in arrays['avg_occupancy']],
+        })
+    else:
+        return jsonify({"error": "format debe ser json o bin"}), 400
+    respuesta.headers['X-Stations-Version'] = version
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+
 # ============================================================
 # 6. Endpoint: Recomendaciones de redistribución
 # ============================================================
 @app.route('/api/redistribution', methods=['GET'])
 def api_redistribution():
     """Detecta estaciones con pocas bicicletas y sugiere posibles donantes"""
-    df = load_full_history()
+    # Última captura por estación (almacén SQL)
+    df = latest_readings()
     if df.empty:
         return jsonify({"error": "No hay datos disponibles"}), 400
 
-    # Usar última captura por estación
-    df = df.sort_values('scrape_timestamp').drop_duplicates('station_id', keep='last')
-
     # Filtrar columnas necesarias
     df = df[['station_id', 'station_name', 'lat', 'lon', 'free_bikes', 'capacity']].copy()
     df['free_bikes'] = pd.to_numeric(df['free_bikes'], errors='coerce')
@@ -248,10 +360,11 @@ def api_redistribution():
         donor_routes = []
         for _, donor in best_donors.iterrows():
             coords = f"{donor['lon']},{donor['lat']};{low['lon']},{low['lat']}"
-            url = f"http://router.project-osrm.org/route/v1/driving/{coords}?overview=full&geometries=geojson"
+            url = f"{OSRM_URL}/route/v1/driving/{coords}?overview=full&geometries=geojson"
             try:
-                r = requests.get(url, timeout=10)
-                route = r.json()['routes'][0]
+                with llamada_externa('osrm'):
+                    r = requests.get(url, timeout=10)
+                    route = r.json()['routes'][0]
                 donor_routes.append({
                     "donor_id": donor['station_id'],
                     "donor_name": donor['station_name'],
@@ -277,13 +390,17 @@ from pathlib import Path
 
 @app.route('/api/process_history', methods=['POST'])
 def api_process_history():
-    """Procesa el archivo histórico CSV y genera citybike_procesado.csv"""
-    data_dir = Path(__file__).parent / "data"
+    """Procesa el archivo histórico CSV y genera el dataset procesado (Parquet por fecha)"""
+    data_dir = DATA_DIR
     input_file = data_dir / "citybike_lima(5).csv"
-    output_file = data_dir / "citybike_procesado.csv"
+    # ?csv=1 también exporta citybike_procesado.csv
+    output_file = data_dir / "citybike_procesado.csv" if request.args.get('csv') else None
+    # ?procesos=N reparte el resumen por estación en N procesos (por defecto CITYBIKE_PROCESOS)
+    procesos = request.args.get('procesos', type=int)
 
     try:
-        df = procesar_citybike_csv(input_file, output_file)
+        df = procesar_citybike_csv(input_file, output_file, salida_columnar=PROCESSED_DIR, procesos=procesos)
+        rebuild_aggregates()
         return {"success": True, "rows": len(df)}, 200
     except Exception as e:
         return {"success": False, "error": str(e)}, 500
@@ -294,15 +411,353 @@ def api_process_history():
 
 @app.route('/api/history', methods=['GET'])
 def api_history():
-    """Devuelve toda la base de datos histórica procesada"""
-    processed_file = DATA_DIR / 'citybike_procesado.csv'
-    if not processed_file.exists():
-        return jsonify({"error": "No existe el archivo procesado"}), 404
-
-    df = pd.read_csv(processed_file)
+    """Devuelve el histórico (procesado + en vivo) desde el almacén SQL.
+
+    Filtros opcionales (WHERE sobre la clave (estación, timestamp) del almacén):
+    ?station=<id>[,<id>...]&from=<ts>&to=<ts>&columns=<col>[,<col>...]
+    ?exclude_flagged=1 quita las lecturas marcadas por el detector de salud.
+    Las fechas que la retención ya compactó salen una fila por cubeta de 15 min
+    o 1 h (promedios), con 'obs' y 'resolucion'.
+    """
+    def _lista(nombre):
+        valor = request.args.get(nombre)
+        return [v.strip() for v in valor.split(',') if v.strip()] if valor else None
+
+    load_history_store()   # lo construye desde el procesado la primera vez
+    try:
+        df = load_full_history(columnas=_lista('columns'), estaciones=_lista('station'),
+                               desde=request.args.get('from'), hasta=request.args.get('to'),
+                               excluir_marcadas=request.args.get('exclude_flagged') in ('1', 'true'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # timestamps como texto ISO (como en el CSV)
+    if 'timestamp' in df.columns:
+        df['timestamp'] = df['timestamp'].astype(str)
     return jsonify(df.to_dict(orient='records'))
 
 
+# ============================================================
+# 7.1 Endpoint: Resumen por estación (estado incremental)
+# ============================================================
+
+@app.route('/api/summary', methods=['GET'])
+def api_summary():
+    """station_summary al día sin recalcular el histórico.
+
+    ?station=<id> devuelve además el perfil 7x24 (día x hora) de ocupación.
+    ?from=<ts>&to=<ts> resume solo ese rango (GROUP BY en el almacén SQL,
+    con todas las lecturas, también las marcadas por el detector; las fechas
+    ya compactadas por la retención se suman desde los rollups).
+    """
+    if request.args.get('from') or request.args.get('to'):
+        return _summary_rango(request.args.get('station'), request.args.get('from'), request.args.get('to'))
+
+    estado = load_station_state()
+    resumen = estado.resumen()
+    resumen['categoria_ocupacion_promedio'] = resumen['categoria_ocupacion_promedio'].astype(str)
+    resumen = resumen.astype(object).where(resumen.notna(), None)
+
+    station = request.args.get('station')
+    if station is None:
+        return jsonify(resumen.to_dict(orient='records'))
+
+    fila = resumen[resumen['id_estacion'] == station]
+    if fila.empty:
+        return jsonify({"error": f"Estación no encontrada: {station}"}), 404
+    perfil = estado.perfil(station).round(4)
+    return jsonify({
+        **fila.iloc[0].to_dict(),
+        'perfil_dia_hora': [[None if pd.isna(v) else float(v) for v in dia] for dia in perfil],
+    })
+
+
+def _summary_rango(station, desde, hasta):
+    """Modo ?from=&to= de /api/summary."""
+    try:
+        resumen = history_summary([station] if station else None, desde, hasta)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro inválido: {e}"}), 400
+    resumen['categoria_ocupacion_promedio'] = resumen['categoria_ocupacion_promedio'].astype(str)
+    resumen = resumen.astype(object).where(resumen.notna(), None)
+    if station is None:
+        return jsonify(resumen.to_dict(orient='records'))
+    if resumen.empty:
+        return jsonify({"error": f"Estación sin lecturas en el rango: {station}"}), 404
+    return jsonify(resumen.iloc[0].to_dict())
+
+
+# ============================================================
+# 7.2 Endpoint: Análisis por hora/día/periodo/categoría (cubo)
+# ============================================================
+
+@app.route('/api/rollup', methods=['GET'])
+def api_rollup():
+    """Agrega el cubo (estación, fecha, hora, categoría).
+
+    ?by=hora,dia_semana&metric=ocupacion|bicis_libres&measure=mean|sum|count|min|max|pct_vacia|pct_llena|obs
+    &station=<id>[,<id>...]&from=AAAA-MM-DD&to=AAAA-MM-DD
+    """
+    by = [d for d in request.args.get('by', 'hora').split(',') if d]
+    station = request.args.get('station')
+    try:
+        r = load_cube().rollup(
+            por=by,
+            metrica=request.args.get('metric', 'ocupacion'),
+            medida=request.args.get('measure', 'mean'),
+            estaciones=station.split(',') if station else None,
+            desde=request.args.get('from'),
+            hasta=request.args.get('to'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    r['valor'] = r['valor'].astype(float).round(4)
+    r = r.astype(object).where(r.notna(), None)
+    return jsonify({'by': by, 'fields': list(r.columns), 'rows': r.values.tolist()})
+
+
+# ============================================================
+# 7.3 Endpoint: Distribuciones (percentiles, boxplot, histograma)
+# ============================================================
+
+@app.route('/api/distribution', methods=['GET'])
+def api_distribution():
+    """Distribución de ocupación o bicis libres desde los histogramas incrementales.
+
+    ?metric=ocupacion|bicis_libres&station=<id>[,<id>...]&hour=<0-23>|weekday=<0-6>
+    &q=0.05,0.5,0.95
+    """
+    station = request.args.get('station')
+    try:
+        qs = [float(q) for q in request.args.get('q', '0.05,0.25,0.5,0.75,0.95').split(',')]
+        hora = request.args.get('hour', type=int)
+        dia = request.args.get('weekday', type=int)
+        if any(not 0 <= q <= 1 for q in qs) or (hora is not None and not 0 <= hora < 24) \
+                or (dia is not None and not 0 <= dia < 7):
+            raise ValueError("q en [0, 1], hour en 0-23, weekday en 0-6")
+        r = load_distributions().distribucion(
+            request.args.get('metric', 'ocupacion'), qs,
+            estaciones=station.split(',') if station else None, hora=hora, dia_semana=dia)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(r)
+
+
+# ============================================================
+# 7.4 Endpoint: Agregados por zona (geocercas)
+# ============================================================
+
+@app.route('/api/zones', methods=['GET'])
+def api_zones():
+    """Resumen por zona/distrito (zona de cada estación en la dimensión).
+
+    ?hourly=1 agrega el perfil de ocupación por hora de cada zona.
+    ?zone=<nombre> filtra una zona.
+    """
+    estado = load_station_state()
+    zonas = load_station_dim().zonas()
+    r = resumen_por_zona(estado.escalares, zonas)
+    zona = request.args.get('zone')
+    if zona is not None:
+        r = r[r['zona'].str.lower() == zona.lower()]
+        if r.empty:
+            return jsonify({"error": f"Zona no encontrada: {zona}"}), 404
+
+    cols = ['bicis_promedio', 'ocupacion_promedio', 'pct_vacia', 'pct_llena']
+    r[cols] = r[cols].astype(float).round(4)
+    filas = r.astype(object).where(r.notna(), None).to_dict(orient='records')
+    if request.args.get('hourly') in ('1', 'true'):
+        perfil = perfil_hora_por_zona(estado.hist_sum, estado.hist_n, estado.escalares.index, zonas).round(4)
+        for f in filas:
+            f['perfil_hora'] = [None if pd.isna(v) else float(v) for v in perfil.loc[f['zona']]]
+
+    geocerca = geocerca_actual()
+    return jsonify({'source': geocerca.origen, 'zones_defined': geocerca.nombres(), 'zones': filas})
+
+
+# ============================================================
+# 7.5 Endpoint: Pronóstico de ocupación a 1–3 horas
+# ============================================================
+
+@app.route('/api/forecast', methods=['GET'])
+def api_forecast():
+    """Ocupación y bicis esperadas por estación (arrays paralelos, fila = estación).
+
+    ?horizon=1,2,3 (horas), ?station=<id>,<id>, ?at=<timestamp> (por defecto
+    la última lectura) y ?threshold=<bicis> para marcar riesgo de vaciarse.
+    """
+    try:
+        horizontes = [float(h) for h in request.args.get('horizon', '1,2,3').split(',') if h.strip()]
+        umbral = float(request.args.get('threshold', 1))
+        ahora = pd.Timestamp(request.args['at']) if request.args.get('at') else None
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro inválido: {e}"}), 400
+    if not horizontes or any(h <= 0 or h > 24 for h in horizontes):
+        return jsonify({"error": "horizon debe estar entre 0 y 24 horas"}), 400
+    estaciones = request.args.get('station')
+    estaciones = [e.strip() for e in estaciones.split(',') if e.strip()] if estaciones else None
+
+    modelo = load_forecast()
+    r = modelo.pronosticar(horizontes, ahora=ahora, estaciones=estaciones, umbral_bicis=umbral)
+    if estaciones and not r['ids']:
+        return jsonify({"error": "Estación sin datos"}), 404
+    a_lista = lambda m: [[None if pd.isna(v) else round(float(v), 4) for v in fila] for fila in m]
+    return jsonify({
+        'reference': pd.Timestamp(r['referencia_ns']).isoformat() if r['ids'] else None,
+        'horizons': r['horizontes'],
+        'phi': float(modelo.phi_global),
+        'seasonal_weight': float(modelo.amplitud),
+        'ids': r['ids'],
+        'occupancy': a_lista(r['ocupacion']),
+        'bikes': a_lista(r['bicis']),
+        'empty_risk': r['se_vacia'].tolist(),
+    })
+
+
+# ============================================================
+# 7.6 Endpoint: Estaciones trabadas / rotas (detector en la ingesta)
+# ============================================================
+
+@app.route('/api/station_health', methods=['GET'])
+def api_station_health():
+    """Marcas abiertas por estación (estancada, inconsistente, offline).
+
+    ?flagged=1 solo las marcadas; ?station=<id>[,<id>...] filtra;
+    ?intervals=1 agrega el historial de intervalos marcados.
+    """
+    salud = load_station_health()
+    estado = salud.estado_actual()
+    estaciones = request.args.get('station')
+    if estaciones:
+        estado = estado[estado['id_estacion'].isin([e.strip() for e in estaciones.split(',')])]
+        if estado.empty:
+            return jsonify({"error": f"Estación no encontrada: {estaciones}"}), 404
+    if request.args.get('flagged') in ('1', 'true'):
+        estado = estado[estado['marcas'].str.len() > 0]
+
+    iso = lambda serie: [None if pd.isna(v) else v.isoformat() for v in serie]
+    filas = estado.assign(**{c: iso(estado[c]) for c in ('marcada_desde', 'ultima_lectura', 'ultimo_cambio')})
+    respuesta = {
+        'thresholds': {'stale_hours': ESTANCADA_H, 'offline_hours': OFFLINE_H, 'dock_tolerance': TOLERANCIA_DOCKS},
+        'flagged': int((estado['marcas'].str.len() > 0).sum()),
+        'stations': filas.to_dict(orient='records'),
+    }
+    if request.args.get('intervals') in ('1', 'true'):
+        t = salud.todos_intervalos()
+        t = t[t['id_estacion'].isin(estado['id_estacion'])]
+        a_iso = lambda ns: [None if v == ABIERTO else pd.Timestamp(v, tz='UTC').isoformat() for v in ns]
+        respuesta['intervals'] = {'id_estacion': t['id_estacion'].tolist(), 'motivo': t['motivo'].tolist(),
+                                  'inicio': a_iso(t['inicio_ns']), 'fin': a_iso(t['fin_ns'])}
+    return jsonify(respuesta)
+
+
+# ============================================================
+# 7.7 Endpoint: Flujos (salidas/llegadas inferidas de snapshots)
+# ============================================================
+
+@app.route('/api/flows', methods=['GET'])
+def api_flows():
+    """Salidas y llegadas por estación a partir de las diferencias entre snapshots.
+
+    ?station=<id>[,<id>...]&from=<ts>&to=<ts> filtran los eventos;
+    ?hourly=1 agrega el perfil por hora; ?include_rebalancing=1 cuenta
+    también los saltos grandes (probable camión de redistribución).
+    """
+    estaciones = request.args.get('station')
+    estaciones = [e.strip() for e in estaciones.split(',') if e.strip()] if estaciones else None
+    try:
+        eventos = load_flows(estaciones=estaciones, desde=request.args.get('from'), hasta=request.args.get('to'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sin_rebalanceo = request.args.get('include_rebalancing') not in ('1', 'true')
+
+    r = resumen_flujos(eventos, sin_rebalanceo)
+    r[['salidas_dia', 'llegadas_dia']] = r[['salidas_dia', 'llegadas_dia']].astype(float).round(3)
+    filas = r.astype(object).where(r.notna(), None).to_dict(orient='records')
+    if request.args.get('hourly') in ('1', 'true'):
+        perfil = perfil_hora_flujos(eventos, sin_rebalanceo)
+        por_estacion = {k: g.set_index('hora')[['salidas', 'llegadas']].reindex(range(24), fill_value=0) for k, g in perfil.groupby('id_estacion')}
+        for f in filas:
+            p = por_estacion.get(f['id_estacion'])
+            f['salidas_hora'] = [round(float(v), 3) for v in p['salidas']] if p is not None else [0.0] * 24
+            f['llegadas_hora'] = [round(float(v), 3) for v in p['llegadas']] if p is not None else [0.0] * 24
+    return jsonify({'events': int(len(eventos)), 'stations': filas})
+
+
+# ============================================================
+# 7.8 Endpoint: Serie histórica por niveles de retención
+# ============================================================
+
+@app.route('/api/timeseries', methods=['GET'])
+def api_timeseries():
+    """Serie por estación (obs, promedio/mín/máx de bicis, ocupación y capacidad, % vacía/llena).
+
+    ?station=<id>[,<id>...]&from=<ts>&to=<ts>&resolution=crudo|15min|1h (por
+    defecto según el largo del rango). Cada fecha se lee del nivel más fino
+    que la conserve; 'resolution' de cada fila indica el nivel real.
+    ?summary=1 devuelve un resumen por estación sobre el rango.
+    """
+    estaciones = request.args.get('station')
+    estaciones = [e.strip() for e in estaciones.split(',') if e.strip()] if estaciones else None
+    desde, hasta = request.args.get('from'), request.args.get('to')
+    try:
+        if request.args.get('summary') in ('1', 'true'):
+            df = retention_summary(estaciones, desde, hasta)
+        else:
+            df = load_series(estaciones, desde, hasta, request.args.get('resolution'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if 'timestamp' in df.columns:
+        df['timestamp'] = df['timestamp'].map(lambda t: t.isoformat())
+    num = df.select_dtypes('float').columns
+    df[num] = df[num].astype('float64').round(4)
+    df = df.astype(object).where(df.notna(), None)
+    return jsonify({'fields': list(df.columns), 'rows': df.values.tolist()})
+
+
+# ============================================================
+# 7.9 Endpoint: Exportar histórico a Excel (bajo pedido)
+# ============================================================
+
+@app.route('/api/export', methods=['GET'])
+def api_export():
+    """Descarga un xlsx con las lecturas del almacén SQL (columnas del CSV en vivo).
+
+    ?from=<ts>&to=<ts>&station=<id>[,<id>...] filtran en la base; el libro se
+    escribe fila a fila (write_only) en un temporal, sin cargar el rango en memoria.
+    Solo hay lecturas crudas del periodo retenido: un ?from anterior a las
+    fechas ya compactadas da 400 (ese periodo sale de /api/timeseries); sin
+    ?from, el libro empieza donde empieza el almacén (cabecera Warning).
+    """
+    station = request.args.get('station')
+    estaciones = [s.strip() for s in station.split(',') if s.strip()] if station else None
+    desde, hasta = request.args.get('from'), request.args.get('to')
+    try:
+        fuera = compacted_dates(desde, hasta)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro inválido: {e}"}), 400
+    if fuera and desde:
+        return jsonify({"error": f"Sin lecturas crudas de {fuera[0]} a {fuera[-1]} (compactadas por la retención); "
+                                 f"usa /api/timeseries para ese periodo"}), 400
+
+    load_history_store()   # lo construye si aún no existe
+    archivo = tempfile.TemporaryFile()
+    try:
+        filas = exportar_excel(archivo, HISTORY_DB, estaciones, desde, hasta)
+    except ValueError as e:
+        archivo.close()
+        return jsonify({"error": f"Parámetro inválido: {e}"}), 400
+    archivo.seek(0)
+    log.info(f"📤 Exportación xlsx: {filas} filas")
+    respuesta = send_file(archivo, as_attachment=True, download_name=nombre_excel(estaciones, desde, hasta),
+                          mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    if fuera:
+        respuesta.headers['Warning'] = f'299 - "Sin lecturas crudas hasta {fuera[-1]} (retención)"'
+    return respuesta
+
+
 # ============================================================
 # 8. Endpoint: Estimar ruta (API pública OSRM)
 # ============================================================
@@ -319,13 +774,14 @@ def api_estimate_route():
 
     # Llamar al servidor OSRM
     coords = f"{src['lon']},{src['lat']};{dst['lon']},{dst['lat']}"
-    url = f"http://router.project-osrm.org/route/v1/driving/{coords}?overview=full&geometries=geojson&steps=true"
+    url = f"{OSRM_URL}/route/v1/driving/{coords}?overview=full&geometries=geojson&steps=true"
 
     try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        jr = r.json()
-        route = jr['routes'][0]
+        with llamada_externa('osrm'):
+            r = requests.get(url, timeout=10)
+            r.raise_for_status()
+            jr = r.json()
+            route = jr['routes'][0]
         return jsonify({
             'duration': route['duration'],
             'distance': route['distance'],
@@ -336,22 +792,68 @@ def api_estimate_route():
 
 
 # ============================================================
-# 9. Tarea programada: tomar snapshot cada 5 minutos
+# 8.1 Endpoint: Mapa de calor pre-agregado por zoom y franja
+# ============================================================
+
+@app.route('/api/heatmap', methods=['GET'])
+def api_heatmap():
+    """Rejilla de ocupación/demanda por zoom y franja (hour, weekday, day, all).
+
+    metric=demand es 1 - ocupación media de la celda (como los mapas de
+    demanda del EDA), no salidas/llegadas: esas están en /api/flows.
+    ETag = versión de los datos; con If-None-Match vigente responde 304.
+    """
+    try:
+        grid = get_heatmap(
+            zoom=request.args.get('zoom', 14),
+            bucket=request.args.get('bucket', 'hour'),
+            metric=request.args.get('metric', 'occupancy'),
+            value=request.args.get('value'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    resp = Response(status=304) if request.if_none_match.contains(grid['version']) else jsonify(grid)
+    resp.set_etag(grid['version'])
+    return resp
+
+
+# ============================================================
+# 8.2 Endpoint: Métricas (formato Prometheus)
+# ============================================================
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Latencias por endpoint, etapas del colector/procesador/ingesta,
+    llamadas externas y aciertos de caché (ver metrics.py)."""
+    return Response(exponer(), mimetype='text/plain; version=0.0.4')
+
+
+# ============================================================
+# 9. Tareas programadas: snapshot cada 5 minutos (CITYBIKE_SNAPSHOT_MIN) y retención diaria
 # ============================================================
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
 def auto_snapshot():
-    print("⏱️ [Scheduler] Ejecutando snapshot automático...")
+    log.info("⏱️ [Scheduler] Ejecutando snapshot automático...")
     try:
         rows = collect_snapshot()
         append_to_csv(rows, str(LIVE_CSV))
-        print(f"✅ Snapshot automático guardado ({len(rows)} registros).")
+        ingest_snapshot(rows)
+        log.info(f"✅ Snapshot automático guardado ({len(rows)} registros).")
+    except Exception as e:
+        log.error(f"❌ Error en snapshot automático: {e}")
+
+def auto_retencion():
+    try:
+        compact_retention()
     except Exception as e:
-        print(f"❌ Error en snapshot automático: {e}")
+        log.error(f"❌ Error en la compactación de retención: {e}")
 
 scheduler = BackgroundScheduler()
-scheduler.add_job(auto_snapshot, 'interval', minutes=5)
+scheduler.add_job(auto_snapshot, 'interval', minutes=SNAPSHOT_MINUTOS)
+scheduler.add_job(auto_retencion, 'cron', hour=3, minute=30)   # niveles de retención (retention.py)
 scheduler.start()
 
 
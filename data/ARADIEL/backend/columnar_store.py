@@ -0,0 +1,198 @@
+# columnar_store.py
+# Histórico procesado en Parquet particionado por fecha (fecha=AAAA-MM-DD),
+# ordenado por estación y timestamp para que las estadísticas de cada row
+# group permitan saltar bloques. Las lecturas empujan al lector los filtros
+# de estación/tiempo y la lista de columnas.
+import json
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Conteos: enteros (nulos permitidos en Arrow, sin pasar a float)
+ENTEROS = ['hora', 'capacidad', 'bicis_libres', 'espacios_vacios', 'obs']
+FILAS_POR_GRUPO = 64_000
+PARTICION = ds.partitioning(pa.schema([('fecha', pa.string())]), flavor='hive')
+NOMBRE_RESUMEN = 'station_summary_agg.parquet'
+
+
+# ============================================================
+# Esquema y conversión
+# ============================================================
+
+def _a_tabla(df):
+    """DataFrame -> tabla Arrow con categorías y fechas como texto."""
+    df = df.copy()
+    for c in df.columns:
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype(object).where(df[c].notna(), None)
+    if 'fecha' in df.columns:
+        df['fecha'] = df['fecha'].astype(str).where(df['fecha'].notna(), None)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _esquema(tabla):
+    """Esquema fijo a partir del primer bloque: conteos int64 y columnas vacías como texto."""
+    campos = []
+    for f in tabla.schema:
+        tipo = f.type
+        if f.name in ENTEROS and (pa.types.is_integer(tipo) or pa.types.is_floating(tipo)):
+            tipo = pa.int64()
+        elif pa.types.is_null(tipo) or pa.types.is_large_string(tipo):
+            tipo = pa.string()
+        campos.append(pa.field(f.name, tipo))
+    orden = json.dumps([f.name for f in tabla.schema])
+    return pa.schema(campos, metadata={b'columnas': orden.encode()})
+
+
+def _ajustar(tabla, esquema):
+    """Castea un bloque al esquema fijo (la inferencia de tipos varía por bloque)."""
+    columnas = []
+    for f in esquema:
+        if f.name in tabla.column_names:
+            col = tabla.column(f.name)
+            columnas.append(col if col.type == f.type else pc.cast(col, f.type))
+        else:
+            columnas.append(pa.nulls(len(tabla), f.type))
+    return pa.Table.from_arrays(columnas, schema=esquema)
+
+
+def _ordenar(tabla):
+    claves = [(c, 'ascending') for c in ('fecha', 'id_estacion', 'timestamp') if c in tabla.column_names]
+    return tabla.sort_by(claves) if claves else tabla
+
+
+# ============================================================
+# Escritura
+# ============================================================
+
+def escribir_procesado(bloques, destino):
+    """Escribe el histórico procesado como dataset Parquet particionado por fecha.
+
+    bloques: un DataFrame o un iterable de DataFrames (modo por bloques).
+    Se escribe en un directorio temporal y se reemplaza el destino al final,
+    así los lectores nunca ven un dataset a medias. Devuelve filas escritas.
+    """
+    destino = Path(destino)
+    if isinstance(bloques, pd.DataFrame):
+        bloques = [bloques]
+
+    tmp = destino.with_name(destino.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    esquema = None
+    filas = 0
+    opciones = ds.ParquetFileFormat().make_write_options(compression='zstd', write_statistics=True)
+    for i, df in enumerate(bloques):
+        tabla = _a_tabla(df)
+        if esquema is None:
+            esquema = _esquema(tabla)
+        tabla = _ordenar(_ajustar(tabla, esquema))
+        filas += tabla.num_rows
+        ds.write_dataset(
+            tabla, tmp, format='parquet', partitioning=PARTICION,
+            basename_template=f'parte-{i:05d}-{{i}}.parquet',
+            file_options=opciones, max_rows_per_group=FILAS_POR_GRUPO,
+            existing_data_behavior='overwrite_or_ignore',
+        )
+
+    if esquema is None:
+        raise ValueError("No hay datos para escribir")
+    shutil.rmtree(destino, ignore_errors=True)
+    tmp.rename(destino)
+    return filas
+
+
+def ruta_resumen(destino):
+    """Archivo del resumen por estación, junto al dataset (no dentro)."""
+    return Path(destino).parent / NOMBRE_RESUMEN
+
+
+def escribir_resumen(station_summary, destino):
+    """station_summary_agg en un único Parquet junto al dataset procesado."""
+    ruta = ruta_resumen(destino)
+    pq.write_table(_a_tabla(station_summary), ruta, compression='zstd')
+    return ruta
+
+
+# ============================================================
+# Lectura con filtros empujados al lector
+# ============================================================
+
+def _dataset(origen):
+    return ds.dataset(origen, format='parquet', partitioning=PARTICION)
+
+
+def _como_ts(valor, tipo):
+    """Límite de tiempo en la zona del dataset (naive = hora local del dataset)."""
+    ts = pd.Timestamp(valor)
+    if tipo.tz is not None:
+        ts = ts.tz_localize(tipo.tz) if ts.tzinfo is None else ts.tz_convert(tipo.tz)
+    return ts
+
+
+def filtro(dataset, estaciones=None, desde=None, hasta=None):
+    """Expresión de filtro: estaciones por id, rango [desde, hasta] de timestamp.
+
+    El rango también se traduce a la partición 'fecha' para podar directorios.
+    """
+    expr = None
+
+    def _y(e):
+        nonlocal expr
+        expr = e if expr is None else expr & e
+
+    if estaciones is not None:
+        _y(ds.field('id_estacion').isin([str(e) for e in estaciones]))
+    tipo = dataset.schema.field('timestamp').type if 'timestamp' in dataset.schema.names else None
+    for valor, op in ((desde, '>='), (hasta, '<=')):
+        if valor is None or tipo is None:
+            continue
+        ts = _como_ts(valor, tipo)
+        dia = ts.strftime('%Y-%m-%d')
+        if op == '>=':
+            _y((ds.field('timestamp') >= pa.scalar(ts, type=tipo)) & (ds.field('fecha') >= dia))
+        else:
+            _y((ds.field('timestamp') <= pa.scalar(ts, type=tipo)) & (ds.field('fecha') <= dia))
+    return expr
+
+
+def leer_procesado(origen, columnas=None, estaciones=None, desde=None, hasta=None):
+    """Lee el dataset procesado leyendo solo particiones, row groups y columnas necesarios."""
+    dataset = _dataset(origen)
+    orden = json.loads((dataset.schema.metadata or {}).get(b'columnas', b'[]') or '[]')
+    nombres = [c for c in orden if c in dataset.schema.names] or dataset.schema.names
+    if columnas is not None:
+        pedidas = set(columnas)
+        nombres = [c for c in nombres if c in pedidas]
+    tabla = dataset.to_table(columns=nombres, filter=filtro(dataset, estaciones, desde, hasta))
+    return tabla.to_pandas()
+
+
+def leer_resumen(destino):
+    """station_summary_agg escrito por escribir_resumen (None si no existe)."""
+    ruta = ruta_resumen(destino)
+    return pq.read_table(ruta).to_pandas() if ruta.exists() else None
+
+
+def firma(origen):
+    """(archivos, mtime máximo, bytes) del dataset: cambia al reescribirlo."""
+    archivos = list(Path(origen).rglob('*.parquet'))
+    if not archivos:
+        return (0, None, None)
+    stats = [p.stat() for p in archivos]
+    return (len(stats), max(s.st_mtime_ns for s in stats), sum(s.st_size for s in stats))
+
+
+if __name__ == '__main__':
+    # Migración: python columnar_store.py data/citybike_procesado.csv data/procesado
+    import sys
+    from data_reader import leer_csv
+
+    origen, destino = sys.argv[1], sys.argv[2]
+    filas = escribir_procesado(leer_csv(origen, normalizar=False), destino)
+    print(f"📦 {origen} -> {destino}: {filas} filas")
@@ -0,0 +1,127 @@
+# compact_history.py
+# Representación compacta del histórico en memoria:
+#   - estaciones: tabla de dimensión (station_dim: id, nombre, código, avenida,
+#     zona, coordenadas, capacidad, exclusión)
+#   - hechos: una fila por snapshot con station_key entero y tipos angostos
+#     (int16 conteos, float32 ocupación, int8 hora/día, booleanos reales).
+# Solo lo usa el backend (data_utils.load_compact_history: índice as-of y
+# mapa de calor). El procesador (data_processor) agrega sobre las filas
+# completas: con la ocupación en float32 las medias y los empates de hora
+# pico no saldrían idénticos a la implementación original.
+import numpy as np
+import pandas as pd
+
+from data_reader import parse_timestamp, resolver_columnas
+from station_dim import DimensionEstaciones
+
+PERIODOS = ['madrugada', 'mañana', 'tarde', 'noche']
+_VERDADEROS = {'true', '1', 'yes', 'si', 'sí'}
+
+
+def _a_bool(s):
+    """'True'/'False' (texto) -> bool."""
+    if s.dtype == bool:
+        return s
+    return s.astype(str).str.strip().str.lower().isin(_VERDADEROS)
+
+
+def _entero_angosto(s, dtype='int16'):
+    """Entero angosto; nullable (Int16) solo si hay vacíos."""
+    s = pd.to_numeric(s, errors='coerce')
+    if s.notna().all():
+        return s.astype(dtype)
+    return s.round().astype(dtype.capitalize())
+
+
+def _periodo(hora):
+    """Mismos cortes que periodo_de_dia del procesador, vectorizado."""
+    h = hora.to_numpy(dtype='float64')
+    codigos = np.select([(h >= 5) & (h < 12), (h >= 12) & (h < 17), (h >= 17) & (h < 21)], [1, 2, 3], 0)
+    codigos = np.where(np.isnan(h), -1, codigos)
+    return pd.Categorical.from_codes(codigos, categories=PERIODOS)
+
+
+def construir_estaciones(df, dimension=None):
+    """Dimensión de estaciones (station_dim) y station_key de cada fila.
+
+    Sin `dimension` se arma una nueva (claves por id ordenado); con una
+    dimensión persistida solo se le agregan las estaciones que falten.
+    """
+    if dimension is None:
+        dimension = DimensionEstaciones()
+    dimension.plegar(df)
+    keys = dimension.claves(df['id_estacion'])
+    estaciones = dimension.tabla.copy()
+    estaciones.index = estaciones.index.astype(dimension.dtype_clave())
+    return estaciones, keys
+
+
+def compactar_historial(df, dimension=None):
+    """Convierte un histórico (crudo o procesado) a (hechos, estaciones).
+
+    Los nombres de columna se normalizan con el mapa de alias del lector.
+    dimension: DimensionEstaciones persistida para mantener claves estables.
+    """
+    df = df.rename(columns=resolver_columnas(tuple(df.columns)))
+    if 'timestamp' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df['timestamp'] = parse_timestamp(df['timestamp'])
+
+    estaciones, keys = construir_estaciones(df, dimension)
+
+    hechos = pd.DataFrame({'station_key': keys}, index=pd.RangeIndex(len(df)))
+    if 'timestamp' in df.columns:
+        ts = df['timestamp'].reset_index(drop=True)
+        hechos['timestamp'] = ts
+        hechos['hora'] = ts.dt.hour.astype('Int8' if ts.isna().any() else 'int8')
+        hechos['dia_semana'] = ts.dt.dayofweek.astype('Int8' if ts.isna().any() else 'int8')  # 0 = lunes
+        hechos['periodo_dia'] = _periodo(ts.dt.hour)
+
+    for c in ['bicis_libres', 'espacios_vacios', 'capacidad']:
+        if c in df.columns:
+            hechos[c] = _entero_angosto(df[c].reset_index(drop=True))
+
+    ocup = pd.Series(np.nan, index=hechos.index)
+    if 'ocupacion' in df.columns:
+        ocup = pd.to_numeric(df['ocupacion'], errors='coerce').reset_index(drop=True)
+    if 'bicis_libres' in hechos.columns and 'capacidad' in hechos.columns:
+        # filas sin 'ocupacion' (p.ej. CSV en vivo unido al procesado)
+        cap = hechos['capacidad'].astype('float64')
+        ocup = ocup.fillna(hechos['bicis_libres'].astype('float64') / cap.where(cap > 0))
+    hechos['ocupacion'] = ocup.astype('float32')
+
+    for c in ['temp_c', 'temp_miraflores']:
+        if c in df.columns:
+            hechos[c] = pd.to_numeric(df[c], errors='coerce').reset_index(drop=True).astype('float32')
+    if 'en_miraflores' in df.columns:
+        hechos['en_miraflores'] = _a_bool(df['en_miraflores'].reset_index(drop=True))
+
+    return hechos, estaciones
+
+
+def reporte_memoria(antes, hechos, estaciones=None):
+    """Bytes por fila antes/después de compactar (memory_usage profundo)."""
+    filas = max(len(antes), 1)
+    bytes_antes = int(antes.memory_usage(deep=True).sum())
+    bytes_despues = int(hechos.memory_usage(deep=True).sum())
+    if estaciones is not None:
+        bytes_despues += int(estaciones.memory_usage(deep=True).sum())
+    return {
+        'filas': len(antes),
+        'bytes_antes': bytes_antes,
+        'bytes_despues': bytes_despues,
+        'bytes_por_fila_antes': round(bytes_antes / filas, 1),
+        'bytes_por_fila_despues': round(bytes_despues / filas, 1),
+        'reduccion': round(bytes_antes / max(bytes_despues, 1), 1),
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    from data_reader import leer_csv
+
+    for ruta in sys.argv[1:]:
+        df = leer_csv(ruta)
+        hechos, estaciones = compactar_historial(df)
+        r = reporte_memoria(df, hechos, estaciones)
+        print(f"📦 {ruta}: {r['filas']} filas, {len(estaciones)} estaciones")
+        print(f"   {r['bytes_por_fila_antes']} B/fila -> {r['bytes_por_fila_despues']} B/fila (x{r['reduccion']})")
@@ -1,67 +1,49 @@
+import os
+
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from pathlib import Path
 
-def procesar_citybike_csv(input_csv: str, output_csv: str):
-    def periodo_de_dia(h):
-        try:
-            h = int(h)
-        except Exception:
-            return np.nan
-        if 5 <= h < 12:
-            return "mañana"
-        if 12 <= h < 17:
-            return "tarde"
-        if 17 <= h < 21:
-            return "noche"
-        return "madrugada"
-
-    def safe_mode(series):
-        s = series.dropna()
-        if s.empty:
-            return ""
-        mode = s.mode()
-        return mode.iloc[0] if not mode.empty else s.iloc[0]
+from columnar_store import escribir_procesado, escribir_resumen
+from data_reader import leer_csv, leer_encabezado, resolver_columnas
+from metrics import etapa, log
+from station_dim import ESTACIONES_EXCLUIDAS, codigo_desde_nombre, es_excluida
 
-    # --- 1) Leer CSV ---
-    df = pd.read_csv(input_csv)
-    print("Columnas originales:", df.columns.tolist()[:30])
+BINS = [0, 0.35, 0.65, 1.0]
+LABELS = ['Baja','Media','Alta']
+
+# >1: el resumen por estación (modo en memoria) se reparte en procesos (parallel_stations)
+PROCESOS = int(os.environ.get('CITYBIKE_PROCESOS', 1))
+
+COLS_RESUMEN_MERGE = ['id_estacion','ocupacion_promedio','bicis_promedio','capacidad_promedio','categoria_ocupacion_promedio']
 
-    # --- 2) Normalizar/renombrar columnas frecuentes (español esperados) ---
-    # Mapas de alias comunes -> nombre objetivo
-    alias_map = {
-        'id_estacion': ['id_estacion', 'station_id', 'stationid', 'station', 'station-id'],
-        'nombre_estacion': ['nombre_estacion', 'station_name', 'stationname', 'name'],
-        'latitud': ['lat', 'latitude', 'latitud', 'latitud_dec'],
-        'longitud': ['lon', 'lng', 'longitude', 'longitud'],
-        'capacidad': ['capacidad', 'capacity', 'dockcount', 'bike_stands', 'slots'],
-        'bicis_libres': ['bicis_libres', 'free_bikes', 'available_bikes', 'num_bikes_available'],
-        'espacios_vacios': ['espacios_vacios', 'empty_slots', 'num_docks_available', 'empty_docks'],
-        'timestamp': ['timestamp', 'scrape_timestamp', 'datetime', 'date', 'fecha_hora'],
-        'temp_c': ['temp_c', 'temp_C', 'temp', 'temperature'],
-        'vel_viento': ['vel_viento', 'wind_speed', 'windspeed'],
-        'en_miraflores': ['en_miraflores', 'in_miraflores']
-    }
 
-    # crear mapa lower->original para matching insensible a mayúsculas
-    col_lower_to_orig = {c.lower(): c for c in df.columns}
+def periodo_de_dia(h):
+    try:
+        h = int(h)
+    except Exception:
+        return np.nan
+    if 5 <= h < 12:
+        return "mañana"
+    if 12 <= h < 17:
+        return "tarde"
+    if 17 <= h < 21:
+        return "noche"
+    return "madrugada"
 
-    for target, aliases in alias_map.items():
-        if target in df.columns:
-            continue
-        found = None
-        for a in aliases:
-            if a.lower() in col_lower_to_orig:
-                found = col_lower_to_orig[a.lower()]
-                break
-        if found:
-            df.rename(columns={found: target}, inplace=True)
-            # actualizar mapa lower->orig porque renombramos
-            col_lower_to_orig = {c.lower(): c for c in df.columns}
 
-    print("Columnas después de normalizar:", df.columns.tolist()[:60])
+# ============================================================
+# Etapas (compartidas por el modo en memoria y el modo por bloques)
+# ============================================================
 
+def _normalizar_columnas(df):
+    """Renombra columnas según data_reader.ALIAS_MAP (insensible a mayúsculas; resolución cacheada por encabezado)."""
+    return df.rename(columns=resolver_columnas(tuple(df.columns)))
+
+
+def _preparar(df, verbose=True):
+    """Tipos seguros y columnas derivadas por fila (pasos 3 a 7)."""
     # --- 3) Tipos seguros ---
     # timestamp
     if 'timestamp' in df.columns:
@@ -78,19 +60,23 @@ def procesar_citybike_csv(input_csv: str, output_csv: str):
     if 'espacios_vacios' not in df.columns:
         if 'capacidad' in df.columns and 'bicis_libres' in df.columns:
             df['espacios_vacios'] = (df['capacidad'] - df['bicis_libres']).clip(lower=0)
-            print("Calculo espacios_vacios a partir de capacidad - bicis_libres")
+            if verbose:
+                log.debug("Calculo espacios_vacios a partir de capacidad - bicis_libres")
         else:
             df['espacios_vacios'] = np.nan
-            print("Aviso: no se encontró 'capacidad' o 'bicis_libres'. 'espacios_vacios' queda NaN")
+            if verbose:
+                log.warning("⚠️ No se encontró 'capacidad' o 'bicis_libres'. 'espacios_vacios' queda NaN")
 
     # --- 5) ocupacion (si no existe) ---
     if 'ocupacion' not in df.columns:
         if 'capacidad' in df.columns and 'bicis_libres' in df.columns:
             df['ocupacion'] = df['bicis_libres'] / df['capacidad'].replace({0: np.nan})
-            print("Calculada 'ocupacion' = bicis_libres / capacidad")
+            if verbose:
+                log.debug("Calculada 'ocupacion' = bicis_libres / capacidad")
         else:
             df['ocupacion'] = np.nan
-            print("Aviso: no se pudo calcular 'ocupacion' (faltan columnas).")
+            if verbose:
+                log.warning("⚠️ No se pudo calcular 'ocupacion' (faltan columnas).")
 
     # --- 6) fecha/hora/dia/periodo ---
     df['fecha'] = df['timestamp'].dt.date
@@ -101,75 +87,224 @@ def procesar_citybike_csv(input_csv: str, output_csv: str):
     # --- 7) codigo_estacion desde nombre si no existe id_estacion ---
     if 'codigo_estacion' not in df.columns:
         if 'nombre_estacion' in df.columns:
-            df['codigo_estacion'] = df['nombre_estacion'].astype(str).str.extract(r'(\d{5})')
+            df['codigo_estacion'] = codigo_desde_nombre(df['nombre_estacion']).to_numpy()
         else:
             df['codigo_estacion'] = np.nan
+    return df
 
-    # --- 8) station_summary (resumen por estación) ---
+
+def _clave(df):
     # elegir llave para agrupar: id_estacion preferido, si no usar codigo_estacion, si no usar nombre_estacion
     if 'id_estacion' in df.columns:
-        key = 'id_estacion'
-    elif 'codigo_estacion' in df.columns:
-        key = 'codigo_estacion'
-    else:
-        key = 'nombre_estacion'
+        return 'id_estacion'
+    if 'codigo_estacion' in df.columns:
+        return 'codigo_estacion'
+    return 'nombre_estacion'
 
+
+def _categorizar_resumen(station_summary):
+    # redondeos
+    for c in ['bicis_promedio','capacidad_promedio','ocupacion_promedio','pct_vacia','pct_llena']:
+        if c in station_summary.columns:
+            station_summary[c] = station_summary[c].round(3)
+
+    station_summary['categoria_ocupacion_promedio'] = pd.cut(station_summary['ocupacion_promedio'].fillna(0), bins=BINS, labels=LABELS, include_lowest=True)
+    return station_summary
+
+
+def _resumen_estaciones(df, key):
+    """station_summary (resumen por estación) a partir del df completo.
+
+    Todo vectorizado: medias con groupby, porcentajes como medias de máscaras
+    booleanas, moda del nombre por conteos y hora pico por idxmax.
+    """
     grouped = df.groupby(key, observed=True)
+    obs = grouped[key].count()
+    if 'nombre_estacion' in df.columns:
+        nombres = df['nombre_estacion'].rename('_nombre')
+        nombre = _moda_nombres(nombres.groupby([df[key], nombres], observed=True).size(), obs.index)
+    else:
+        nombre = ""
 
-    station_summary = grouped.agg(
-        nombre_estacion = ('nombre_estacion', lambda s: safe_mode(s) if 'nombre_estacion' in df.columns else ""),
-        obs = (key, 'count'),
-        bicis_promedio = ('bicis_libres', 'mean') if 'bicis_libres' in df.columns else pd.NamedAgg(column=key, aggfunc='count'),
-        capacidad_promedio = ('capacidad', 'mean') if 'capacidad' in df.columns else pd.NamedAgg(column=key, aggfunc='count'),
-        ocupacion_promedio = ('ocupacion', 'mean'),
-        pct_vacia = ('bicis_libres', lambda x: (x == 0).mean() * 100) if 'bicis_libres' in df.columns else pd.NamedAgg(column=key, aggfunc=lambda x: np.nan),
-        pct_llena = ('espacios_vacios', lambda x: (x == 0).mean() * 100) if 'espacios_vacios' in df.columns else pd.NamedAgg(column=key, aggfunc=lambda x: np.nan)
-    ).reset_index().rename(columns={key: 'id_estacion'})
+    def _pct_ceros(col):
+        if col not in df.columns:
+            return pd.Series(np.nan, index=obs.index)
+        return df[col].eq(0).groupby(df[key], observed=True).mean() * 100
+
+    station_summary = pd.DataFrame({
+        'nombre_estacion': nombre,
+        'obs': obs,
+        'bicis_promedio': grouped['bicis_libres'].mean() if 'bicis_libres' in df.columns else obs,
+        'capacidad_promedio': grouped['capacidad'].mean() if 'capacidad' in df.columns else obs,
+        'ocupacion_promedio': grouped['ocupacion'].mean(),
+        'pct_vacia': _pct_ceros('bicis_libres'),
+        'pct_llena': _pct_ceros('espacios_vacios'),
+    })
+    station_summary.index.name = key
+    station_summary = station_summary.reset_index().rename(columns={key: 'id_estacion'})
 
     # hora pico
     if 'hora' in df.columns:
-        hp = (
-            df.groupby([key, 'hora'], observed=True)['ocupacion']
-            .mean()
-            .reset_index()
-            .sort_values([key, 'ocupacion'], ascending=[True, False])
-            .groupby(key, observed=True)
-            .first()
-            .reset_index()[[key,'hora']]
-            .rename(columns={key:'id_estacion','hora':'hora_pico'})
-        )
-        hp['id_estacion'] = hp['id_estacion'].astype(str)
+        hp = _hora_pico(df.groupby([key, 'hora'], observed=True)['ocupacion'].mean())
         station_summary['id_estacion'] = station_summary['id_estacion'].astype(str)
         station_summary = station_summary.merge(hp, on='id_estacion', how='left')
 
-    # redondeos
-    for c in ['bicis_promedio','capacidad_promedio','ocupacion_promedio','pct_vacia','pct_llena']:
-        if c in station_summary.columns:
-            station_summary[c] = station_summary[c].round(3)
+    return _categorizar_resumen(station_summary)
+
 
-    # --- 9) Categorías (instantánea y promedio) ---
-    BINS = [0, 0.35, 0.65, 1.0]
-    LABELS = ['Baja','Media','Alta']
+def resumen_estaciones(df, key=None):
+    """station_summary de un df ya preparado (nombres canónicos, ocupacion y hora).
 
+    key: columna de estación; por defecto la que elige el procesador (id,
+    código o nombre). Para scripts fuera del backend (Codigo resumido/).
+    """
+    return _resumen_estaciones(df, key or _clave(df))
+
+
+def _resumen_estaciones_paralelo(df, key, procesos):
+    """_resumen_estaciones con las sumas por estación y por (estación, hora) en varios procesos.
+
+    Los tramos de estaciones van a parallel_stations.ejecutar_por_estacion y
+    el resumen se arma como en el modo por bloques (_resumen_desde_agregados).
+    Los hechos no salen de compact_history: se conserva la ocupación en
+    float64 y la clave propia del procesador (id o código de estación).
+    """
+    from parallel_stations import COLUMNAS, ejecutar_por_estacion   # parallel_stations importa este módulo
+
+    if any(c not in df.columns for c in COLUMNAS[1:]):
+        return _resumen_estaciones(df, key)
+    codigos, claves = pd.factorize(df[key], sort=True)
+    hechos = df[COLUMNAS[1:]].assign(station_key=codigos)[codigos >= 0]
+    parciales = ejecutar_por_estacion(hechos, etapas=('resumen', 'horas'), procesos=procesos)
+
+    est = parciales['resumen']
+    est.index = claves[est.index].rename(key)
+    hora = parciales['horas']
+    hora.index = pd.MultiIndex.from_arrays([
+        claves[hora.index.get_level_values(0)].rename(key),
+        hora.index.get_level_values(1).astype(df['hora'].dtype),
+    ])
+    nombres = (
+        df.groupby([df[key], df['nombre_estacion'].rename('_nombre')], observed=True).size()
+        if 'nombre_estacion' in df.columns else pd.Series(dtype='int64')
+    )
+    return _resumen_desde_agregados({'estacion': est, 'hora': hora, 'nombres': nombres}, key)
+
+
+def _moda_nombres(conteos, index):
+    """Nombre más frecuente por estación (empate -> menor valor, como Series.mode).
+
+    conteos: Series con índice (estación, nombre) y número de apariciones.
+    """
+    if conteos.empty:
+        return pd.Series("", index=index)
+    conteos = conteos.rename('n').reset_index()
+    llave, nombre = conteos.columns[0], conteos.columns[1]
+    moda = (
+        conteos.sort_values([llave, 'n', nombre], ascending=[True, False, True])
+        .drop_duplicates(llave)
+        .set_index(llave)[nombre]
+    )
+    return moda.reindex(index).fillna("")
+
+
+def _hora_pico(medias_hora):
+    """Hora de mayor ocupación media por estación.
+
+    medias_hora: Series con índice (estación, hora). Pivot estación x hora e
+    idxmax por fila; empates -> hora menor. Las horas con ocupación NaN solo
+    ganan si la estación no tiene ninguna hora válida.
+    """
+    key = medias_hora.index.names[0]
+    pivot = medias_hora.fillna(-np.inf).unstack('hora')
+    hp = pivot.idxmax(axis=1).astype(medias_hora.index.get_level_values('hora').dtype)
+    hp = hp.rename('hora_pico').rename_axis(key).reset_index().rename(columns={key: 'id_estacion'})
+    hp['id_estacion'] = hp['id_estacion'].astype(str)
+    return hp
+
+
+def _enriquecer(df, station_summary, key):
+    """Categoría instantánea + columnas del resumen unidas a cada fila (paso 9)."""
     # borrar columnas antiguas si existieran
     for col in ['categoria_ocupacion','categoria_ocupacion_promedio','ocup_cat_fixed']:
         if col in df.columns:
             df.drop(columns=[col], inplace=True)
 
     df['categoria_ocupacion'] = pd.cut(df['ocupacion'].fillna(0), bins=BINS, labels=LABELS, include_lowest=True)
-    station_summary['categoria_ocupacion_promedio'] = pd.cut(station_summary['ocupacion_promedio'].fillna(0), bins=BINS, labels=LABELS, include_lowest=True)
 
     # unir info de station_summary al df (ocupacion_promedio, categoria_promedio, etc.)
     df['id_estacion'] = df['id_estacion'].astype(str) if 'id_estacion' in df.columns else df[key].astype(str)
     station_summary['id_estacion'] = station_summary['id_estacion'].astype(str)
 
-    df = df.merge(
-        station_summary[['id_estacion','ocupacion_promedio','bicis_promedio','capacidad_promedio','categoria_ocupacion_promedio']],
+    return df.merge(
+        station_summary[COLS_RESUMEN_MERGE],
         on='id_estacion',
         how='left',
         validate='many_to_one'
     )
 
+
+def _excluir_estaciones(df, verbose=True):
+    """Quita las filas de estaciones excluidas (station_dim.ESTACIONES_EXCLUIDAS).
+
+    Se mira codigo_estacion (normalizado a texto) o, si no existe, id_estacion.
+    """
+    col = 'codigo_estacion' if 'codigo_estacion' in df.columns else 'id_estacion'
+    if col not in df.columns:
+        return df
+    df[col] = df[col].astype(str).str.strip()
+    mask = es_excluida(df[col]).to_numpy()
+    if mask.any():
+        df = df[~mask].reset_index(drop=True)
+    if verbose and (mask.any() or col == 'codigo_estacion'):
+        log.info(f"Se eliminaron {int(mask.sum())} filas con {col} == {', '.join(ESTACIONES_EXCLUIDAS)} (si existían).")
+    return df
+
+
+# ============================================================
+# Modo en memoria
+# ============================================================
+
+def procesar_citybike_csv(input_csv: str, output_csv: str = None, salida_columnar: str = None,
+                          procesos: int = None):
+    """Procesa el CSV crudo, escribe el histórico enriquecido y devuelve el df completo.
+
+    salida_columnar: directorio del dataset Parquet particionado por fecha
+    (el resumen por estación queda al lado, en station_summary_agg.parquet).
+    output_csv: exportación CSV opcional. procesos: con más de uno, el
+    resumen por estación se calcula por tramos de estaciones en paralelo;
+    por defecto, CITYBIKE_PROCESOS. Para históricos que no entran en
+    memoria: procesar_citybike_csv_por_bloques.
+    """
+    if not output_csv and not salida_columnar:
+        raise ValueError("Indica output_csv y/o salida_columnar")
+
+    # --- 1) Leer CSV ---
+    with etapa('procesador', 'leer'):
+        df = leer_csv(input_csv)
+    log.debug(f"Columnas originales: {leer_encabezado(input_csv)[:30]}")
+
+    # --- 2) Normalizar/renombrar columnas frecuentes (español esperados) ---
+    with etapa('procesador', 'normalizar', filas=len(df)):
+        df = _normalizar_columnas(df)
+        log.debug(f"Columnas después de normalizar: {df.columns.tolist()[:60]}")
+
+        # --- 3 a 7) Tipos, ocupación, fecha/hora, código ---
+        df = _preparar(df)
+
+    # --- 8) station_summary (resumen por estación) ---
+    key = _clave(df)
+    procesos = PROCESOS if procesos is None else procesos
+    with etapa('procesador', 'agregar'):
+        if procesos > 1:
+            station_summary = _resumen_estaciones_paralelo(df, key, procesos)
+        else:
+            station_summary = _resumen_estaciones(df, key)
+
+    # --- 9) Categorías (instantánea y promedio) + merge ---
+    with etapa('procesador', 'unir'):
+        df = _enriquecer(df, station_summary, key)
+
     # --- 10) columnas finales ordenadas ---
     cols_final = [
         'timestamp','fecha','hora','dia_semana','periodo_dia',
@@ -184,42 +319,155 @@ def procesar_citybike_csv(input_csv: str, output_csv: str):
     ]
     cols_final = [c for c in cols_final if c in df.columns]
 
-    # ---------------------------
-    # AÑADIDO: eliminar código 27042 (robusto a tipos)
-    # ---------------------------
-    # Normalizar codigo_estacion a str (si existe)
-    if 'codigo_estacion' in df.columns:
-        # algunos valores vienen como float (NaN), otros como int o str. Convertimos a str y strip.
-        df['codigo_estacion'] = df['codigo_estacion'].astype(str).str.strip()
-        # Los NaN convertidos a 'nan' no queremos eliminar; filtramos explicitamente el literal '27042'
-        before_len = len(df)
-        df = df[~df['codigo_estacion'].isin(['27042', '27042.0', '27042.00'])].reset_index(drop=True)
-        removed = before_len - len(df)
-        print(f"Se eliminaron {removed} filas con codigo_estacion == 27042 (si existían).")
-    else:
-        # por seguridad, también revisamos id_estacion por si el código aparece ahí
-        if 'id_estacion' in df.columns:
-            df['id_estacion'] = df['id_estacion'].astype(str).str.strip()
-            before_len = len(df)
-            df = df[~df['id_estacion'].isin(['27042', '27042.0', '27042.00'])].reset_index(drop=True)
-            removed = before_len - len(df)
-            if removed:
-                print(f"Se eliminaron {removed} filas con id_estacion == 27042 (si existían).")
-
-    # Confirmación adicional: eliminar cualquier fila donde codigo_estacion contiene '27042' (por si había formato extraño)
-    if 'codigo_estacion' in df.columns:
-        mask_contains = df['codigo_estacion'].str.contains('27042', na=False)
-        if mask_contains.any():
-            before_len = len(df)
-            df = df[~mask_contains].reset_index(drop=True)
-            print(f"Se eliminaron {before_len - len(df)} filas adicionales donde codigo_estacion contenía '27042'.")
+    df = _excluir_estaciones(df)
+
+    with etapa('procesador', 'escribir', filas=len(df)):
+        if salida_columnar:
+            escribir_procesado(df, salida_columnar)
+            log.info(f"💾 Dataset columnar guardado: {salida_columnar}")
+            ruta = escribir_resumen(station_summary, salida_columnar)
+            log.info(f"💾 Resumen guardado: {ruta}")
+        if output_csv:
+            df.to_csv(output_csv, index=False, encoding='utf-8-sig')
+            log.info(f"💾 Archivo guardado: {output_csv}")
+    log.info("✅ Procesado completado.")
+    log.debug(f"Columnas guardadas: {cols_final}")
+
+
+
+    return df  # opcional: devolver el DF procesado
+
+
+# ============================================================
+# Modo por bloques (memoria acotada)
+# ============================================================
+# Pasada 1: cada bloque aporta agregados sumables por estación y por
+# (estación, hora); se combinan sumando. Pasada 2: se vuelve a leer el CSV
+# por bloques, se une el resumen (pequeño) y se escriben las filas.
+
+def _leer_bloques(input_csv, chunksize, key_cache):
+    for chunk in leer_csv(input_csv, chunksize=chunksize):
+        with etapa('procesador', 'normalizar', filas=len(chunk)):
+            chunk = _preparar(_normalizar_columnas(chunk), verbose=False)
+        key = key_cache.setdefault('key', _clave(chunk))
+        # la inferencia de tipos es por bloque: fijar la llave como texto
+        chunk[key] = chunk[key].where(chunk[key].isna(), chunk[key].astype(str))
+        yield chunk, key
+
+
+def _agregados_parciales(df, key):
+    """Agregados sumables del bloque: por estación, por (estación, hora) y por nombre."""
+    g = df.groupby(key)
+    est = pd.DataFrame({'obs': g[key].count()})
+    for col, pref in [('bicis_libres', 'bicis'), ('capacidad', 'cap'), ('ocupacion', 'ocup')]:
+        if col in df.columns:
+            est[f'{pref}_sum'] = g[col].sum()
+            est[f'{pref}_n'] = g[col].count()
+    if 'bicis_libres' in df.columns:
+        est['vacia_n'] = df['bicis_libres'].eq(0).groupby(df[key]).sum()
+    if 'espacios_vacios' in df.columns:
+        est['llena_n'] = df['espacios_vacios'].eq(0).groupby(df[key]).sum()
+
+    hora = df.groupby([key, 'hora'])['ocupacion'].agg(['sum', 'count'])
+    nombres = (
+        df.groupby([df[key], df['nombre_estacion'].rename('_nombre')]).size()
+        if 'nombre_estacion' in df.columns else pd.Series(dtype='int64')
+    )
+    return {'estacion': est, 'hora': hora, 'nombres': nombres}
+
+
+def _combinar(acc, parcial):
+    if acc is None:
+        return parcial
+    return {
+        k: pd.concat([acc[k], parcial[k]]).groupby(level=list(range(acc[k].index.nlevels))).sum()
+        for k in acc
+    }
+
+
+def _resumen_desde_agregados(acc, key):
+    """Reconstruye station_summary (mismas columnas que el modo en memoria)."""
+    est = acc['estacion']
+    nan = pd.Series(np.nan, index=est.index)
+
+    nombre = _moda_nombres(acc['nombres'], est.index)
+
+    station_summary = pd.DataFrame({
+        'nombre_estacion': nombre,
+        'obs': est['obs'],
+        'bicis_promedio': est['bicis_sum'] / est['bicis_n'].replace(0, np.nan) if 'bicis_sum' in est else est['obs'],
+        'capacidad_promedio': est['cap_sum'] / est['cap_n'].replace(0, np.nan) if 'cap_sum' in est else est['obs'],
+        'ocupacion_promedio': est['ocup_sum'] / est['ocup_n'].replace(0, np.nan),
+        'pct_vacia': est['vacia_n'] / est['obs'] * 100 if 'vacia_n' in est else nan,
+        'pct_llena': est['llena_n'] / est['obs'] * 100 if 'llena_n' in est else nan,
+    })
+    station_summary.index.name = key
+    station_summary = station_summary.reset_index().rename(columns={key: 'id_estacion'})
+
+    hora = acc['hora']
+    medias = hora['sum'] / hora['count'].replace(0, np.nan)
+    station_summary['id_estacion'] = station_summary['id_estacion'].astype(str)
+    station_summary = station_summary.merge(_hora_pico(medias), on='id_estacion', how='left')
+
+    return _categorizar_resumen(station_summary)
+
+
+def procesar_citybike_csv_por_bloques(input_csv, output_csv=None, chunksize=100_000, salida_columnar=None):
+    """Versión en dos pasadas de procesar_citybike_csv con memoria acotada.
+
+    La memoria pico depende de `chunksize` y del número de estaciones, no del
+    tamaño del archivo. Escribe las mismas salidas pero no junta el df: devuelve
+    el resumen por estación.
+    """
+    if not output_csv and not salida_columnar:
+        raise ValueError("Indica output_csv y/o salida_columnar")
+    key_cache = {}
+
+    # --- Pasada 1: agregados por estación y (estación, hora) ---
+    acc = None
+    filas = 0
+    for chunk, key in _leer_bloques(input_csv, chunksize, key_cache):
+        with etapa('procesador', 'agregar', filas=len(chunk)):
+            acc = _combinar(acc, _agregados_parciales(chunk, key))
+        filas += len(chunk)
+    if acc is None:
+        raise ValueError(f"CSV vacío: {input_csv}")
+
+    key = key_cache['key']
+    with etapa('procesador', 'agregar'):
+        station_summary = _resumen_desde_agregados(acc, key)
+    log.info(f"Pasada 1: {filas} filas, {len(station_summary)} estaciones.")
+
+    # --- Pasada 2: enriquecer y escribir por bloques ---
+    escritas = 0
 
-    df.to_csv(output_csv, index=False, encoding='utf-8-sig')
-    print("✅ Procesado completado.")
-    print("Archivo guardado:", output_csv)
-    print("También guardado: dataframe_procesado_final.csv y station_summary_agg.csv")
-    print("Columnas guardadas:", cols_final)
+    def _enriquecidos(f):
+        nonlocal escritas
+        for i, (chunk, key) in enumerate(_leer_bloques(input_csv, chunksize, key_cache)):
+            with etapa('procesador', 'unir', filas=len(chunk)):
+                chunk = _excluir_estaciones(_enriquecer(chunk, station_summary, key), verbose=False)
+            if f is not None:
+                chunk.to_csv(f, index=False, header=(i == 0))
+            escritas += len(chunk)
+            yield chunk
 
- 
+    # en este modo 'escribir' incluye la segunda lectura (las etapas por bloque quedan anidadas)
+    f = open(output_csv, 'w', encoding='utf-8-sig', newline='') if output_csv else None
+    try:
+        with etapa('procesador', 'escribir'):
+            if salida_columnar:
+                escribir_procesado(_enriquecidos(f), salida_columnar)
+                escribir_resumen(station_summary, salida_columnar)
+            else:
+                for _ in _enriquecidos(f):
+                    pass
+    finally:
+        if f is not None:
+            f.close()
 
-    return df  # opcional: devolver el DF procesado
\ No newline at end of file
+    log.info(f"Se eliminaron {filas - escritas} filas con codigo_estacion == {', '.join(ESTACIONES_EXCLUIDAS)} (si existían).")
+    log.info("✅ Procesado por bloques completado.")
+    for salida in (salida_columnar, output_csv):
+        if salida:
+            log.info(f"💾 Archivo guardado: {salida}")
+    return station_summary
@@ -0,0 +1,153 @@
+# data_reader.py
+# Lector CSV compartido: esquema canónico, solo columnas pedidas, motor
+# pyarrow (si está instalado) y timestamps ISO-8601 con formato fijo.
+import csv
+from functools import lru_cache
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    MOTOR = 'pyarrow'
+except ImportError:
+    MOTOR = 'c'
+
+# Mapas de alias comunes -> nombre objetivo
+ALIAS_MAP = {
+    'id_estacion': ['id_estacion', 'station_id', 'stationid', 'station', 'station-id'],
+    'nombre_estacion': ['nombre_estacion', 'station_name', 'stationname', 'name'],
+    'latitud': ['lat', 'latitude', 'latitud', 'latitud_dec'],
+    'longitud': ['lon', 'lng', 'longitude', 'longitud'],
+    'capacidad': ['capacidad', 'capacity', 'dockcount', 'bike_stands', 'slots'],
+    'bicis_libres': ['bicis_libres', 'free_bikes', 'available_bikes', 'num_bikes_available'],
+    'espacios_vacios': ['espacios_vacios', 'empty_slots', 'num_docks_available', 'empty_docks'],
+    'timestamp': ['timestamp', 'scrape_timestamp', 'datetime', 'date', 'fecha_hora'],
+    'temp_c': ['temp_c', 'temp_C', 'temp', 'temperature'],
+    'vel_viento': ['vel_viento', 'wind_speed', 'windspeed'],
+    'en_miraflores': ['en_miraflores', 'in_miraflores']
+}
+
+# Esquema canónico (nombres del procesado) -> dtype al leer.
+# 'datetime': ISO-8601 con offset (2025-10-01T11:34:22.005486-05:00).
+# None: numérico inferido por el motor (conteos: int64, o float64 si hay vacíos).
+ESQUEMA = {
+    'timestamp': 'datetime',
+    'id_estacion': str,
+    'nombre_estacion': str,
+    'codigo_estacion': str,
+    'latitud': 'float64',
+    'longitud': 'float64',
+    'capacidad': None,
+    'bicis_libres': None,
+    'espacios_vacios': None,
+    'temp_c': 'float64',
+    'vel_viento': 'float64',
+    'temp_miraflores': 'float64',
+    'ocupacion': 'float64',
+    'ocupacion_promedio': 'float64',
+    'bicis_promedio': 'float64',
+    'capacidad_promedio': 'float64',
+    'day_of_week': str,
+    'dia_semana': str,
+    'fecha': str,
+    'periodo_dia': str,
+    'clima_miraflores': str,
+    'categoria_ocupacion': str,
+    'categoria_ocupacion_promedio': str,
+}
+
+
+@lru_cache(maxsize=64)
+def resolver_columnas(encabezado):
+    """Mapa {columna_original: nombre_canónico} para un encabezado (tupla).
+
+    Misma regla que el renombrado del procesador: para cada objetivo que no
+    esté ya presente se toma el primer alias encontrado (sin distinguir
+    mayúsculas). Se cachea por encabezado.
+    """
+    cols = list(encabezado)
+    renombres = {}
+    for target, aliases in ALIAS_MAP.items():
+        if target in cols:
+            continue
+        col_lower_to_orig = {c.lower(): c for c in cols}
+        for a in aliases:
+            found = col_lower_to_orig.get(a.lower())
+            if found:
+                renombres[found] = target
+                cols[cols.index(found)] = target
+                break
+    return renombres
+
+
+def leer_encabezado(path):
+    """Nombres de columna del archivo (sin BOM)."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def parse_timestamp(s):
+    """Timestamps ISO-8601 (con 'T' o espacio y offset) en una sola pasada vectorizada."""
+    return pd.to_datetime(s, format='ISO8601', errors='coerce')
+
+
+def leer_csv(path, columnas=None, normalizar=True, fechas=True, chunksize=None):
+    """Lee un CSV de CityBike con tipos explícitos.
+
+    columnas: nombres canónicos (o tal cual en el archivo) a leer; None = todas.
+    normalizar: renombrar las columnas a los nombres canónicos.
+    fechas: convertir 'timestamp' a datetime.
+    chunksize: devuelve un iterador de bloques (usa el motor C).
+    """
+    encabezado = tuple(leer_encabezado(path))
+    renombres = resolver_columnas(encabezado)
+    canonico = {c: renombres.get(c, c) for c in encabezado}
+
+    usecols = None
+    if columnas is not None:
+        pedidas = set(columnas)
+        usecols = [c for c in encabezado if c in pedidas or canonico[c] in pedidas]
+
+    dtype = {}
+    col_fecha = None
+    for c in (usecols or encabezado):
+        tipo = ESQUEMA.get(canonico[c])
+        if tipo == 'datetime':
+            col_fecha = c
+            dtype[c] = str
+        elif tipo is not None:
+            dtype[c] = tipo
+
+    def _post(df):
+        if fechas and col_fecha is not None and col_fecha in df.columns:
+            df[col_fecha] = parse_timestamp(df[col_fecha])
+        if normalizar:
+            df = df.rename(columns=renombres)
+        return df
+
+    if chunksize:
+        lector = pd.read_csv(path, usecols=usecols, dtype=dtype, encoding='utf-8-sig', chunksize=chunksize)
+        return (_post(chunk) for chunk in lector)
+    if MOTOR == 'pyarrow':
+        return _post(_leer_pyarrow(path, usecols, dtype))
+    return _post(pd.read_csv(path, usecols=usecols, dtype=dtype, encoding='utf-8-sig'))
+
+
+def _leer_pyarrow(path, usecols, dtype):
+    """Lectura multihilo con pyarrow.csv respetando los tipos declarados.
+
+    Los timestamps se piden como texto: la inferencia de Arrow los pasaría a
+    UTC y se perdería la hora local (-05:00).
+    """
+    tipos = {c: pa.string() if t is str else pa.from_numpy_dtype(t) for c, t in dtype.items()}
+    # celdas vacías en texto -> nulo, como el motor C
+    opciones = pacsv.ConvertOptions(include_columns=usecols or [], column_types=tipos,
+                                    strings_can_be_null=True)
+    tabla = pacsv.read_csv(path, convert_options=opciones)
+    df = tabla.to_pandas()
+    # columnas completamente vacías: float NaN, como el motor C
+    for campo in tabla.schema:
+        if pa.types.is_null(campo.type):
+            df[campo.name] = df[campo.name].astype('float64')
+    return df
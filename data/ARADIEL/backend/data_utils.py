@@ -1,51 +1,544 @@
 # data_utils.py
+import hashlib
+import os
+import threading
+
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
-DATA_DIR = Path(__file__).parent / 'data'
-HIST_XLSX = DATA_DIR / 'citybike_lima (5).xlsx'
+from columnar_store import firma, leer_procesado
+from compact_history import compactar_historial
+from data_reader import leer_csv, parse_timestamp, resolver_columnas
+from flows import TablaFlujos
+from forecast import Pronostico
+from history_db import AlmacenHistorial
+from metrics import cache, etapa, log
+from quantile_sketch import SketchDistribuciones
+import retention
+from rollup_cube import CuboRollup
+from station_asof import MAX_ANTIGUEDAD, IndiceTemporal
+from station_dim import DimensionEstaciones
+from station_health import SaludEstaciones
+from station_state import EstadoEstaciones
+
+DATA_DIR = Path(os.environ.get('CITYBIKE_DATA_DIR', Path(__file__).parent / 'data'))
 LIVE_CSV = DATA_DIR / 'citybike_live.csv'
+PROCESSED_CSV = DATA_DIR / 'citybike_procesado.csv'   # exportación opcional
+PROCESSED_DIR = DATA_DIR / 'procesado'                 # Parquet particionado por fecha
+STATE_NPZ = DATA_DIR / 'station_state.npz'             # estado agregado por estación
+CUBE_DIR = DATA_DIR / 'cubo'                           # cubo (estación, fecha, hora), un Parquet por fecha
+SKETCH_NPZ = DATA_DIR / 'distribuciones.npz'           # histogramas por (estación, hora)
+STATIONS_PARQUET = DATA_DIR / 'estaciones.parquet'     # dimensión de estaciones
+FORECAST_NPZ = DATA_DIR / 'pronostico.npz'             # parámetros del pronóstico
+HEALTH_NPZ = DATA_DIR / 'salud_estaciones.npz'         # detector de estaciones trabadas
+FLOWS_DIR = DATA_DIR / 'flujos'                        # eventos salidas/llegadas (Parquet por fecha)
+HISTORY_DB = DATA_DIR / 'historial.sqlite'             # almacén SQL de lecturas (estaciones + hechos)
+EXPORTS_DIR = DATA_DIR / 'exportaciones'               # xlsx generados bajo pedido (excel_export.py)
+ROLLUP_15MIN_DIR = DATA_DIR / 'rollup_15min'           # histórico vencido, medidas cada 15 min
+ROLLUP_1H_DIR = DATA_DIR / 'rollup_1h'                 # histórico largo plazo, medidas por hora
+RETENTION_TIERS = {'crudo': PROCESSED_DIR, '15min': ROLLUP_15MIN_DIR, '1h': ROLLUP_1H_DIR}
+ROLLUP_TIERS = {k: v for k, v in RETENTION_TIERS.items() if k != 'crudo'}
+# los agregados ignoran las lecturas de estaciones marcadas (estancada/inconsistente/offline)
+EXCLUIR_MARCADAS = os.environ.get('CITYBIKE_EXCLUIR_MARCADAS', '1') not in ('0', 'false')
+
+_compact_cache = {'version': None, 'data': None}
+_compact_lock = threading.Lock()
+_agg_cache = {}
+_agg_lock = threading.Lock()
+_asof_cache = {'version': None, 'indice': None}
+_asof_lock = threading.Lock()
+
+
+def history_version():
+    """Firma (mtime, tamaño) de los archivos de histórico; cambia al llegar datos nuevos."""
+    firmas = [(PROCESSED_DIR.name, *firma(PROCESSED_DIR))]
+    for p in (PROCESSED_CSV, LIVE_CSV):
+        try:
+            st = p.stat()
+            firmas.append((p.name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            firmas.append((p.name, None, None))
+    return tuple(firmas)
+
+
+def _hay_columnar():
+    return PROCESSED_DIR.exists() and any(PROCESSED_DIR.rglob('*.parquet'))
+
+
+def _filtrar_csv(df, estaciones=None, desde=None, hasta=None):
+    """Mismos filtros que leer_procesado, aplicados en memoria (CSV en vivo)."""
+    canon = {v: k for k, v in resolver_columnas(tuple(df.columns)).items()}
+    col_id = canon.get('id_estacion', 'id_estacion')
+    col_ts = canon.get('timestamp', 'timestamp')
+    mask = pd.Series(True, index=df.index)
+    if estaciones is not None and col_id in df.columns:
+        mask &= df[col_id].astype(str).isin([str(e) for e in estaciones])
+    if col_ts in df.columns and (desde is not None or hasta is not None):
+        ts = df[col_ts] if pd.api.types.is_datetime64_any_dtype(df[col_ts]) else parse_timestamp(df[col_ts])
+        for valor, op in ((desde, 'ge'), (hasta, 'le')):
+            if valor is None:
+                continue
+            limite = pd.Timestamp(valor)
+            if ts.dt.tz is not None and limite.tzinfo is None:
+                limite = limite.tz_localize(ts.dt.tz)
+            mask &= getattr(ts, op)(limite)
+    return df[mask]
 
 # === Cargar histórico completo ===
 
-def load_full_history():
-    frames = []
+def load_full_history(columnas=None, estaciones=None, desde=None, hasta=None, excluir_marcadas=False):
+    """Histórico completo: almacén SQL si existe; si no, procesado + CSV en vivo.
 
-    # 📌 Nuevo: archivo procesado como base histórica
-    PROCESSED_CSV = DATA_DIR / "citybike_procesado.csv"
+    Del almacén (HISTORY_DB) las lecturas salen con nombres canónicos; de los
+    archivos, con los nombres tal cual en cada uno. Las fechas que la
+    retención ya pasó a rollups salen una fila por cubeta (promedios de 15 min
+    o 1 h, ver _lecturas_rollup) con las columnas extra 'obs' y 'resolucion'.
+    columnas: limitar la lectura a esas columnas (nombres canónicos o del archivo).
+    estaciones / desde / hasta: filtros por id de estación y rango de timestamp;
+    en el almacén son SQL sobre la clave (estación, ts) y en el dataset
+    columnar se resuelven en el lector (particiones y row groups).
+    excluir_marcadas: quita las lecturas dentro de intervalos del detector de salud.
+    """
+    frames = []
+    filtros = dict(estaciones=estaciones, desde=desde, hasta=hasta)
+    hay_filtros = any(v is not None for v in filtros.values()) or excluir_marcadas
+    almacen = HISTORY_DB.exists()
+    if almacen and columnas is not None:
+        columnas = [resolver_columnas(tuple(columnas)).get(c, c) for c in columnas]
+    if excluir_marcadas and columnas is not None:
+        columnas, pedidas = _con_filtros(columnas, True), columnas
 
-    if PROCESSED_CSV.exists():
-        print(f"✅ Leyendo histórico procesado desde: {PROCESSED_CSV}")
-        df_hist = pd.read_csv(PROCESSED_CSV)
-        frames.append(df_hist)
+    # 📌 Almacén SQL (se mantiene al día en cada ingesta)
+    if almacen:
+        with etapa('historial', 'almacen'):
+            frames.append(AlmacenHistorial.leer(HISTORY_DB, columnas=columnas, **filtros))
     else:
-        print(f"⚠️ No se encontró el archivo histórico procesado: {PROCESSED_CSV}")
+        _leer_archivos(frames, columnas, filtros, hay_filtros)
 
-    # 📌 Datos en vivo
-    if LIVE_CSV.exists():
-        print(f"✅ Leyendo datos en vivo desde: {LIVE_CSV}")
-        dfl = pd.read_csv(LIVE_CSV)
-        frames.append(dfl)
-    else:
-        print("ℹ️ No hay archivo CSV en vivo todavía.")
+    # 📌 Fechas que ya solo están en los rollups de la retención
+    viejas = _fechas_solo_rollup(desde, hasta)
+    if viejas:
+        with etapa('historial', 'rollups'):
+            ts = frames[0]['timestamp'] if frames and 'timestamp' in frames[0].columns else None
+            tz = ts.dt.tz if ts is not None and pd.api.types.is_datetime64_any_dtype(ts) else None
+            frames.insert(0, _lecturas_rollup(viejas, columnas, estaciones, desde, hasta, tz))
 
-    # 📌 Unir ambos si existen
+    # 📌 Unir si hay datos
     if frames:
         df = pd.concat(frames, ignore_index=True)
-        print(f"✅ Dataset combinado con {df.shape[0]} registros y {df.shape[1]} columnas.")
+        if viejas and len(frames) > 1:   # columnas en el orden de las lecturas crudas
+            df = df[list(dict.fromkeys([*frames[1].columns, *frames[0].columns]))]
+        log.debug(f"✅ Dataset combinado con {df.shape[0]} registros y {df.shape[1]} columnas.")
     else:
-        print("⚠️ No se pudo cargar ningún dataset (DataFrame vacío).")
+        log.warning("⚠️ No se pudo cargar ningún dataset (DataFrame vacío).")
         df = pd.DataFrame()
 
+    if excluir_marcadas and not df.empty:
+        with etapa('historial', 'excluir_marcadas'):
+            df = df[load_station_health().mascara(df)].reset_index(drop=True)
+        log.debug(f"🩺 Sin lecturas marcadas: {df.shape[0]} registros.")
+        if columnas is not None:
+            df = _recortar(df, [*pedidas, 'obs', 'resolucion'] if viejas else pedidas, True)
     return df
 
 
+def _leer_archivos(frames, columnas, filtros, hay_filtros):
+    """Histórico procesado (Parquet o CSV) + CSV en vivo, filtrados, agregados a frames."""
+    # 📌 Nuevo: histórico procesado (Parquet; CSV si aún no se generó)
+    with etapa('historial', 'procesado'):
+        if _hay_columnar():
+            log.debug(f"✅ Leyendo histórico procesado desde: {PROCESSED_DIR}")
+            frames.append(leer_procesado(PROCESSED_DIR, columnas=columnas, **filtros))
+        elif PROCESSED_CSV.exists():
+            log.debug(f"✅ Leyendo histórico procesado desde: {PROCESSED_CSV}")
+            df_hist = leer_csv(PROCESSED_CSV, columnas=_con_filtros(columnas, hay_filtros), normalizar=False)
+            frames.append(_recortar(_filtrar_csv(df_hist, **filtros), columnas, hay_filtros))
+        else:
+            log.warning(f"⚠️ No se encontró el histórico procesado: {PROCESSED_DIR}")
+
+    # 📌 Datos en vivo
+    with etapa('historial', 'vivo'):
+        if LIVE_CSV.exists():
+            log.debug(f"✅ Leyendo datos en vivo desde: {LIVE_CSV}")
+            dfl = leer_csv(LIVE_CSV, columnas=_con_filtros(columnas, hay_filtros), normalizar=False)
+            frames.append(_recortar(_filtrar_csv(dfl, **filtros), columnas, hay_filtros))
+        else:
+            log.debug("ℹ️ No hay archivo CSV en vivo todavía.")
+
+
+def _con_filtros(columnas, hay_filtros):
+    """Columnas a leer del CSV: las pedidas más las que usan los filtros."""
+    if columnas is None or not hay_filtros:
+        return columnas
+    return list(dict.fromkeys([*columnas, 'id_estacion', 'timestamp']))
+
+
+def _recortar(df, columnas, hay_filtros):
+    """Quita las columnas que solo se leyeron para filtrar."""
+    if columnas is None or not hay_filtros:
+        return df
+    pedidas = set(columnas)
+    canon = resolver_columnas(tuple(df.columns))
+    return df[[c for c in df.columns if c in pedidas or canon.get(c, c) in pedidas]]
+
+
+# === Histórico compacto (hechos + dimensión de estaciones) ===
+
+def load_compact_history():
+    """(hechos, estaciones) con tipos angostos, cacheado por versión de datos.
+
+    Ambos archivos se leen con nombres canónicos, así procesado y en vivo
+    comparten columnas antes de compactar. Las claves de estación salen de la
+    dimensión persistida (estables entre recargas).
+    """
+    version = history_version()
+    with _compact_lock:
+        cache('historial_compacto', _compact_cache['version'] == version)
+        if _compact_cache['version'] != version:
+            frames = []
+            if _hay_columnar():
+                frames.append(leer_procesado(PROCESSED_DIR))
+            elif PROCESSED_CSV.exists():
+                frames.append(leer_csv(PROCESSED_CSV))
+            if LIVE_CSV.exists():
+                frames.append(leer_csv(LIVE_CSV))
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+                columns=['id_estacion', 'timestamp'])
+            dim = load_station_dim()
+            with _agg_lock:
+                antes = len(dim)
+                _compact_cache['data'] = compactar_historial(df, dim)
+                if len(dim) != antes:
+                    dim.guardar(STATIONS_PARQUET)
+            _compact_cache['version'] = version
+        return _compact_cache['data']
+
+
+# === Estado de la red en un instante (índice as-of por estación) ===
+
+def load_asof_index():
+    """station_asof.IndiceTemporal sobre el histórico compacto, reconstruido al cambiar los datos."""
+    version = history_version()
+    with _asof_lock:
+        cache('indice_asof', _asof_cache['version'] == version)
+        if _asof_cache['version'] != version:
+            with etapa('historial', 'indice_asof'):
+                _asof_cache['indice'] = IndiceTemporal.desde_hechos(*load_compact_history())
+            _asof_cache['version'] = version
+        return _asof_cache['indice']
+
+
+def stations_at(instante, max_antiguedad=MAX_ANTIGUEDAD, estaciones=None):
+    """Última lectura <= instante de cada estación (ver IndiceTemporal.estado_en)."""
+    return load_asof_index().estado_en(instante, max_antiguedad=max_antiguedad, estaciones=estaciones)
+
+
+# === Retención por niveles (crudo reciente, 15 min, 1 hora) ===
+
+def compact_retention(hoy=None):
+    """Baja las particiones vencidas del procesado a los rollups (retention.compactar)."""
+    with etapa('retencion', 'compactar'):
+        movidas = retention.compactar(RETENTION_TIERS, hoy)
+    if any(movidas.values()):
+        log.info(f"🗜️ Retención: {movidas['15min']} particiones a 15 min, {movidas['1h']} a 1 hora")
+    if HISTORY_DB.exists():
+        # el almacén SQL guarda lecturas crudas: mismo plazo que el nivel crudo
+        almacen = _agregado('historial')
+        with _agg_lock, etapa('retencion', 'podar_almacen'):
+            podadas = almacen.podar(retention.corte(hoy))
+            almacen.guardar(HISTORY_DB)
+        if podadas:
+            log.info(f"🗜️ Retención: {podadas} lecturas viejas borradas del almacén SQL")
+    return movidas
+
+
+def _fecha_lima(valor):
+    ts = pd.Timestamp(valor)
+    if ts is pd.NaT:
+        raise ValueError(f"Timestamp inválido: {valor}")
+    return (ts.tz_convert(retention.LIMA_TZ) if ts.tzinfo is not None else ts).strftime('%Y-%m-%d')
+
+
+def _fechas_solo_rollup(desde=None, hasta=None):
+    """Fechas (texto) que la retención ya sacó del crudo (y del almacén SQL), dentro del rango."""
+    viejas = {f for ruta in ROLLUP_TIERS.values() for f in retention.fechas(ruta)}
+    if not viejas:
+        return []
+    viejas -= set(retention.fechas(PROCESSED_DIR))   # si se reprocesó el CSV, manda el crudo
+    d = _fecha_lima(desde) if desde is not None else None
+    h = _fecha_lima(hasta) if hasta is not None else None
+    return sorted(f for f in viejas if (d is None or f >= d) and (h is None or f <= h))
+
+
+def compacted_dates(desde=None, hasta=None):
+    """Fechas del rango que ya solo quedan en los rollups (fuera del crudo y del almacén SQL)."""
+    return _fechas_solo_rollup(desde, hasta)
+
+
+def _en_fechas(df, fechas):
+    """Filas de df (timestamp con zona) cuya fecha en Lima está en fechas."""
+    if df.empty:
+        return df
+    return df[df['timestamp'].dt.tz_convert(retention.LIMA_TZ).dt.strftime('%Y-%m-%d').isin(fechas)]
+
+
+def _lecturas_rollup(fechas, columnas=None, estaciones=None, desde=None, hasta=None, tz=None):
+    """Rollups de esas fechas con forma de lecturas: bicis/capacidad/ocupación son los
+    promedios de la cubeta; nombre y ubicación, de la dimensión de estaciones."""
+    serie = _en_fechas(retention.consultar(ROLLUP_TIERS, estaciones, desde, hasta, resolucion='15min'), fechas)
+    if tz is not None and not serie.empty:
+        serie = serie.assign(timestamp=serie['timestamp'].dt.tz_convert(tz))
+    dim = load_station_dim().tabla[['id_estacion', 'nombre_estacion', 'latitud', 'longitud']]
+    df = serie.rename(columns={'bicis_promedio': 'bicis_libres', 'capacidad_promedio': 'capacidad',
+                               'ocupacion_promedio': 'ocupacion'}).merge(dim, on='id_estacion', how='left')
+    df = df[['timestamp', 'id_estacion', 'nombre_estacion', 'latitud', 'longitud', 'capacidad', 'bicis_libres',
+             'ocupacion', 'obs', 'resolucion']]
+    if columnas is not None:
+        df = df[[c for c in df.columns if c in set(columnas) or c in ('obs', 'resolucion')]]
+    return df.reset_index(drop=True)
+
+
+def load_series(estaciones=None, desde=None, hasta=None, resolucion=None):
+    """Serie por estación leyendo cada fecha del nivel que la tenga (retention.consultar)."""
+    return retention.consultar(RETENTION_TIERS, estaciones, desde, hasta, resolucion)
+
+
+def retention_summary(estaciones=None, desde=None, hasta=None):
+    """Resumen por estación sobre todo el periodo retenido (crudo + rollups)."""
+    return retention.resumen(RETENTION_TIERS, estaciones, desde, hasta)
+
+
+# === Agregados incrementales (dimensión, estado por estación, cubo, distribuciones) ===
+# Cada agregado se construye una vez desde el histórico, se persiste y luego
+# solo se le pliegan los snapshots nuevos.
+
+_AGREGADOS = {
+    'estaciones': (DimensionEstaciones, STATIONS_PARQUET),
+    'salud': (SaludEstaciones, HEALTH_NPZ),   # antes que los agregados que filtra
+    'estado': (EstadoEstaciones, STATE_NPZ),
+    'cubo': (CuboRollup, CUBE_DIR),
+    'distribuciones': (SketchDistribuciones, SKETCH_NPZ),
+    'pronostico': (Pronostico, FORECAST_NPZ),
+    'flujos': (TablaFlujos, FLOWS_DIR),
+    'historial': (AlmacenHistorial, HISTORY_DB),   # lecturas crudas consultables con SQL
+}
+
+
+def _historial_base():
+    """Histórico procesado (nombres canónicos) o None."""
+    if _hay_columnar():
+        return leer_procesado(PROCESSED_DIR)
+    if PROCESSED_CSV.exists():
+        return leer_csv(PROCESSED_CSV)
+    return None
+
+
+_SIN_FILTRO = ('estaciones', 'salud', 'historial')   # ven todas las lecturas
+
+
+def _filtrar_marcadas(salud, df):
+    """Filas de df fuera de los intervalos marcados por el detector."""
+    if df is None or not EXCLUIR_MARCADAS:
+        return df
+    return df[salud.mascara(df)]
+
+
+def _construir(nombres):
+    """Construye los agregados pedidos leyendo el histórico una sola vez."""
+    viejas = _fechas_solo_rollup()
+    if viejas:
+        log.warning(f"⚠️ El crudo ya no tiene {len(viejas)} fechas (hasta {viejas[-1]}): "
+                    f"construyendo {', '.join(nombres)} sin ellas")
+    base = _historial_base()
+    live = leer_csv(LIVE_CSV) if LIVE_CSV.exists() else None
+    # el detector va primero: sus intervalos filtran el histórico de los demás
+    if EXCLUIR_MARCADAS and 'salud' not in nombres and 'salud' not in _agg_cache \
+            and any(n not in _SIN_FILTRO for n in nombres):
+        nombres = ['salud', *nombres]
+    construidos = {}
+    for nombre in sorted(nombres, key=list(_AGREGADOS).index):
+        clase, ruta = _AGREGADOS[nombre]
+        salud = construidos.get('salud') or _agg_cache.get('salud')
+        b, l = (base, live) if nombre in _SIN_FILTRO else (_filtrar_marcadas(salud, base), _filtrar_marcadas(salud, live))
+        agregado = clase.desde_df(b) if b is not None else clase()
+        if l is not None:
+            # solo lo más nuevo que el procesado (el procesado puede venir del mismo CSV)
+            agregado.plegar(l)
+        agregado.guardar(ruta)
+        construidos[nombre] = agregado
+    return construidos
+
+
+def _agregado(nombre):
+    with _agg_lock:
+        cache('agregados', nombre in _agg_cache)
+        if nombre not in _agg_cache:
+            clase, ruta = _AGREGADOS[nombre]
+            if ruta.exists():
+                with etapa('agregados', 'cargar', agregado=nombre):
+                    _agg_cache[nombre] = clase.cargar(ruta)
+            else:
+                log.info(f"🧮 Construyendo {nombre} desde el histórico...")
+                with etapa('agregados', 'construir', agregado=nombre):
+                    _agg_cache.update(_construir([nombre]))
+        return _agg_cache[nombre]
+
+
+def load_station_dim():
+    """Dimensión de estaciones (station_dim.DimensionEstaciones); se amplía al ingerir."""
+    return _agregado('estaciones')
+
+
+def load_station_state():
+    """Estado por estación (station_state.EstadoEstaciones)."""
+    return _agregado('estado')
+
+
+def load_cube():
+    """Cubo (estación, fecha, hora, categoría) (rollup_cube.CuboRollup)."""
+    return _agregado('cubo')
+
+
+def load_distributions():
+    """Histogramas de ocupación/bicis (quantile_sketch.SketchDistribuciones)."""
+    return _agregado('distribuciones')
+
+
+def load_forecast():
+    """Pronóstico por estación (forecast.Pronostico); φ y w se reajustan con rebuild_aggregates()."""
+    return _agregado('pronostico')
+
+
+def load_flows(estaciones=None, desde=None, hasta=None):
+    """Eventos de salidas/llegadas inferidos de snapshots consecutivos (flows.TablaFlujos)."""
+    _agregado('flujos')   # los construye si aún no existen
+    with _agg_lock:       # no leer mientras una ingesta escribe o compacta
+        return TablaFlujos.leer(FLOWS_DIR, estaciones=estaciones, desde=desde, hasta=hasta)
+
+
+def load_station_health():
+    """Detector de estaciones trabadas/rotas (station_health.SaludEstaciones)."""
+    return _agregado('salud')
+
+
+def load_history_store():
+    """Almacén SQL del histórico (history_db.AlmacenHistorial); se construye la primera vez."""
+    return _agregado('historial')
+
+
+def latest_readings():
+    """Última lectura por estación con los nombres del CSV en vivo (+ avg_occupancy).
+
+    Sale del almacén SQL (una búsqueda por estación, sin leer el histórico) y
+    la ocupación promedio del estado incremental.
+    """
+    load_history_store()   # lo construye si aún no existe
+    df = AlmacenHistorial.ultimas(HISTORY_DB)
+    estado = load_station_state().escalares
+    promedio = estado['ocup_sum'] / estado['ocup_n'].replace(0, float('nan'))
+    df['avg_occupancy'] = df['id_estacion'].map(promedio)
+    return df.rename(columns={
+        'id_estacion': 'station_id', 'nombre_estacion': 'station_name', 'latitud': 'lat', 'longitud': 'lon',
+        'timestamp': 'scrape_timestamp', 'bicis_libres': 'free_bikes', 'espacios_vacios': 'empty_slots',
+        'capacidad': 'capacity',
+    })
+
+
+def station_metadata():
+    """(versión, tabla) con los atributos estáticos de cada estación, en orden de station_key.
+
+    La posición en la tabla es el índice que usan los arrays de
+    station_state_arrays(); la versión (hash del contenido) cambia solo si
+    aparece una estación o cambian sus atributos.
+    """
+    dim = load_station_dim()
+    with _agg_lock:   # la ingesta puede estar ampliando la dimensión
+        tabla = dim.tabla[['id_estacion', 'nombre_estacion', 'latitud', 'longitud', 'capacidad']].copy()
+    firma_tabla = pd.util.hash_pandas_object(tabla, index=True).to_numpy().tobytes()
+    return hashlib.sha1(firma_tabla).hexdigest()[:12], tabla
+
+
+def station_state_arrays():
+    """(versión, {free_bikes, empty_slots, avg_occupancy}) alineados con station_metadata().
+
+    Arrays float64 de largo = estaciones de la dimensión; NaN donde la
+    estación no tiene lectura.
+    """
+    version, tabla = station_metadata()
+    ultimas = latest_readings()
+    pos = pd.Index(tabla['id_estacion']).get_indexer(ultimas['station_id'])
+    ok = pos >= 0
+    arrays = {}
+    for c in ('free_bikes', 'empty_slots', 'avg_occupancy'):
+        a = np.full(len(tabla), np.nan)
+        a[pos[ok]] = pd.to_numeric(ultimas[c], errors='coerce').to_numpy(dtype='float64')[ok]
+        arrays[c] = a
+    return version, arrays
+
+
+def history_summary(estaciones=None, desde=None, hasta=None):
+    """station_summary de un rango cualquiera, agregado en SQL sobre el almacén.
+
+    Si el rango toca fechas que la retención ya sacó del almacén, se suman
+    las medidas por hora del almacén (AlmacenHistorial.medidas) a las de los
+    rollups: medias, porcentajes y hora pico salen exactos.
+    """
+    load_history_store()   # lo construye si aún no existe
+    viejas = _fechas_solo_rollup(desde, hasta)
+    if not viejas:
+        return AlmacenHistorial.resumen(HISTORY_DB, estaciones, desde, hasta)
+    with etapa('historial', 'resumen_rollups'):
+        rollups = _en_fechas(retention.leer_medidas(ROLLUP_TIERS, estaciones, desde, hasta), viejas)
+        rollups = rollups.assign(timestamp=rollups['timestamp'].dt.tz_convert(retention.LIMA_TZ))
+        medidas = pd.concat([rollups.drop(columns='resolucion'),
+                             AlmacenHistorial.medidas(HISTORY_DB, estaciones, desde, hasta)], ignore_index=True)
+        nombres = load_station_dim().tabla.set_index('id_estacion')['nombre_estacion']
+        return retention.resumen_estaciones(medidas, nombres)
+
+
+def ingest_snapshot(rows):
+    """Pliega un snapshot (filas de collect_snapshot) en todos los agregados y los persiste.
+
+    El detector de salud corre primero; las lecturas que marca no entran en
+    los agregados (salvo la dimensión de estaciones).
+    """
+    df = pd.DataFrame(rows)
+    plegadas = {}
+    limpio = df
+    for nombre, (_, ruta) in _AGREGADOS.items():
+        agregado = _agregado(nombre)
+        with _agg_lock, etapa('ingesta', nombre):
+            plegadas[nombre] = agregado.plegar(df if nombre in _SIN_FILTRO else limpio)
+            if nombre == 'salud':
+                limpio = _filtrar_marcadas(agregado, df)
+            if plegadas[nombre]:
+                agregado.guardar(ruta)
+    return plegadas
+
+
+def rebuild_aggregates():
+    """Recalcula todos los agregados desde cero (tras reprocesar el histórico).
+
+    Se niega si la retención ya sacó fechas del crudo: los agregados
+    persistidos las incluyen y el cubo, las distribuciones, el pronóstico y
+    los flujos necesitan las lecturas, que los rollups no guardan.
+    Reprocesar el CSV completo vuelve a poner esas fechas en el crudo.
+    """
+    viejas = _fechas_solo_rollup()
+    if viejas:
+        raise RuntimeError(f"El crudo ya no tiene {len(viejas)} fechas ({viejas[0]} a {viejas[-1]}), "
+                           "compactadas por la retención; reconstruir perdería esos días en los agregados. "
+                           "Reprocesa el CSV completo primero.")
+    with _agg_lock:
+        _agg_cache.update(_construir(list(_AGREGADOS)))
+
 
 # === Calcular promedio de ocupación, bicis, etc. ===
 # promedio de ocupación (por estación): ocupacion = free_bikes / capacity
 def station_average_occupancy(df):
     if df.empty:
-        print("⚠️ DataFrame vacío en station_average_occupancy()")
+        log.warning("⚠️ DataFrame vacío en station_average_occupancy()")
         return {}
 
     # Asegurar tipos numéricos
@@ -65,7 +558,7 @@ def station_average_occupancy(df):
     res = df.groupby('station_id')['avg_occupancy'].mean().to_dict()
 
     # Debug para revisar valores
-    print(f"✅ Calculados promedios de ocupación para {len(res)} estaciones")
+    log.debug(f"✅ Calculados promedios de ocupación para {len(res)} estaciones")
     return res
 
 
@@ -0,0 +1,86 @@
+# excel_export.py
+# Exportación a Excel bajo pedido: las lecturas salen del almacén SQL por
+# lotes (history_db.AlmacenHistorial.iterar_snapshots) y se escriben en un
+# libro openpyxl write_only, que manda cada fila al archivo sin armar el
+# libro en memoria. Así la memoria queda acotada por el lote, no por el
+# rango exportado. Ni la ingesta ni collector.py escriben xlsx.
+# Solo se exportan lecturas crudas: las fechas que la retención ya compactó
+# (más viejas que CITYBIKE_RETENCION_CRUDO_DIAS) no están en el almacén. Un
+# --desde anterior a eso es un error; para ese periodo, /api/timeseries.
+#
+# Uso:
+#   python excel_export.py                                    # todo el histórico
+#   python excel_export.py --desde 2025-10-01 --hasta 2025-10-07 --estacion <id>[,<id>...]
+#   python excel_export.py -o data/exportaciones/semana.xlsx
+import argparse
+from pathlib import Path
+
+from openpyxl import Workbook
+
+from history_db import SNAPSHOT, AlmacenHistorial
+
+MAX_FILAS_HOJA = 1_048_576   # límite de Excel por hoja (incluye el encabezado)
+HOJA = 'historial'
+
+
+def exportar(destino, ruta_db, estaciones=None, desde=None, hasta=None):
+    """Escribe en destino (ruta o archivo binario) las lecturas filtradas. Devuelve filas escritas.
+
+    Las columnas son las del CSV en vivo; si el rango no entra en una hoja
+    se continúa en 'historial_2', 'historial_3', ...
+    """
+    libro = Workbook(write_only=True)
+    en_miraflores = SNAPSHOT.index('in_miraflores')
+    hoja, en_hoja, total = None, MAX_FILAS_HOJA, 0
+    for fila in AlmacenHistorial.iterar_snapshots(ruta_db, estaciones, desde, hasta):
+        if en_hoja == MAX_FILAS_HOJA:
+            hoja = libro.create_sheet(HOJA if hoja is None else f'{HOJA}_{len(libro.sheetnames) + 1}')
+            hoja.append(SNAPSHOT)
+            en_hoja = 1
+        fila = list(fila)
+        if fila[en_miraflores] is not None:
+            fila[en_miraflores] = bool(fila[en_miraflores])
+        hoja.append(fila)
+        en_hoja += 1
+        total += 1
+    if hoja is None:   # sin lecturas: libro con solo el encabezado
+        libro.create_sheet(HOJA).append(SNAPSHOT)
+    libro.save(destino)
+    return total
+
+
+def nombre_archivo(estaciones=None, desde=None, hasta=None):
+    """Nombre por defecto según los filtros (citybike_lima_<desde>_<hasta>.xlsx)."""
+    partes = ['citybike_lima']
+    if desde or hasta:
+        partes += [str(desde or 'inicio')[:10], str(hasta or 'hoy')[:10]]
+    if estaciones is not None and len(estaciones) == 1:
+        partes.append(str(estaciones[0]))
+    return '_'.join(partes) + '.xlsx'
+
+
+def main():
+    from data_utils import EXPORTS_DIR, HISTORY_DB, compacted_dates, load_history_store
+
+    ap = argparse.ArgumentParser(description="Exporta el histórico del almacén SQL a Excel (xlsx)")
+    ap.add_argument('-o', '--salida', help="archivo xlsx (por defecto en data/exportaciones/)")
+    ap.add_argument('--desde', help="timestamp inicial (sin zona = hora de Lima)")
+    ap.add_argument('--hasta', help="timestamp final (sin zona = hora de Lima)")
+    ap.add_argument('--estacion', help="id de estación (varios separados por coma)")
+    args = ap.parse_args()
+
+    fuera = compacted_dates(args.desde, args.hasta)
+    if fuera and args.desde:
+        ap.error(f"--desde {args.desde}: {fuera[0]} a {fuera[-1]} ya no tienen lecturas crudas (retención)")
+    if fuera:
+        print(f"⚠️ Se exporta desde {fuera[-1]} en adelante: lo anterior ya está compactado")
+    estaciones = [e.strip() for e in args.estacion.split(',') if e.strip()] if args.estacion else None
+    salida = Path(args.salida) if args.salida else EXPORTS_DIR / nombre_archivo(estaciones, args.desde, args.hasta)
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    load_history_store()   # lo construye si aún no existe
+    filas = exportar(salida, HISTORY_DB, estaciones, args.desde, args.hasta)
+    print(f"📤 {filas} filas exportadas a {salida}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+# flows.py
+# Flujos inferidos de snapshots consecutivos: entre dos lecturas de una
+# estación, una baja de bicis_libres son retiros (salidas) y una subida son
+# devoluciones (llegadas). Solo se ve el neto del intervalo, así que son
+# cotas inferiores de los viajes reales. Se ordena una vez por (estación,
+# timestamp) y las diferencias salen de arrays desplazados.
+# Los eventos se guardan como Parquet particionado por fecha (mismo esquema
+# de carpetas que el histórico procesado); cada ingesta agrega un archivo y
+# las particiones con muchos archivos se compactan en uno.
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from columnar_store import PARTICION, _ajustar, leer_procesado
+from station_state import _preparar_filas, _utc_ns
+
+MAX_INTERVALO_H = 2        # diferencias sobre huecos más largos no se atribuyen
+UMBRAL_REBALANCEO = 5      # |Δ bicis| en un intervalo: probablemente el camión, no usuarios
+MAX_ARCHIVOS = 48          # archivos por partición antes de compactarla
+ULTIMAS = '_ultimas.parquet'   # '_' -> el dataset lo ignora al leer eventos
+NS_MINUTO = 60 * 10**9
+_SIN_MARCA = np.iinfo('int64').min
+
+
+def inferir_flujos(df, ultimas=None):
+    """Lecturas -> (eventos, última lectura por estación).
+
+    ultimas: lectura previa de cada estación (id_estacion, timestamp,
+    bicis_libres) para enlazar con lo ya procesado. Solo se emiten los
+    intervalos con cambio.
+    """
+    filas = _preparar_filas(pd.DataFrame(df))
+    filas = filas.loc[filas['timestamp'].notna() & filas['bicis_libres'].notna(),
+                      ['id_estacion', 'timestamp', 'bicis_libres']]
+    if ultimas is not None and len(ultimas):
+        previas = ultimas[ultimas['id_estacion'].isin(filas['id_estacion'].unique())]
+        filas = pd.concat([previas, filas], ignore_index=True) if len(previas) else filas
+    if filas.empty:
+        return _eventos_vacios(), filas
+
+    codigos, _ = pd.factorize(filas['id_estacion'])
+    ns = _utc_ns(filas['timestamp'])
+    orden = np.lexsort((ns, codigos))
+    codigos, ns = codigos[orden], ns[orden]
+    ids = filas['id_estacion'].to_numpy()[orden]
+    ts = filas['timestamp'].iloc[orden].reset_index(drop=True)
+    bicis = filas['bicis_libres'].to_numpy(dtype='float64')[orden]
+
+    delta = np.diff(bicis)
+    paso = np.diff(ns)
+    ok = ((codigos[1:] == codigos[:-1]) & (paso > 0) & (paso <= MAX_INTERVALO_H * 60 * NS_MINUTO)
+          & (delta != 0))
+    fin = ts.iloc[1:][ok].reset_index(drop=True)
+    eventos = pd.DataFrame({
+        'id_estacion': ids[1:][ok],
+        'desde': ts.iloc[:-1][ok].reset_index(drop=True).array,
+        'timestamp': fin.array,
+        'hora': fin.dt.hour.to_numpy(),
+        'salidas': np.clip(-delta[ok], 0, None).astype('int32'),
+        'llegadas': np.clip(delta[ok], 0, None).astype('int32'),
+        'minutos': (paso[ok] / NS_MINUTO).astype('float32'),
+        'posible_rebalanceo': np.abs(delta[ok]) >= UMBRAL_REBALANCEO,
+    })
+    # fecha de partición: se formatea una vez por día distinto
+    dias, unicos = pd.factorize(fin.dt.floor('D'))
+    eventos['fecha'] = np.asarray(unicos.strftime('%Y-%m-%d'), dtype=object)[dias] if len(eventos) else []
+
+    ultima = np.r_[codigos[1:] != codigos[:-1], True]
+    nuevas = pd.DataFrame({'id_estacion': ids[ultima], 'timestamp': ts[ultima].array,
+                           'bicis_libres': bicis[ultima]})
+    return eventos, nuevas
+
+
+def _eventos_vacios():
+    return pd.DataFrame({c: pd.Series(dtype=t) for c, t in (
+        ('id_estacion', object), ('desde', 'datetime64[ns]'), ('timestamp', 'datetime64[ns]'),
+        ('hora', 'int32'), ('salidas', 'int32'), ('llegadas', 'int32'), ('minutos', 'float32'),
+        ('posible_rebalanceo', bool), ('fecha', object))})
+
+
+# ============================================================
+# Tabla de eventos incremental
+# ============================================================
+
+class TablaFlujos:
+    """Eventos pendientes de escribir + última lectura por estación."""
+
+    def __init__(self):
+        self.ultimas = pd.DataFrame({'id_estacion': pd.Series(dtype=object),
+                                     'timestamp': pd.Series(dtype='datetime64[ns]'),
+                                     'bicis_libres': pd.Series(dtype='float64')})
+        self.pendientes = []
+        self._reescribir = True     # una tabla nueva (no cargada) reemplaza lo que haya en disco
+
+    @classmethod
+    def desde_df(cls, df):
+        tabla = cls()
+        tabla.plegar(df, respetar_marca=False)
+        return tabla
+
+    def plegar(self, df, respetar_marca=True):
+        """Infiere los eventos de las lecturas nuevas. Devuelve filas procesadas.
+
+        Con respetar_marca se ignoran las filas con timestamp <= última lectura
+        de su estación (las de `ultimas` hacen de marca por estación).
+        """
+        filas = _preparar_filas(pd.DataFrame(df))
+        ns = _utc_ns(filas['timestamp']) if len(filas) else np.zeros(0, 'int64')
+        nuevas = ns != _SIN_MARCA
+        if respetar_marca and len(self.ultimas):
+            marcas = pd.Series(_utc_ns(self.ultimas['timestamp']), index=self.ultimas['id_estacion'].to_numpy())
+            nuevas &= ns > marcas.reindex(filas['id_estacion'].to_numpy(), fill_value=_SIN_MARCA).to_numpy()
+        filas = filas[nuevas]
+        if filas.empty:
+            return 0
+        eventos, ultimas = inferir_flujos(filas, self.ultimas)
+        if len(eventos):
+            self.pendientes.append(eventos)
+        resto = self.ultimas[~self.ultimas['id_estacion'].isin(ultimas['id_estacion'])]
+        self.ultimas = pd.concat([resto, ultimas], ignore_index=True) if len(resto) else ultimas
+        return len(filas)
+
+    # --- persistencia ---
+    def guardar(self, ruta):
+        """Escribe los eventos pendientes en ruta (dataset) y la última lectura por estación."""
+        ruta = Path(ruta)
+        if self._reescribir:
+            shutil.rmtree(ruta, ignore_errors=True)
+        ruta.mkdir(parents=True, exist_ok=True)
+        if self.pendientes:
+            eventos = pd.concat(self.pendientes, ignore_index=True)
+            tabla = pa.Table.from_pandas(eventos, preserve_index=False)
+            actual = _esquema_existente(ruta)
+            if actual is not None:
+                tabla = _ajustar(tabla, actual)
+            ds.write_dataset(
+                tabla.sort_by([('fecha', 'ascending'), ('id_estacion', 'ascending'), ('timestamp', 'ascending')]),
+                ruta, format='parquet', partitioning=PARTICION,
+                basename_template=f'eventos-{time.time_ns()}-{{i}}.parquet',
+                existing_data_behavior='overwrite_or_ignore',
+                file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'))
+            for fecha in eventos['fecha'].unique():
+                _compactar(ruta / f'fecha={fecha}')
+            self.pendientes = []
+        pq.write_table(pa.Table.from_pandas(self.ultimas, preserve_index=False), ruta / ULTIMAS)
+        self._reescribir = False
+
+    @classmethod
+    def cargar(cls, ruta):
+        tabla = cls()
+        tabla._reescribir = False
+        archivo = Path(ruta) / ULTIMAS
+        if archivo.exists():
+            tabla.ultimas = pq.read_table(archivo).to_pandas()
+        return tabla
+
+    @staticmethod
+    def leer(ruta, columnas=None, estaciones=None, desde=None, hasta=None):
+        """Eventos guardados (filtros empujados al lector como en el histórico procesado)."""
+        if not any(Path(ruta).glob('fecha=*/*.parquet')):
+            return _eventos_vacios()
+        return leer_procesado(ruta, columnas=columnas, estaciones=estaciones, desde=desde, hasta=hasta)
+
+
+def _esquema_existente(ruta):
+    """Esquema de los eventos ya escritos (+ la columna de partición), para que los anexos coincidan."""
+    archivos = list(Path(ruta).glob('fecha=*/*.parquet'))
+    if not archivos:
+        return None
+    esquema = pq.read_schema(archivos[0]).remove_metadata()
+    return esquema if 'fecha' in esquema.names else esquema.append(pa.field('fecha', pa.string()))
+
+
+def _compactar(particion):
+    """Junta los archivos de una partición en uno (ordenado) si pasaron de MAX_ARCHIVOS."""
+    archivos = sorted(particion.glob('*.parquet'))
+    if len(archivos) <= MAX_ARCHIVOS:
+        return
+    tabla = pa.concat_tables([pq.read_table(a) for a in archivos])
+    tabla = tabla.sort_by([('id_estacion', 'ascending'), ('timestamp', 'ascending')])
+    tmp = particion / '_compacto.tmp'
+    pq.write_table(tabla, tmp, compression='zstd')
+    for a in archivos:
+        a.unlink()
+    tmp.rename(particion / 'eventos-compacto-0.parquet')
+
+
+# ============================================================
+# Resúmenes de demanda a partir de los eventos
+# ============================================================
+
+def resumen_flujos(eventos, sin_rebalanceo=True):
+    """Por estación: salidas, llegadas, balance y días con datos."""
+    if sin_rebalanceo and len(eventos):
+        eventos = eventos[~eventos['posible_rebalanceo'].astype(bool)]
+    g = eventos.groupby('id_estacion')
+    out = pd.DataFrame({'salidas': g['salidas'].sum(), 'llegadas': g['llegadas'].sum(),
+                        'dias': g['fecha'].nunique()})
+    out['balance'] = out['llegadas'] - out['salidas']
+    out['salidas_dia'] = out['salidas'] / out['dias'].replace(0, np.nan)
+    out['llegadas_dia'] = out['llegadas'] / out['dias'].replace(0, np.nan)
+    return out.reset_index()
+
+
+def perfil_hora_flujos(eventos, sin_rebalanceo=True):
+    """Salidas y llegadas por estación y hora del día, promedio por día del periodo."""
+    if sin_rebalanceo and len(eventos):
+        eventos = eventos[~eventos['posible_rebalanceo'].astype(bool)]
+    dias = max(eventos['fecha'].nunique(), 1) if len(eventos) else 1
+    g = eventos.groupby(['id_estacion', 'hora'])[['salidas', 'llegadas']].sum() / dias
+    return g.reset_index()
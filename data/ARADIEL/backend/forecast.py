@@ -0,0 +1,272 @@
+# forecast.py
+# Pronóstico de ocupación por estación a 1–3 horas:
+#   ocupación(t + h) = base(t + h) + residuo_actual · φ^h
+#   base = media de la estación + w · (patrón día x hora - media)
+# El patrón día de semana x hora se encoge hacia la media por hora de la
+# estación (y esta hacia la global) cuando hay pocas observaciones.
+# φ: persistencia horaria del residuo, por estación (encogida hacia la
+# global); w: peso del patrón estacional. Ambos se eligen con el error a
+# 1–3 h sobre el histórico. Todo se ajusta vectorizado para
+# todas las estaciones; los parámetros se guardan en float32 (.npz) y el
+# puntaje de todas las estaciones es una sola operación sobre arrays.
+import numpy as np
+import pandas as pd
+
+from station_state import _preparar_filas
+
+DIAS, HORAS = 7, 24
+ENCOGIMIENTO_BASE = 60   # observaciones que "pesa" la media por hora en cada celda día x hora
+ENCOGIMIENTO_PHI = 24    # pares de horas que "pesa" la φ global al encoger
+AMPLITUDES = np.linspace(0, 1, 11)   # pesos candidatos del patrón estacional
+PHIS = np.linspace(0.5, 1.0, 26)     # φ candidatas (1 = el residuo persiste)
+NS_HORA = 3_600 * 10**9
+_SIN_MARCA = np.iinfo('int64').min
+
+
+def _ns_local(ts):
+    """Timestamps -> ns de hora local (pared); así hora/día coinciden con 'hora' y 'dia'."""
+    ts = pd.Series(ts)
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)
+    return ts.astype('datetime64[ns]').to_numpy().view('int64')
+
+
+def _dia_hora(ns):
+    """ns de hora local -> (día de semana 0 = lunes, hora)."""
+    horas = np.floor_divide(ns, NS_HORA)
+    return (np.floor_divide(horas, 24) + 3) % 7, horas % 24   # 1970-01-01 fue jueves
+
+
+class Pronostico:
+    """Parámetros por estación (índice: id_estacion como texto)."""
+
+    def __init__(self):
+        self.ids = pd.Index([], dtype=object, name='id_estacion')
+        self.base = np.zeros((0, DIAS, HORAS), dtype='float32')     # media de ocupación
+        self.n = np.zeros((0, DIAS, HORAS), dtype='float32')        # observaciones por celda
+        self.phi = np.zeros(0, dtype='float32')
+        self.capacidad = np.zeros(0, dtype='float32')
+        self.ultimo_ns = np.zeros(0, dtype='int64')                 # última lectura (hora local)
+        self.ultima_ocup = np.zeros(0, dtype='float32')
+        self.phi_global = np.float32(1.0)   # sin ajuste: persistencia
+        self.amplitud = np.float32(0.0)
+
+    # --- entrenamiento ---
+    @classmethod
+    def desde_df(cls, df):
+        modelo = cls()
+        filas = modelo.plegar(df, respetar_marca=False)
+        if filas:
+            modelo.ajustar(df)
+        return modelo
+
+    def _asegurar_estaciones(self, ids):
+        nuevas = pd.Index(pd.unique(ids)).difference(self.ids)
+        if len(nuevas):
+            k = len(nuevas)
+            self.ids = self.ids.append(nuevas)
+            self.base = np.concatenate([self.base, np.zeros((k, DIAS, HORAS), 'float32')])
+            self.n = np.concatenate([self.n, np.zeros((k, DIAS, HORAS), 'float32')])
+            self.phi = np.concatenate([self.phi, np.full(k, self.phi_global, 'float32')])
+            self.capacidad = np.concatenate([self.capacidad, np.full(k, np.nan, 'float32')])
+            self.ultimo_ns = np.concatenate([self.ultimo_ns, np.full(k, _SIN_MARCA, 'int64')])
+            self.ultima_ocup = np.concatenate([self.ultima_ocup, np.full(k, np.nan, 'float32')])
+        return self.ids.get_indexer(ids)
+
+    def plegar(self, df, respetar_marca=True):
+        """Actualiza la base estacional (media acumulada) y la última lectura de cada estación.
+
+        Con respetar_marca se ignoran las filas con timestamp <= última lectura
+        de su estación (ultimo_ns hace de marca por estación).
+        """
+        filas = _preparar_filas(pd.DataFrame(df))
+        filas = filas[filas['timestamp'].notna() & filas['ocupacion'].notna()]
+        if filas.empty:
+            return 0
+        ns = _ns_local(filas['timestamp'])
+        pos = self._asegurar_estaciones(filas['id_estacion'].to_numpy())
+        if respetar_marca:
+            nuevas = ns > self.ultimo_ns[pos]
+            filas, ns, pos = filas[nuevas], ns[nuevas], pos[nuevas]
+            if filas.empty:
+                return 0
+
+        ocup = filas['ocupacion'].to_numpy(dtype='float64')
+        dia, hora = filas['dia'].to_numpy().astype(int), filas['hora'].to_numpy().astype(int)
+
+        # media acumulada por celda: base' = (base·n + suma) / (n + k)
+        plano = np.ravel_multi_index((pos, dia, hora), self.base.shape)
+        suma = np.bincount(plano, weights=ocup, minlength=self.base.size).reshape(self.base.shape)
+        k = np.bincount(plano, minlength=self.base.size).reshape(self.base.shape)
+        total = self.n.astype('float64') + k
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.base = np.where(k > 0, (self.base * self.n + suma) / total, self.base).astype('float32')
+        self.n = total.astype('float32')
+
+        # última lectura y capacidad de cada estación
+        orden = np.lexsort((ns, pos))
+        ultimo = orden[np.r_[pos[orden][1:] != pos[orden][:-1], True]]
+        p = pos[ultimo]
+        mas_nueva = ns[ultimo] >= self.ultimo_ns[p]
+        p, ultimo = p[mas_nueva], ultimo[mas_nueva]
+        self.ultimo_ns[p] = ns[ultimo]
+        self.ultima_ocup[p] = ocup[ultimo]
+        cap = filas['capacidad'].to_numpy(dtype='float64')[ultimo]
+        self.capacidad[p] = np.where(np.isnan(cap), self.capacidad[p], cap)
+        return len(filas)
+
+    def patron(self):
+        """Patrón día x hora encogido hacia la media por hora de la estación (y esta hacia la global).
+
+        celda' = (n·celda + k·media_hora) / (n + k): con pocas semanas de datos
+        cada celda día x hora es ruidosa y domina la media por hora.
+        Devuelve (patrón (estaciones, 7, 24), media por estación).
+        """
+        s, n = self.base.astype('float64') * self.n, self.n.astype('float64')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            global_hora = np.nan_to_num(s.sum(axis=(0, 1)) / n.sum(axis=(0, 1)), nan=0.5)   # (24,)
+            por_hora = (s.sum(axis=1) + ENCOGIMIENTO_BASE * global_hora) / (n.sum(axis=1) + ENCOGIMIENTO_BASE)
+            patron = (s + ENCOGIMIENTO_BASE * por_hora[:, None, :]) / (n + ENCOGIMIENTO_BASE)
+            media = np.where(n.sum(axis=(1, 2)) > 0, s.sum(axis=(1, 2)) / n.sum(axis=(1, 2)), global_hora.mean())
+        return patron, media
+
+    def base_efectiva(self, amplitud=None):
+        patron, media = self.patron()
+        w = self.amplitud if amplitud is None else amplitud
+        return media[:, None, None] + w * (patron - media[:, None, None])
+
+    def ajustar(self, df):
+        """Ajusta w (global) y φ (por estación) con el error a 1–3 h sobre el histórico.
+
+        Para cada hora de cada estación se predice la media de las horas
+        t + 1..3 desde la última lectura de la hora t, con el patrón armado solo
+        con horas anteriores (si no, cada celda se predice a sí misma y w -> 1).
+        Búsqueda en rejilla (w, φ) sobre arrays; la φ de cada estación suma a
+        su error ENCOGIMIENTO_PHI pares "promedio" del error global.
+        """
+        filas = _preparar_filas(pd.DataFrame(df))
+        filas = filas[filas['timestamp'].notna() & filas['ocupacion'].notna()]
+        if filas.empty:
+            return self
+        ns = _ns_local(filas['timestamp'])
+        tabla = pd.DataFrame({'pos': self.ids.get_indexer(filas['id_estacion'].to_numpy()),
+                              'h': np.floor_divide(ns, NS_HORA), 'ns': ns,
+                              'o': filas['ocupacion'].to_numpy(dtype='float64')})
+        g = (tabla.sort_values(['pos', 'h', 'ns'], kind='stable')
+                  .groupby(['pos', 'h'], sort=True)['o'].agg(['sum', 'count', 'last']).reset_index())
+        p, h = g['pos'].to_numpy(), g['h'].to_numpy()
+        propia_s, propia_n = g['sum'].to_numpy(), g['count'].to_numpy()
+        y_media, y_ultima = propia_s / propia_n, g['last'].to_numpy()
+        dia, hora = _dia_hora(h * NS_HORA)
+
+        # patrón "previo": en cada hora solo cuenta lo observado antes
+        # (sumas acumuladas por grupo, sin la propia hora); con el patrón
+        # completo el ajuste ve el futuro y sobreestima w
+        g['dia'], g['hora'], g['n'] = dia, hora, propia_n
+        orden = np.argsort(h, kind='stable')      # para lo que cruza estaciones
+
+        def previo(claves, c):
+            en_orden = g.iloc[orden] if 'pos' not in claves else g
+            acum = en_orden.groupby(claves, sort=False)[c].cumsum() - en_orden[c]
+            return acum.reindex(g.index).to_numpy()
+
+        k = ENCOGIMIENTO_BASE
+        global_hora = (previo(['hora'], 'sum') + k * 0.5) / (previo(['hora'], 'n') + k)
+        por_hora = ((previo(['pos', 'hora'], 'sum') + k * global_hora)
+                    / (previo(['pos', 'hora'], 'n') + k))
+        celda = ((previo(['pos', 'dia', 'hora'], 'sum') + k * por_hora)
+                 / (previo(['pos', 'dia', 'hora'], 'n') + k))
+        media = (previo(['pos'], 'sum') + k * 0.5) / (previo(['pos'], 'n') + k)
+        estacional = celda - media
+
+        # pares (t, t + k) de la misma estación, k = 1..3 horas
+        pares = []
+        for paso in (1, 2, 3):
+            i = np.flatnonzero((p[paso:] == p[:-paso]) & (h[paso:] - h[:-paso] == paso))
+            pares.append((paso, i, i + paso))
+
+        n_est = len(self.ids)
+        mejor = None
+        for w in AMPLITUDES:
+            base = media + w * estacional
+            r_t = y_ultima - base            # residuo observado en t (última lectura)
+            r_dest = y_media - base          # residuo a predecir en t + k
+            # errores (estaciones x φ) acumulados sobre horizontes
+            errores = np.zeros((n_est, len(PHIS)))
+            conteo = np.zeros(n_est)
+            for paso, i, j in pares:
+                conteo += np.bincount(p[j], minlength=n_est)
+                for c, phi in enumerate(PHIS):
+                    e = np.abs(r_dest[j] - phi ** paso * r_t[i])
+                    errores[:, c] += np.bincount(p[j], weights=e, minlength=n_est)
+            total = errores.sum(axis=0)
+            if mejor is None or total.min() < mejor[0]:
+                mejor = (total.min(), w, errores, conteo, total)
+        _, w, errores, conteo, total = mejor
+        if not conteo.sum():
+            return self   # sin pares de horas consecutivas: se queda la persistencia
+
+        c_global = int(np.argmin(total))
+        por_par = total / max(conteo.sum(), 1)
+        c_est = np.argmin(errores + ENCOGIMIENTO_PHI * por_par[None, :], axis=1)
+        self.amplitud = np.float32(w)
+        self.phi_global = np.float32(PHIS[c_global])
+        self.phi = PHIS[c_est].astype('float32')
+        return self
+
+    # --- puntaje ---
+    def pronosticar(self, horizontes=(1, 2, 3), ahora=None, estaciones=None, umbral_bicis=1):
+        """Ocupación y bicis esperadas de todas las estaciones en cada horizonte (horas).
+
+        ahora: referencia (por defecto, la última lectura recibida). Devuelve
+        dict de arrays (estaciones x horizontes) listo para serializar.
+        """
+        sel = np.arange(len(self.ids))
+        if estaciones is not None:
+            sel = self.ids.get_indexer([str(e) for e in estaciones])
+            sel = sel[sel >= 0]
+        validas = self.ultimo_ns[sel] != _SIN_MARCA
+        sel = sel[validas]
+        horizontes = np.asarray(horizontes, dtype='float64')
+        if ahora is None:
+            ref = int(self.ultimo_ns[sel].max()) if len(sel) else 0
+        else:
+            ref = int(_ns_local(pd.Series([pd.Timestamp(ahora)]))[0])
+
+        base = self.base_efectiva()
+        destino = ref + (horizontes * NS_HORA).astype('int64')                 # (H,)
+        d_dest, h_dest = _dia_hora(destino)
+        d_ult, h_ult = _dia_hora(self.ultimo_ns[sel])
+        residuo = self.ultima_ocup[sel] - base[sel, d_ult, h_ult]                # (E,)
+        horas = (destino[None, :] - self.ultimo_ns[sel][:, None]) / NS_HORA      # (E, H)
+        decaimiento = self.phi[sel][:, None] ** np.clip(horas, 0, None)
+        ocup = np.clip(base[sel][:, d_dest, h_dest] + residuo[:, None] * decaimiento, 0, 1)
+        bicis = ocup * self.capacidad[sel][:, None]
+        return {
+            'ids': self.ids[sel].tolist(),
+            'horizontes': horizontes.tolist(),
+            'referencia_ns': ref,
+            'ocupacion': ocup,
+            'bicis': bicis,
+            'se_vacia': bicis < umbral_bicis,
+        }
+
+    # --- persistencia ---
+    def guardar(self, ruta):
+        np.savez_compressed(
+            ruta, ids=self.ids.to_numpy(dtype=str),
+            base=self.base, n=self.n, phi=self.phi, capacidad=self.capacidad,
+            ultimo_ns=self.ultimo_ns, ultima_ocup=self.ultima_ocup,
+            phi_global=np.array([self.phi_global], dtype='float32'),
+            amplitud=np.array([self.amplitud], dtype='float32'))
+
+    @classmethod
+    def cargar(cls, ruta):
+        modelo = cls()
+        with np.load(ruta, allow_pickle=False) as z:
+            modelo.ids = pd.Index(z['ids'].astype(object), name='id_estacion')
+            for c in ('base', 'n', 'phi', 'capacidad', 'ultimo_ns', 'ultima_ocup'):
+                setattr(modelo, c, z[c])
+            modelo.phi_global = z['phi_global'][0]
+            modelo.amplitud = z['amplitud'][0]
+        return modelo
@@ -1,4 +1,5 @@
-from data_processor import procesar_citybike_csv
+from data_processor import procesar_citybike_csv, procesar_citybike_csv_por_bloques
+from compact_history import compactar_historial, reporte_memoria
 from pathlib import Path
 
 # 📂 Carpeta de datos
@@ -7,10 +8,27 @@ data_dir = Path(__file__).parent / "data"
 # 📥 Archivo de entrada (el CSV original crudo)
 input_file = data_dir / "citybike_lima (5).csv"   # ← pon el nombre real aquí
 
-# 💾 Archivo de salida — exactamente como tú quieres
-output_file = data_dir / "citybike_procesado.csv"
+# 💾 Salida: dataset Parquet particionado por fecha (+ station_summary_agg.parquet)
+output_dir = data_dir / "procesado"
+
+# 📄 Exportación CSV opcional (None = no exportar)
+output_file = None   # p.ej. data_dir / "citybike_procesado.csv"
+
+# 🧩 Tamaño de bloque (None = todo en memoria; p.ej. 200_000 para históricos grandes)
+chunksize = None
+
+# ⚙️ Procesos para el resumen por estación (None = CITYBIKE_PROCESOS; p.ej. 4)
+procesos = None
 
 # 🧠 Procesar
 print(f"🔸 Leyendo desde: {input_file}")
-print(f"💾 Guardando en: {output_file}")
-procesar_citybike_csv(input_file, output_file)
\ No newline at end of file
+print(f"💾 Guardando en: {output_dir}")
+if chunksize:
+    resumen = procesar_citybike_csv_por_bloques(input_file, output_file, chunksize, salida_columnar=output_dir)
+    print(f"📊 {len(resumen)} estaciones")
+else:
+    df = procesar_citybike_csv(input_file, output_file, salida_columnar=output_dir, procesos=procesos)
+
+    # 📦 Memoria del histórico procesado: representación original vs compacta
+    r = reporte_memoria(df, *compactar_historial(df))
+    print(f"📦 {r['bytes_por_fila_antes']} B/fila -> {r['bytes_por_fila_despues']} B/fila compacto (x{r['reduccion']})")
\ No newline at end of file
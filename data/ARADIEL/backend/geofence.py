@@ -0,0 +1,246 @@
+# geofence.py
+# Geocercas de zonas/distritos: polígonos desde un GeoJSON local (o, si no
+# hay archivo, el círculo de 2 km alrededor de Miraflores que usaba el
+# scraper), índice de rejilla sobre los bounding boxes y clasificación
+# vectorizada de todas las estaciones en una sola llamada. El resultado se
+# guarda por estación (dimensión de estaciones y caché del scraper), así el
+# número de zonas no agrega costo por fila ni por snapshot.
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ZONAS_GEOJSON = Path(os.environ.get('CITYBIKE_ZONAS', Path(__file__).parent / 'data' / 'zonas.geojson'))
+MIRAFLORES_CENTER = (-12.117880, -77.033043)
+MIRAFLORES_RADIUS_KM = 2.0
+ZONA_MIRAFLORES = 'Miraflores'
+SIN_ZONA = 'Sin zona'
+CLAVES_NOMBRE = ('nombre', 'name', 'NOMBDIST', 'distrito', 'DISTRITO', 'zona')
+CELDAS = 32            # rejilla CELDAS x CELDAS sobre la extensión de las zonas
+BLOQUE_ARISTAS = 2_000_000   # puntos x aristas por bloque en el test punto-en-polígono
+KM_POR_GRADO = 111.32
+
+
+def haversine_km(lat, lon, lat0, lon0):
+    """Distancia en km de cada (lat, lon) a un punto (vectorizado)."""
+    lat, lon = np.radians(np.asarray(lat, dtype='float64')), np.radians(np.asarray(lon, dtype='float64'))
+    lat0, lon0 = np.radians(lat0), np.radians(lon0)
+    a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat) * np.cos(lat0) * np.sin((lon - lon0) / 2) ** 2
+    return 2 * 6371.0 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def _dentro_anillos(lon, lat, aristas):
+    """Paridad de cruces (even-odd) de cada punto contra todas las aristas de la zona.
+
+    Con la regla par-impar los huecos y las partes de un MultiPolygon se
+    resuelven solos: basta juntar las aristas de todos los anillos.
+    """
+    x1, y1, x2, y2 = aristas
+    dentro = np.zeros(len(lon), dtype=bool)
+    paso = max(1, BLOQUE_ARISTAS // max(len(x1), 1))
+    for i in range(0, len(lon), paso):
+        px, py = lon[i:i + paso, None], lat[i:i + paso, None]
+        cruza = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_corte = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        dentro[i:i + paso] = (np.count_nonzero(cruza & (px < x_corte), axis=1) % 2) == 1
+    return dentro
+
+
+def _aristas(anillos):
+    """Anillos [(n, 2) lon/lat] -> arrays x1, y1, x2, y2 de todas las aristas."""
+    partes = [np.asarray(a, dtype='float64') for a in anillos if len(a) >= 3]
+    ini = np.concatenate(partes)
+    fin = np.concatenate([np.roll(p, -1, axis=0) for p in partes])
+    return ini[:, 0], ini[:, 1], fin[:, 0], fin[:, 1]
+
+
+class Geocerca:
+    """Zonas con nombre (polígonos o círculos) y un índice de rejilla para clasificarlas."""
+
+    def __init__(self, zonas, origen=None):
+        # zona: {'nombre', 'aristas': (x1, y1, x2, y2)} o {'nombre', 'centro', 'radio_km'}
+        self.zonas = zonas
+        self.origen = origen
+        h = hashlib.md5()
+        for z in zonas:
+            h.update(json.dumps([z['nombre'], z.get('centro'), z.get('radio_km')]).encode())
+            for a in z.get('aristas', ()):
+                h.update(a.tobytes())
+        self.version = h.hexdigest()
+        self._indexar()
+
+    # --- construcción ---
+    @classmethod
+    def desde_geojson(cls, ruta):
+        """Polygon/MultiPolygon de un FeatureCollection; el nombre sale de CLAVES_NOMBRE."""
+        datos = json.loads(Path(ruta).read_text(encoding='utf-8'))
+        features = datos.get('features', [datos] if datos.get('type') == 'Feature' else [])
+        zonas = []
+        for i, f in enumerate(features):
+            geom = f.get('geometry') or {}
+            if geom.get('type') == 'Polygon':
+                anillos = geom['coordinates']
+            elif geom.get('type') == 'MultiPolygon':
+                anillos = [anillo for poligono in geom['coordinates'] for anillo in poligono]
+            else:
+                continue
+            props = f.get('properties') or {}
+            nombre = next((str(props[k]) for k in CLAVES_NOMBRE if props.get(k)), f"zona_{i}")
+            zonas.append({'nombre': nombre, 'aristas': _aristas([[p[:2] for p in a] for a in anillos])})
+        if not zonas:
+            raise ValueError(f"El GeoJSON no tiene polígonos: {ruta}")
+        return cls(zonas, origen=str(ruta))
+
+    @classmethod
+    def circulo(cls, nombre=ZONA_MIRAFLORES, centro=MIRAFLORES_CENTER, radio_km=MIRAFLORES_RADIUS_KM):
+        """Zona circular exacta por distancia haversine (la regla original de in_miraflores)."""
+        return cls([{'nombre': nombre, 'centro': tuple(centro), 'radio_km': float(radio_km)}], origen='circulo')
+
+    def _caja(self, z):
+        """(lon_min, lat_min, lon_max, lat_max) de una zona."""
+        if 'aristas' in z:
+            x, y = z['aristas'][0], z['aristas'][1]
+            return x.min(), y.min(), x.max(), y.max()
+        lat0, lon0 = z['centro']
+        dlat = z['radio_km'] / KM_POR_GRADO
+        dlon = dlat / max(np.cos(np.radians(lat0)), 1e-6)
+        return lon0 - dlon, lat0 - dlat, lon0 + dlon, lat0 + dlat
+
+    def _indexar(self):
+        """Rejilla regular sobre la extensión total; cada celda guarda qué cajas la tocan."""
+        self.cajas = np.array([self._caja(z) for z in self.zonas], dtype='float64')
+        self.extension = (*self.cajas[:, :2].min(axis=0), *self.cajas[:, 2:].max(axis=0))
+        x0, y0, x1, y1 = self.extension
+        self._paso = (max(x1 - x0, 1e-9) / CELDAS, max(y1 - y0, 1e-9) / CELDAS)
+        self.celdas = np.zeros((CELDAS * CELDAS, len(self.zonas)), dtype=bool)
+        for j, (cx0, cy0, cx1, cy1) in enumerate(self.cajas):
+            i0, k0 = self._celda(np.array([cx0]), np.array([cy0]))
+            i1, k1 = self._celda(np.array([cx1]), np.array([cy1]))
+            ix, iy = np.meshgrid(np.arange(i0[0], i1[0] + 1), np.arange(k0[0], k1[0] + 1))
+            self.celdas[(iy * CELDAS + ix).ravel(), j] = True
+
+    def _celda(self, lon, lat):
+        x0, y0 = self.extension[:2]
+        ix = np.clip(((lon - x0) / self._paso[0]).astype(int), 0, CELDAS - 1)
+        iy = np.clip(((lat - y0) / self._paso[1]).astype(int), 0, CELDAS - 1)
+        return ix, iy
+
+    # --- consultas ---
+    def nombres(self):
+        return [z['nombre'] for z in self.zonas]
+
+    def clasificar(self, lat, lon):
+        """Zona de cada punto (primera del archivo que lo contiene) o None."""
+        lat = np.asarray(pd.to_numeric(pd.Series(lat), errors='coerce'), dtype='float64')
+        lon = np.asarray(pd.to_numeric(pd.Series(lon), errors='coerce'), dtype='float64')
+        salida = np.full(len(lat), None, dtype=object)
+        x0, y0, x1, y1 = self.extension
+        ok = ~np.isnan(lat) & ~np.isnan(lon) & (lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1)
+        idx = np.flatnonzero(ok)
+        if not len(idx):
+            return salida
+        ix, iy = self._celda(lon[idx], lat[idx])
+        candidatas = self.celdas[iy * CELDAS + ix]          # (puntos, zonas)
+        libres = np.ones(len(idx), dtype=bool)
+        for j, z in enumerate(self.zonas):
+            cx0, cy0, cx1, cy1 = self.cajas[j]
+            sel = libres & candidatas[:, j]
+            p = idx[sel]
+            sel_caja = (lon[p] >= cx0) & (lon[p] <= cx1) & (lat[p] >= cy0) & (lat[p] <= cy1)
+            p, pos = p[sel_caja], np.flatnonzero(sel)[sel_caja]
+            if not len(p):
+                continue
+            if 'aristas' in z:
+                dentro = _dentro_anillos(lon[p], lat[p], z['aristas'])
+            else:
+                dentro = haversine_km(lat[p], lon[p], *z['centro']) <= z['radio_km']
+            salida[p[dentro]] = z['nombre']
+            libres[pos[dentro]] = False
+        return salida
+
+
+# ============================================================
+# Geocerca activa y caché por estación
+# ============================================================
+
+_actual = {'firma': None, 'geocerca': None}
+_por_estacion = {}
+_lock = threading.Lock()
+
+
+def _firma_archivo():
+    try:
+        st = ZONAS_GEOJSON.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def geocerca_actual():
+    """Geocerca del GeoJSON local (recargada si cambia) o el círculo de Miraflores."""
+    firma = _firma_archivo()
+    with _lock:
+        if _actual['geocerca'] is None or _actual['firma'] != firma:
+            if firma is None:
+                _actual['geocerca'] = Geocerca.circulo()
+            else:
+                _actual['geocerca'] = Geocerca.desde_geojson(ZONAS_GEOJSON)
+                print(f"🗺️ Zonas cargadas desde {ZONAS_GEOJSON}: {len(_actual['geocerca'].zonas)}")
+            _actual['firma'] = firma
+            _por_estacion.clear()
+        return _actual['geocerca']
+
+
+def zonas_estaciones(ids, lat, lon):
+    """Zona por estación; solo las (id, lat, lon) no vistas se clasifican (en una llamada)."""
+    geocerca = geocerca_actual()
+    claves = list(zip(map(str, ids), lat, lon))
+    with _lock:
+        faltan = [k for k in dict.fromkeys(claves) if k not in _por_estacion]
+        if faltan:
+            _, la, lo = zip(*faltan)
+            _por_estacion.update(zip(faltan, geocerca.clasificar(la, lo)))
+        return [_por_estacion[k] for k in claves]
+
+
+def en_zona(zona, nombre=ZONA_MIRAFLORES):
+    return zona is not None and str(zona).strip().lower() == nombre.lower()
+
+
+# ============================================================
+# Agregados por zona (a partir de sumas por estación)
+# ============================================================
+
+def resumen_por_zona(escalares, zonas):
+    """Resumen por zona desde EstadoEstaciones.escalares (índice id_estacion)."""
+    z = pd.Series(zonas).reindex(escalares.index).fillna(SIN_ZONA).to_numpy()
+    g = escalares.groupby(z)
+    s = g.sum()
+    obs = s['obs'].replace(0, np.nan)
+    out = pd.DataFrame({
+        'estaciones': g.size(),
+        'obs': s['obs'].astype('int64'),
+        'bicis_promedio': s['bicis_sum'] / s['bicis_n'].replace(0, np.nan),
+        'ocupacion_promedio': s['ocup_sum'] / s['ocup_n'].replace(0, np.nan),
+        'pct_vacia': s['vacia_n'] / obs * 100,
+        'pct_llena': s['llena_n'] / obs * 100,
+    })
+    out.index.name = 'zona'
+    return out.reset_index()
+
+
+def perfil_hora_por_zona(hist_sum, hist_n, ids, zonas):
+    """Ocupación media por hora de cada zona (filas: zona, columnas: 0..23)."""
+    z = pd.Series(zonas).reindex(pd.Index(ids)).fillna(SIN_ZONA)
+    codigos, unicas = pd.factorize(z, sort=True)
+    s = np.zeros((len(unicas), hist_sum.shape[2]))
+    n = np.zeros_like(s)
+    np.add.at(s, codigos, hist_sum.sum(axis=1))
+    np.add.at(n, codigos, hist_n.sum(axis=1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame(s / np.where(n > 0, n, np.nan), index=pd.Index(unicas, name='zona'))
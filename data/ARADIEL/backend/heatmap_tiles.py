@@ -0,0 +1,133 @@
+# heatmap_tiles.py
+# Rejillas de calor pre-agregadas (ocupación / demanda) por nivel de zoom y
+# franja temporal, calculadas a partir del histórico y cacheadas por versión
+# de los datos.
+import hashlib
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_utils import history_version, load_compact_history
+from metrics import cache
+
+# Niveles de zoom servidos (Leaflet) y celdas por tile de 256 px en cada eje
+ZOOM_MIN, ZOOM_MAX = 10, 17
+CELDAS_POR_TILE = 8
+
+BUCKETS = ('hour', 'weekday', 'day', 'all')
+METRICS = ('occupancy', 'demand')
+
+_cache = {'version': None, 'base': None, 'grids': {}}
+_lock = threading.Lock()
+
+
+# === Preparación de puntos ===
+def _puntos_base(hechos, estaciones):
+    """lat/lon/ocupación/tiempo por snapshot a partir del histórico compacto."""
+    if hechos.empty or 'timestamp' not in hechos.columns:
+        return pd.DataFrame(columns=['lat', 'lon', 'occupancy', 'ts'])
+
+    coords = estaciones[['latitud', 'longitud']].reindex(hechos['station_key'].to_numpy())
+    pts = pd.DataFrame({
+        'lat': coords['latitud'].to_numpy(),
+        'lon': coords['longitud'].to_numpy(),
+        'occupancy': hechos['ocupacion'].clip(0, 1).astype('float64').to_numpy(),
+    }, index=hechos.index)
+    pts['ts'] = pd.to_datetime(hechos['timestamp'], utc=True).dt.tz_convert('America/Lima')
+    return pts.dropna().reset_index(drop=True)
+
+
+def _celdas(lat, lon, zoom):
+    """Índices (ix, iy) de celda Web Mercator para el zoom dado (vectorizado)."""
+    n = (2 ** zoom) * CELDAS_POR_TILE
+    lat_r = np.radians(lat)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat_r) + 1.0 / np.cos(lat_r)) / math.pi) / 2.0 * n
+    return np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+
+
+def _centro_celda(ix, iy, zoom):
+    """Centro (lat, lon) de cada celda."""
+    n = (2 ** zoom) * CELDAS_POR_TILE
+    lon = (ix + 0.5) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * (iy + 0.5) / n))))
+    return lat, lon
+
+
+def _bucket(pts, bucket):
+    if bucket == 'hour':
+        return pts['ts'].dt.hour.astype(str)
+    if bucket == 'weekday':
+        return pts['ts'].dt.dayofweek.astype(str)  # 0 = lunes
+    if bucket == 'day':
+        return pts['ts'].dt.strftime('%Y-%m-%d')
+    return pd.Series('all', index=pts.index)
+
+
+def build_grid(pts, zoom, bucket):
+    """Agrega los puntos en celdas del zoom y franja dados.
+
+    Devuelve {valor_franja: [[lat, lon, ocupacion, n], ...]}.
+    """
+    if pts.empty:
+        return {}
+
+    ix, iy = _celdas(pts['lat'].to_numpy(), pts['lon'].to_numpy(), zoom)
+    g = (
+        pd.DataFrame({'b': _bucket(pts, bucket).to_numpy(), 'ix': ix, 'iy': iy,
+                      'occ': pts['occupancy'].to_numpy()})
+        .groupby(['b', 'ix', 'iy'], sort=True)['occ']
+        .agg(['mean', 'count'])
+        .reset_index()
+    )
+    lat, lon = _centro_celda(g['ix'].to_numpy(), g['iy'].to_numpy(), zoom)
+    g['lat'] = np.round(lat, 5)
+    g['lon'] = np.round(lon, 5)
+    g['mean'] = g['mean'].round(3)
+
+    grid = {}
+    for b, sub in g.groupby('b', sort=True):
+        grid[b] = [[la, lo, v, int(n)] for la, lo, v, n in
+                   zip(sub['lat'], sub['lon'], sub['mean'], sub['count'])]
+    return grid
+
+
+# === API pública ===
+def get_heatmap(zoom, bucket='hour', metric='occupancy', value=None):
+    """Rejilla de calor para (zoom, franja), recalculada solo si cambian los datos."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket inválido: {bucket}")
+    if metric not in METRICS:
+        raise ValueError(f"metric inválida: {metric}")
+    zoom = int(min(max(int(zoom), ZOOM_MIN), ZOOM_MAX))
+
+    version = history_version()
+    with _lock:
+        if _cache['version'] != version:
+            _cache['version'] = version
+            _cache['base'] = _puntos_base(*load_compact_history())
+            _cache['grids'] = {}
+        key = (zoom, bucket)
+        cache('heatmap', key in _cache['grids'])
+        if key not in _cache['grids']:
+            _cache['grids'][key] = build_grid(_cache['base'], zoom, bucket)
+        grid = _cache['grids'][key]
+
+    if value is not None:
+        grid = {str(value): grid.get(str(value), [])}
+
+    # La demanda se deriva de la ocupación (1 - ocupación), como en el EDA
+    if metric == 'demand':
+        grid = {b: [[la, lo, round(1 - v, 3), n] for la, lo, v, n in celdas]
+                for b, celdas in grid.items()}
+
+    return {
+        'version': hashlib.md5(repr(version).encode()).hexdigest()[:12],
+        'zoom': zoom,
+        'bucket': bucket,
+        'metric': metric,
+        'fields': ['lat', 'lon', metric, 'n'],
+        'cells': grid,
+    }
@@ -0,0 +1,340 @@
+# history_db.py
+# Almacén analítico embebido del histórico (SQLite, data/historial.sqlite):
+#   estaciones  dimensión, una fila por estación con station_key entero
+#   lecturas    hechos, una fila por (station_key, ts), ts en ns UTC
+# lecturas es WITHOUT ROWID con clave primaria (station_key, ts): las lecturas
+# de cada estación quedan contiguas y ordenadas en el árbol, así una consulta
+# por estación y rango recorre solo su tramo; el índice por ts sirve los
+# rangos de toda la red. La ingesta inserta cada snapshot (INSERT OR IGNORE:
+# reintentar no duplica) y las lecturas salen con SQL parametrizado, con los
+# filtros de estación y tiempo resueltos por la base y no en pandas.
+# La vista 'snapshots' expone las columnas del CSV en vivo para los notebooks.
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_processor import BINS, LABELS, _categorizar_resumen, periodo_de_dia
+from data_reader import resolver_columnas
+from retention import MEDIDAS
+from station_dim import DimensionEstaciones
+from station_state import _preparar_filas, _utc_ns
+
+LIMA_TZ = 'America/Lima'
+OFFSET_LIMA_S = -5 * 3600   # Lima no tiene horario de verano: hora local = UTC-5
+_SIN_MARCA = np.iinfo('int64').min
+HORA_NS = 3600 * 10**9
+
+HECHOS = ['bicis_libres', 'espacios_vacios', 'capacidad', 'ocupacion', 'temp_c', 'en_miraflores']
+DIMENSION = ['id_estacion', 'nombre_estacion', 'codigo_estacion', 'latitud', 'longitud', 'capacidad', 'excluida']
+RESUMEN = ['obs', 'bicis_promedio', 'capacidad_promedio', 'ocupacion_promedio',
+           'pct_vacia', 'pct_llena', 'hora_pico', 'categoria_ocupacion_promedio']
+# mismo orden que las columnas finales del procesado
+COLUMNAS = ['timestamp', 'fecha', 'hora', 'dia_semana', 'periodo_dia',
+            'id_estacion', 'codigo_estacion', 'nombre_estacion', 'latitud', 'longitud',
+            'capacidad', 'capacidad_promedio', 'bicis_libres', 'bicis_promedio', 'espacios_vacios',
+            'ocupacion', 'ocupacion_promedio', 'categoria_ocupacion', 'categoria_ocupacion_promedio',
+            'pct_vacia', 'pct_llena', 'hora_pico', 'temp_c', 'en_miraflores']
+
+_LOCAL = f"l.ts / 1000000000, 'unixepoch', '{OFFSET_LIMA_S} seconds'"
+_DIAS = ' '.join(f"WHEN '{i}' THEN '{d}'" for i, d in enumerate(
+    ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']))
+
+# columnas del CSV en vivo (scraper.collect_snapshot) calculadas desde lecturas l + estaciones e
+SNAPSHOT = ['scrape_timestamp', 'station_id', 'station_name', 'lat', 'lon', 'capacity',
+            'free_bikes', 'empty_slots', 'day_of_week', 'temp_C', 'in_miraflores']
+_COLUMNAS_SNAPSHOT = f"""strftime('%Y-%m-%dT%H:%M:%S', {_LOCAL})
+           || printf('.%06d', l.ts / 1000 % 1000000) || '-05:00' AS scrape_timestamp,
+       e.id_estacion AS station_id, e.nombre_estacion AS station_name,
+       e.latitud AS lat, e.longitud AS lon, l.capacidad AS capacity,
+       l.bicis_libres AS free_bikes, l.espacios_vacios AS empty_slots,
+       CASE strftime('%w', {_LOCAL}) {_DIAS} END AS day_of_week,
+       l.temp_c AS temp_C, l.en_miraflores AS in_miraflores"""
+
+ESQUEMA = f"""
+CREATE TABLE IF NOT EXISTS estaciones (
+    station_key     INTEGER PRIMARY KEY,
+    id_estacion     TEXT NOT NULL UNIQUE,
+    nombre_estacion TEXT,
+    codigo_estacion TEXT,
+    latitud         REAL,
+    longitud        REAL,
+    capacidad       INTEGER,
+    excluida        INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS lecturas (
+    station_key     INTEGER NOT NULL REFERENCES estaciones (station_key),
+    ts              INTEGER NOT NULL,
+    bicis_libres    INTEGER,
+    espacios_vacios INTEGER,
+    capacidad       INTEGER,
+    ocupacion       REAL,
+    temp_c          REAL,
+    en_miraflores   INTEGER,
+    PRIMARY KEY (station_key, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lecturas_ts ON lecturas (ts);
+CREATE VIEW IF NOT EXISTS snapshots AS
+SELECT {_COLUMNAS_SNAPSHOT}
+FROM lecturas l JOIN estaciones e USING (station_key);
+"""
+
+
+def conectar(ruta, solo_lectura=False):
+    """Conexión al archivo; las de lectura no bloquean la ingesta (WAL)."""
+    if solo_lectura:
+        return sqlite3.connect(Path(ruta).resolve().as_uri() + '?mode=ro', uri=True, check_same_thread=False)
+    conn = sqlite3.connect(ruta, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _tuplas(df):
+    """Filas de df como tuplas de tipos de Python (NaN -> NULL)."""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def _booleano(s):
+    """True/False/'True'/1.0 -> 1/0 (NaN si no se reconoce)."""
+    texto = s.astype(str).str.strip().str.lower()
+    return texto.map({'true': 1, '1': 1, '1.0': 1, 'false': 0, '0': 0, '0.0': 0})
+
+
+def _limite_ns(valor):
+    """Límite de tiempo -> ns UTC (sin zona = hora de Lima, como en el procesado)."""
+    ts = pd.Timestamp(valor)
+    if ts is pd.NaT:
+        raise ValueError(f"Timestamp inválido: {valor}")
+    return (ts.tz_localize(LIMA_TZ) if ts.tzinfo is None else ts).value
+
+
+def _donde(estaciones=None, desde=None, hasta=None):
+    """Cláusula WHERE y parámetros sobre lecturas l (usa la clave primaria o el índice por ts)."""
+    cond, params = [], []
+    if estaciones is not None:
+        ids = [str(e) for e in estaciones]
+        marcas = ', '.join('?' * len(ids)) or 'NULL'
+        cond.append(f"l.station_key IN (SELECT station_key FROM estaciones WHERE id_estacion IN ({marcas}))")
+        params += ids
+    for valor, op in ((desde, '>='), (hasta, '<=')):
+        if valor is not None:
+            cond.append(f"l.ts {op} ?")
+            params.append(_limite_ns(valor))
+    return (' WHERE ' + ' AND '.join(cond)) if cond else '', params
+
+
+def _hora_local(columna='l.ts'):
+    return f"(({columna} / 1000000000 + {OFFSET_LIMA_S}) / 3600 % 24)"
+
+
+class AlmacenHistorial:
+    """Conexión al almacén con la interfaz de los agregados (desde_df/plegar/guardar/cargar)."""
+
+    def __init__(self, conn=None):
+        self._en_memoria = conn is None
+        self.conn = conn or sqlite3.connect(':memory:', check_same_thread=False)
+        self.conn.executescript(ESQUEMA)
+        self._claves = dict(self.conn.execute("SELECT id_estacion, station_key FROM estaciones"))
+
+    @classmethod
+    def desde_df(cls, df):
+        almacen = cls()
+        almacen.plegar(df)
+        return almacen
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM lecturas").fetchone()[0]
+
+    # --- ingesta ---
+    def _agregar_estaciones(self, df):
+        """Inserta en la dimensión las estaciones de df (atributos de station_dim)."""
+        tabla = DimensionEstaciones.desde_df(df).tabla
+        self.conn.executemany(
+            f"INSERT OR IGNORE INTO estaciones ({', '.join(DIMENSION)}) VALUES ({', '.join('?' * len(DIMENSION))})",
+            _tuplas(tabla[DIMENSION]))
+        self._claves = dict(self.conn.execute("SELECT id_estacion, station_key FROM estaciones"))
+
+    def plegar(self, df):
+        """Inserta las lecturas nuevas (y las estaciones que falten). Devuelve filas insertadas.
+
+        La clave primaria (station_key, ts) descarta las repetidas: un snapshot
+        tardío o parcial entra aunque otras estaciones ya tengan lecturas más
+        recientes, y reintentar uno no duplica.
+        """
+        df = pd.DataFrame(df)
+        filas = _preparar_filas(df)
+        if filas.empty:
+            return 0
+        ns = _utc_ns(filas['timestamp'])
+        nuevas = ns != _SIN_MARCA
+        if not nuevas.any():
+            return 0
+        df = df.rename(columns=resolver_columnas(tuple(df.columns)))[nuevas]
+        filas, ns = filas[nuevas], ns[nuevas]
+
+        ids = filas['id_estacion']
+        faltan = ~ids.isin(list(self._claves))
+        if faltan.any():
+            self._agregar_estaciones(df[faltan.to_numpy()])
+
+        def _col(c, fn=lambda s: pd.to_numeric(s, errors='coerce')):
+            return fn(df[c]).to_numpy() if c in df.columns else np.full(len(df), np.nan)
+
+        hechos = pd.DataFrame({
+            'station_key': ids.map(self._claves).to_numpy(),
+            'ts': ns,
+            **{c: filas[c].to_numpy() for c in ('bicis_libres', 'espacios_vacios', 'capacidad', 'ocupacion')},
+            'temp_c': _col('temp_c'),
+            'en_miraflores': _col('en_miraflores', _booleano),
+        })
+        antes = self.conn.total_changes
+        self.conn.executemany(
+            f"INSERT OR IGNORE INTO lecturas (station_key, ts, {', '.join(HECHOS)}) VALUES (?, ?, {', '.join('?' * len(HECHOS))})",
+            _tuplas(hechos))
+        return self.conn.total_changes - antes
+
+    def podar(self, antes):
+        """Borra las lecturas anteriores a `antes` (retención del nivel crudo). Devuelve cuántas."""
+        cur = self.conn.execute("DELETE FROM lecturas WHERE ts < ?", (_limite_ns(antes),))
+        return cur.rowcount
+
+    # --- persistencia ---
+    def guardar(self, ruta):
+        """Confirma los cambios; un almacén construido en memoria se copia a ruta y sigue ahí."""
+        self.conn.commit()
+        if self._en_memoria:
+            destino = conectar(ruta)
+            self.conn.backup(destino)
+            destino.execute('PRAGMA journal_mode=WAL')
+            self.conn.close()
+            self.conn, self._en_memoria = destino, False
+
+    @classmethod
+    def cargar(cls, ruta):
+        return cls(conectar(ruta))
+
+    # --- consultas (conexión de solo lectura por llamada) ---
+    @staticmethod
+    def leer(ruta, columnas=None, estaciones=None, desde=None, hasta=None):
+        """Lecturas con los nombres del procesado; filtros y columnas resueltos en SQL.
+
+        Las derivadas (fecha, hora, día, periodo, categoría) se calculan sobre el
+        resultado y las del resumen por estación con resumen() de esas estaciones.
+        """
+        pedidas = COLUMNAS if columnas is None else [c for c in COLUMNAS if c in set(columnas)]
+        de_dim = [c for c in DIMENSION[1:-2] if c in pedidas]
+        de_hechos = [c for c in HECHOS if c in pedidas or (c == 'ocupacion' and 'categoria_ocupacion' in pedidas)]
+        select = ['e.id_estacion', 'l.ts', *(f'e.{c}' for c in de_dim), *(f'l.{c}' for c in de_hechos)]
+        donde, params = _donde(estaciones, desde, hasta)
+        with closing(conectar(ruta, solo_lectura=True)) as conn:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(select)} FROM lecturas l JOIN estaciones e USING (station_key){donde}",
+                conn, params=params)
+        df = df.sort_values(['ts', 'id_estacion'], kind='stable', ignore_index=True)
+
+        ts = pd.to_datetime(df.pop('ts'), utc=True).dt.tz_convert(LIMA_TZ)
+        df['timestamp'] = ts
+        if 'fecha' in pedidas:
+            df['fecha'] = ts.dt.strftime('%Y-%m-%d')
+        if 'hora' in pedidas or 'periodo_dia' in pedidas:
+            df['hora'] = ts.dt.hour
+            df['periodo_dia'] = df['hora'].map({h: periodo_de_dia(h) for h in range(24)})
+        if 'dia_semana' in pedidas:
+            df['dia_semana'] = ts.dt.day_name()
+        if 'categoria_ocupacion' in pedidas:
+            df['categoria_ocupacion'] = pd.cut(df['ocupacion'].fillna(0), bins=BINS, labels=LABELS,
+                                               include_lowest=True).astype(str)
+        if 'en_miraflores' in df.columns:
+            df['en_miraflores'] = df['en_miraflores'].map({1: True, 0: False})
+        del_resumen = [c for c in RESUMEN if c in pedidas]
+        if del_resumen and not df.empty:
+            resumen = AlmacenHistorial.resumen(ruta, estaciones=pd.unique(df['id_estacion']))
+            df = df.merge(resumen[['id_estacion', *del_resumen]], on='id_estacion', how='left')
+        return df[[c for c in pedidas if c in df.columns]]
+
+    @staticmethod
+    def iterar_snapshots(ruta, estaciones=None, desde=None, hasta=None, lote=10_000):
+        """Filas (tuplas, columnas SNAPSHOT) en orden de tiempo, leídas por lotes.
+
+        Con fetchmany la memoria no depende del tamaño del rango.
+        """
+        donde, params = _donde(estaciones, desde, hasta)
+        with closing(conectar(ruta, solo_lectura=True)) as conn:
+            cur = conn.execute(f"SELECT {_COLUMNAS_SNAPSHOT} FROM lecturas l JOIN estaciones e "
+                               f"USING (station_key){donde} ORDER BY l.ts, e.id_estacion", params)
+            while filas := cur.fetchmany(lote):
+                yield from filas
+
+    @staticmethod
+    def resumen(ruta, estaciones=None, desde=None, hasta=None):
+        """station_summary (mismas columnas que el procesador) agregado en SQL por estación."""
+        donde, params = _donde(estaciones, desde, hasta)
+        with closing(conectar(ruta, solo_lectura=True)) as conn:
+            resumen = pd.read_sql_query(f"""
+                SELECT e.id_estacion, e.nombre_estacion, COUNT(*) AS obs,
+                       AVG(l.bicis_libres) AS bicis_promedio, AVG(l.capacidad) AS capacidad_promedio,
+                       AVG(l.ocupacion) AS ocupacion_promedio,
+                       100.0 * SUM(l.bicis_libres = 0) / COUNT(*) AS pct_vacia,
+                       100.0 * SUM(l.espacios_vacios = 0) / COUNT(*) AS pct_llena
+                FROM lecturas l JOIN estaciones e USING (station_key){donde}
+                GROUP BY l.station_key""", conn, params=params)
+            horas = pd.read_sql_query(f"""
+                SELECT l.station_key, e.id_estacion, {_hora_local()} AS hora, AVG(l.ocupacion) AS media
+                FROM lecturas l JOIN estaciones e USING (station_key){donde}
+                GROUP BY l.station_key, hora""", conn, params=params)
+        # hora de mayor ocupación media; empate -> hora menor
+        horas = horas.dropna(subset=['media']).sort_values(['id_estacion', 'media', 'hora'],
+                                                           ascending=[True, False, True])
+        pico = horas.drop_duplicates('id_estacion').set_index('id_estacion')['hora'].astype('float64')
+        resumen['hora_pico'] = resumen['id_estacion'].map(pico)
+        resumen['nombre_estacion'] = resumen['nombre_estacion'].fillna('')
+        return _categorizar_resumen(resumen.sort_values('id_estacion', ignore_index=True))
+
+    @staticmethod
+    def medidas(ruta, estaciones=None, desde=None, hasta=None):
+        """Medidas fusionables por (estación, hora), con las columnas de retention.a_medidas.
+
+        Agregadas en SQL; se suman a las de los rollups de la retención sin
+        perder exactitud (Lima no tiene horario de verano: la hora UTC
+        truncada es la hora local truncada).
+        """
+        donde, params = _donde(estaciones, desde, hasta)
+        select = [f"""TOTAL(l.{col}) AS {m}_sum, COUNT(l.{col}) AS {m}_n,
+                       MIN(l.{col}) AS {m}_min, MAX(l.{col}) AS {m}_max""" for m, col in MEDIDAS.items()]
+        with closing(conectar(ruta, solo_lectura=True)) as conn:
+            df = pd.read_sql_query(f"""
+                SELECT e.id_estacion, l.ts / {HORA_NS} * {HORA_NS} AS ts, COUNT(*) AS obs,
+                       {', '.join(select)},
+                       TOTAL(l.bicis_libres = 0) AS vacia_n, TOTAL(l.espacios_vacios = 0) AS llena_n
+                FROM lecturas l JOIN estaciones e USING (station_key){donde}
+                GROUP BY l.station_key, 2""", conn, params=params)
+        df.insert(1, 'timestamp', pd.to_datetime(df.pop('ts'), utc=True).dt.tz_convert(LIMA_TZ))
+        for c in ('vacia_n', 'llena_n'):
+            df[c] = df[c].astype('int64')
+        return df
+
+    @staticmethod
+    def ultimas(ruta, estaciones=None):
+        """Última lectura de cada estación (un descenso por la clave primaria por estación).
+
+        CROSS JOIN fija el orden de recorrido: estaciones afuera, así el
+        planificador no elige recorrer lecturas entera por el índice de ts.
+        """
+        donde, params = '', []
+        if estaciones is not None:
+            ids = [str(e) for e in estaciones]
+            donde = f" WHERE e.id_estacion IN ({', '.join('?' * len(ids)) or 'NULL'})"
+            params = ids
+        with closing(conectar(ruta, solo_lectura=True)) as conn:
+            df = pd.read_sql_query(f"""
+                SELECT e.id_estacion, e.nombre_estacion, e.latitud, e.longitud, l.ts,
+                       l.bicis_libres, l.espacios_vacios, l.capacidad, l.ocupacion
+                FROM estaciones e
+                CROSS JOIN lecturas l ON l.station_key = e.station_key
+                 AND l.ts = (SELECT MAX(ts) FROM lecturas WHERE station_key = e.station_key){donde}
+                ORDER BY e.id_estacion""", conn, params=params)
+        df.insert(4, 'timestamp', pd.to_datetime(df.pop('ts'), utc=True).dt.tz_convert(LIMA_TZ))
+        return df
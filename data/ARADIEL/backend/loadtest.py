@@ -0,0 +1,314 @@
+# loadtest.py
+# Prueba de carga de punta a punta, sin red: levanta stubs locales de
+# CityBikes, clima.com y OSRM (con latencia configurable), arranca el backend
+# en un proceso aparte apuntando a ellos y a un directorio de datos sintético,
+# y reproduce la mezcla de tráfico del dashboard (frontend/app.js) a
+# concurrencia creciente. El snapshot automático del scheduler corre en
+# paralelo (CITYBIKE_SNAPSHOT_MIN) y escribe como en producción.
+# Reporta por nivel y endpoint: req/s, p50/p90/p99 y errores; guarda el JSON
+# en bench_results/carga/ (aparte de las de tests/test_benchmarks.py).
+#
+# Uso:
+#   python loadtest.py                                   # niveles 1,2,4,8,16 x 15 s
+#   python loadtest.py -c 1,4,16,64 --duracion 30 --latencia-osrm 120 --snapshot-cada 0.5
+#   python loadtest.py --mezcla stations=1,estimate_route=3
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+
+import synthetic_data
+from geofence import haversine_km
+
+BACKEND_DIR = Path(__file__).parent
+RESULTADOS = BACKEND_DIR / 'bench_results' / 'carga'
+# app.js: al abrir el dashboard pide estaciones y redistribución; cada clic en
+# una estación pide hasta 3 rutas (una por donante)
+MEZCLA = {'stations': 3, 'redistribution': 1, 'estimate_route': 6}
+NIVELES = (1, 2, 4, 8, 16)
+PUNTOS_RUTA = 25
+
+
+# ============================================================
+# Stubs de servicios externos
+# ============================================================
+
+class _Stub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        servidor = self.server
+        time.sleep(servidor.latencia_s * random.uniform(0.8, 1.2))
+        with servidor.lock:
+            servidor.llamadas += 1
+        estado, tipo, cuerpo = servidor.responder(self.path)
+        datos = cuerpo.encode('utf-8')
+        self.send_response(estado)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, *args):
+        pass
+
+
+def servir(responder, latencia_ms):
+    """Levanta un stub en un puerto libre (hilo demonio). Devuelve (servidor, url base)."""
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), _Stub)
+    servidor.daemon_threads = True
+    servidor.responder = responder
+    servidor.latencia_s = latencia_ms / 1000
+    servidor.llamadas = 0
+    servidor.lock = threading.Lock()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def responder_citybikes(estaciones, semilla=0):
+    """Red 'citybike-lima' con las estaciones sintéticas; las bicis cambian en cada llamada."""
+    rng = np.random.default_rng(semilla)
+    lock = threading.Lock()
+    cap = estaciones['capacity'].to_numpy()
+
+    def responder(ruta):
+        with lock:
+            bicis = rng.binomial(cap, estaciones['media'].to_numpy())
+        ahora = pd.Timestamp.now(tz='UTC').isoformat()
+        red = {'network': {'id': 'citybike-lima', 'stations': [
+            {'id': s, 'name': n, 'latitude': la, 'longitude': lo, 'free_bikes': int(b),
+             'empty_slots': int(c - b), 'timestamp': ahora, 'extra': {'slots': int(c)}}
+            for s, n, la, lo, b, c in zip(estaciones['station_id'], estaciones['station_name'],
+                                          estaciones['lat'], estaciones['lon'], bicis, cap)]}}
+        return 200, 'application/json', json.dumps(red)
+    return responder
+
+
+def responder_clima(ruta):
+    html = ('<html><body><img src="nublado.png" alt="Parcialmente nublado">'
+            f'<span class="temp">{random.randint(16, 22)}°</span></body></html>')
+    return 200, 'text/html; charset=utf-8', html
+
+
+def responder_osrm(ruta):
+    """Ruta en línea recta (PUNTOS_RUTA puntos) a 30 km/h para /route/v1/driving/lon,lat;lon,lat."""
+    try:
+        coords = ruta.split('/driving/')[1].split('?')[0]
+        (lon1, lat1), (lon2, lat2) = [tuple(map(float, p.split(','))) for p in coords.split(';')]
+    except (IndexError, ValueError):
+        return 400, 'application/json', json.dumps({'code': 'InvalidQuery'})
+    km = float(haversine_km(lat1, lon1, lat2, lon2))
+    t = np.linspace(0, 1, PUNTOS_RUTA)
+    linea = np.column_stack([lon1 + (lon2 - lon1) * t, lat1 + (lat2 - lat1) * t]).round(6).tolist()
+    ruta_json = {'distance': km * 1000, 'duration': km / 30 * 3600,
+                 'geometry': {'type': 'LineString', 'coordinates': linea}, 'legs': [{'steps': []}]}
+    return 200, 'application/json', json.dumps({'code': 'Ok', 'routes': [ruta_json]})
+
+
+# ============================================================
+# Backend bajo prueba
+# ============================================================
+
+def preparar_datos(directorio, estaciones, dias, intervalo, semilla):
+    """Histórico sintético procesado (Parquet) + CSV en vivo de un día en el directorio de datos."""
+    from data_processor import procesar_citybike_csv
+
+    historico = directorio / 'citybike_sintetico.csv'
+    synthetic_data.escribir_csv(synthetic_data.generar(estaciones, dias, intervalo, semilla=semilla), historico)
+    inicio = pd.Timestamp('2025-10-01') + pd.Timedelta(days=dias)
+    synthetic_data.escribir_csv(synthetic_data.generar(estaciones, 1, intervalo, inicio=inicio, semilla=semilla),
+                                directorio / 'citybike_live.csv')
+    with open(os.devnull, 'w') as nulo:
+        salida, sys.stdout = sys.stdout, nulo
+        try:
+            procesar_citybike_csv(historico, salida_columnar=directorio / 'procesado')
+        finally:
+            sys.stdout = salida
+    historico.unlink()
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def arrancar_backend(entorno, log, espera_s=120):
+    """Corre app.py (servidor con hilos) en otro proceso y espera a que acepte conexiones."""
+    puerto = _puerto_libre()
+    codigo = ("import app; app.app.run(host='127.0.0.1', port=%d, threaded=True, debug=False, use_reloader=False)"
+              % puerto)
+    proceso = subprocess.Popen([sys.executable, '-c', codigo], cwd=BACKEND_DIR, env=entorno,
+                               stdout=log, stderr=subprocess.STDOUT)
+    limite = time.monotonic() + espera_s
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El backend terminó al arrancar (código {proceso.returncode}); ver {log.name}")
+        try:
+            with socket.create_connection(('127.0.0.1', puerto), timeout=0.5):
+                return proceso, f"http://127.0.0.1:{puerto}"
+        except OSError:
+            time.sleep(0.2)
+    proceso.kill()
+    raise RuntimeError("El backend no respondió a tiempo")
+
+
+# ============================================================
+# Generador de tráfico
+# ============================================================
+
+def _peticion(sesion, base, endpoint, estaciones, rng):
+    if endpoint == 'estimate_route':
+        i, j = rng.sample(range(len(estaciones)), 2)
+        cuerpo = {'src': {'lat': float(estaciones['lat'].iat[i]), 'lon': float(estaciones['lon'].iat[i])},
+                  'dst': {'lat': float(estaciones['lat'].iat[j]), 'lon': float(estaciones['lon'].iat[j])}}
+        return sesion.post(f"{base}/api/estimate_route", json=cuerpo, timeout=120)
+    return sesion.get(f"{base}/api/{endpoint}", timeout=120)
+
+
+def nivel(base, concurrencia, duracion_s, mezcla, estaciones, semilla=0):
+    """Corre `concurrencia` clientes durante duracion_s. Devuelve [(endpoint, latencia_s, ok)]."""
+    nombres, pesos = list(mezcla), list(mezcla.values())
+    registros = []
+    lock = threading.Lock()
+    fin = time.monotonic() + duracion_s
+
+    def cliente(k):
+        rng = random.Random(semilla * 1000 + k)
+        propios = []
+        with requests.Session() as sesion:
+            while time.monotonic() < fin:
+                endpoint = rng.choices(nombres, pesos)[0]
+                t0 = time.perf_counter()
+                try:
+                    ok = _peticion(sesion, base, endpoint, estaciones, rng).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                propios.append((endpoint, time.perf_counter() - t0, ok))
+        with lock:
+            registros.extend(propios)
+
+    hilos = [threading.Thread(target=cliente, args=(k,)) for k in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return registros
+
+
+def resumir(registros, duracion_s):
+    """Por endpoint (y total): peticiones, req/s, errores y percentiles de latencia en ms."""
+    t = pd.DataFrame(registros, columns=['endpoint', 'latencia', 'ok'])
+    salida = {}
+    for nombre, g in [*t.groupby('endpoint'), ('total', t)]:
+        lat = g['latencia'].to_numpy() * 1000
+        salida[nombre] = {
+            'peticiones': int(len(g)), 'rps': round(len(g) / duracion_s, 2),
+            'errores': int((~g['ok']).sum()),
+            **{f'p{q}_ms': round(float(np.percentile(lat, q)), 1) if len(lat) else None for q in (50, 90, 99)},
+            'max_ms': round(float(lat.max()), 1) if len(lat) else None,
+        }
+    return salida
+
+
+def _mezcla(texto):
+    if not texto:
+        return dict(MEZCLA)
+    pares = dict(p.split('=') for p in texto.split(','))
+    desconocidos = set(pares) - set(MEZCLA)
+    if desconocidos:
+        raise SystemExit(f"Endpoints desconocidos en --mezcla: {', '.join(sorted(desconocidos))}")
+    return {k: float(v) for k, v in pares.items()}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prueba de carga offline del backend (stubs de CityBikes, clima y OSRM)")
+    ap.add_argument('-c', '--concurrencias', default=','.join(map(str, NIVELES)))
+    ap.add_argument('--duracion', type=float, default=15, help="segundos por nivel")
+    ap.add_argument('--calentamiento', type=float, default=3, help="segundos a 1 cliente antes de medir")
+    ap.add_argument('--mezcla', help="pesos por endpoint, p.ej. stations=3,redistribution=1,estimate_route=6")
+    ap.add_argument('-e', '--estaciones', type=int, default=50)
+    ap.add_argument('-d', '--dias', type=int, default=10)
+    ap.add_argument('-i', '--intervalo', type=int, default=30, help="minutos entre snapshots del histórico")
+    ap.add_argument('--latencia-citybikes', type=float, default=150, help="ms")
+    ap.add_argument('--latencia-clima', type=float, default=300, help="ms")
+    ap.add_argument('--latencia-osrm', type=float, default=80, help="ms")
+    ap.add_argument('--snapshot-cada', type=float, default=0.5, help="minutos entre snapshots automáticos")
+    ap.add_argument('--semilla', type=int, default=0)
+    ap.add_argument('--conservar', action='store_true', help="no borrar el directorio temporal (datos y log)")
+    args = ap.parse_args()
+    niveles = [int(c) for c in args.concurrencias.split(',')]
+    mezcla = _mezcla(args.mezcla)
+
+    tmp = Path(tempfile.mkdtemp(prefix='citybike-carga-'))
+    estaciones = synthetic_data.estaciones_sinteticas(args.estaciones, args.semilla)
+    stubs = {
+        'citybikes': servir(responder_citybikes(estaciones, args.semilla), args.latencia_citybikes),
+        'clima': servir(responder_clima, args.latencia_clima),
+        'osrm': servir(responder_osrm, args.latencia_osrm),
+    }
+    proceso = None
+    try:
+        print(f"🧪 Preparando datos sintéticos en {tmp}...")
+        preparar_datos(tmp, args.estaciones, args.dias, args.intervalo, args.semilla)
+        entorno = {**os.environ,
+                   'CITYBIKE_DATA_DIR': str(tmp), 'CITYBIKE_DB': str(tmp / 'db.sqlite'),
+                   'CITYBIKE_CITYBIKES_URL': stubs['citybikes'][1] + '/v2/networks/citybike-lima',
+                   'CITYBIKE_CLIMA_URL': stubs['clima'][1] + '/peru/lima/miraflores-4',
+                   'CITYBIKE_OSRM_URL': stubs['osrm'][1],
+                   'CITYBIKE_SNAPSHOT_MIN': str(args.snapshot_cada)}
+        log = open(tmp / 'backend.log', 'w')
+        proceso, base = arrancar_backend(entorno, log)
+        print(f"🚀 Backend en {base} (log: {log.name})")
+        if args.calentamiento:
+            nivel(base, 1, args.calentamiento, mezcla, estaciones, args.semilla)
+
+        curvas = []
+        for c in niveles:
+            llamadas = {k: s[0].llamadas for k, s in stubs.items()}
+            registros = nivel(base, c, args.duracion, mezcla, estaciones, args.semilla + c)
+            resumen = resumir(registros, args.duracion)
+            externas = {k: s[0].llamadas - llamadas[k] for k, s in stubs.items()}
+            curvas.append({'concurrencia': c, 'endpoints': resumen, 'llamadas_externas': externas})
+            print(f"📈 c={c:<4d} total {resumen['total']['rps']:8.1f} req/s  p50 {resumen['total']['p50_ms']} ms  "
+                  f"p99 {resumen['total']['p99_ms']} ms  errores {resumen['total']['errores']}  "
+                  f"(snapshots: {externas['citybikes']})")
+            for nombre, r in resumen.items():
+                if nombre != 'total':
+                    print(f"      {nombre:16s} {r['rps']:8.1f} req/s  p50 {r['p50_ms']:>8} ms  p90 {r['p90_ms']:>8} ms  "
+                          f"p99 {r['p99_ms']:>8} ms  errores {r['errores']}")
+
+        RESULTADOS.mkdir(parents=True, exist_ok=True)
+        destino = RESULTADOS / f"carga-{pd.Timestamp.now():%Y%m%d-%H%M%S}.json"
+        destino.write_text(json.dumps({
+            'fecha': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'config': {**{k: v for k, v in vars(args).items() if k not in ('conservar', 'mezcla')}, 'mezcla': mezcla},
+            'curvas': curvas,
+        }, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"💾 Resultados: {destino}")
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            try:
+                proceso.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+        for servidor, _ in stubs.values():
+            servidor.shutdown()
+        if not args.conservar:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# metrics.py
+# Instrumentación del backend: contadores e histogramas en memoria expuestos
+# en formato de texto de Prometheus (/metrics), tiempos por etapa del
+# colector y del procesador, llamadas a servicios externos, aciertos de caché
+# y trazas opcionales en un archivo local.
+#
+# Las trazas se activan con CITYBIKE_TRAZAS=<ruta>: cada etapa se anexa como
+# evento del formato Trace Event (JSON por línea, abrible en Perfetto o
+# chrome://tracing). Los mensajes de los caminos calientes van por el logger
+# 'citybike' (nivel con CITYBIKE_LOG_LEVEL; en DEBUG se ven los de cada
+# petición).
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TRAZAS = os.environ.get('CITYBIKE_TRAZAS')
+
+log = logging.getLogger('citybike')
+if not log.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(_handler)
+    log.propagate = False
+log.setLevel(os.environ.get('CITYBIKE_LOG_LEVEL', 'INFO').upper())
+
+_registro = {}
+_lock = threading.Lock()
+
+
+# ============================================================
+# Métricas
+# ============================================================
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=()):
+    pares = [*zip(nombres, valores), *extra]
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}' if pares else ''
+
+
+class Contador:
+    """Contador monótono por combinación de etiquetas."""
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self._valores = {}
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(str(etiquetas[e]) for e in self.etiquetas)
+        with _lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def _lineas(self):
+        for clave, v in sorted(self._valores.items()):
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {v}"
+
+
+class Histograma:
+    """Histograma acumulado (buckets 'le' como en Prometheus) por etiquetas."""
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}   # clave -> [conteos por bucket (+Inf al final), suma]
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(str(etiquetas[e]) for e in self.etiquetas)
+        with _lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+
+    def _lineas(self):
+        for clave, (conteos, suma) in sorted(self._series.items()):
+            acumulado = 0
+            for limite, n in zip((*self.buckets, '+Inf'), conteos):
+                acumulado += n
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, [('le', limite)])} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {suma:.6f}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}"
+
+
+def _registrar(metrica):
+    _registro[metrica.nombre] = metrica
+    return metrica
+
+
+def exponer():
+    """Todas las métricas en el formato de texto de Prometheus (0.0.4)."""
+    lineas = []
+    with _lock:
+        for m in _registro.values():
+            lineas += [f"# HELP {m.nombre} {m.ayuda}", f"# TYPE {m.nombre} {m.tipo}", *m._lineas()]
+    return '\n'.join(lineas) + '\n'
+
+
+HTTP_SEGUNDOS = _registrar(Histograma(
+    'citybike_http_duracion_segundos', "Latencia de las peticiones por endpoint", ('endpoint', 'metodo')))
+HTTP_PETICIONES = _registrar(Contador(
+    'citybike_http_peticiones_total', "Peticiones por endpoint y código de estado", ('endpoint', 'metodo', 'estado')))
+ETAPA_SEGUNDOS = _registrar(Histograma(
+    'citybike_etapa_duracion_segundos', "Duración de cada etapa (colector, procesador, ingesta, histórico)",
+    ('proceso', 'etapa')))
+EXTERNAS = _registrar(Contador(
+    'citybike_llamadas_externas_total', "Llamadas a servicios externos (CityBikes, clima, OSRM)", ('servicio',)))
+EXTERNAS_ERRORES = _registrar(Contador(
+    'citybike_llamadas_externas_errores_total', "Llamadas externas que fallaron", ('servicio',)))
+EXTERNAS_SEGUNDOS = _registrar(Histograma(
+    'citybike_llamadas_externas_duracion_segundos', "Latencia de las llamadas externas", ('servicio',)))
+CACHE = _registrar(Contador(
+    'citybike_cache_total', "Consultas a cachés en memoria (resultado hit/miss)", ('cache', 'resultado')))
+
+
+# ============================================================
+# Trazas (archivo local, formato Trace Event)
+# ============================================================
+
+_traza_lock = threading.Lock()
+
+
+def _trazar(nombre, categoria, inicio, duracion, args=None):
+    if not TRAZAS:
+        return
+    evento = {'name': nombre, 'cat': categoria, 'ph': 'X', 'ts': round(inicio * 1e6),
+              'dur': round(duracion * 1e6), 'pid': os.getpid(), 'tid': threading.get_ident()}
+    if args:
+        evento['args'] = args
+    with _traza_lock:
+        with open(TRAZAS, 'a', encoding='utf-8') as f:
+            if f.tell() == 0:
+                f.write('[\n')   # el formato admite el arreglo sin cerrar
+            f.write(json.dumps(evento, ensure_ascii=False) + ',\n')
+
+
+# ============================================================
+# Ayudantes de instrumentación
+# ============================================================
+
+@contextmanager
+def etapa(proceso, nombre, **args):
+    """Mide el bloque como etapa `nombre` de `proceso` (histograma + traza)."""
+    t0 = time.perf_counter()
+    inicio = time.time()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - t0
+        ETAPA_SEGUNDOS.observar(duracion, proceso=proceso, etapa=nombre)
+        _trazar(f"{proceso}.{nombre}", proceso, inicio, duracion, args)
+
+
+@contextmanager
+def llamada_externa(servicio):
+    """Cuenta la llamada (y el error si el bloque lanza una excepción; se relanza)."""
+    EXTERNAS.inc(servicio=servicio)
+    t0 = time.perf_counter()
+    inicio = time.time()
+    try:
+        yield
+    except Exception:
+        EXTERNAS_ERRORES.inc(servicio=servicio)
+        raise
+    finally:
+        duracion = time.perf_counter() - t0
+        EXTERNAS_SEGUNDOS.observar(duracion, servicio=servicio)
+        _trazar(f"externa.{servicio}", 'externa', inicio, duracion)
+
+
+def cache(nombre, acierto):
+    CACHE.inc(cache=nombre, resultado='hit' if acierto else 'miss')
+
+
+def peticion(endpoint, metodo, estado, duracion, inicio):
+    """Registra una petición HTTP ya respondida."""
+    HTTP_SEGUNDOS.observar(duracion, endpoint=endpoint, metodo=metodo)
+    HTTP_PETICIONES.inc(endpoint=endpoint, metodo=metodo, estado=estado)
+    _trazar(f"{metodo} {endpoint}", 'http', inicio, duracion, {'estado': estado})
@@ -1,7 +1,8 @@
+import os
 import sqlite3
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent / 'db.sqlite'
+DB_PATH = Path(os.environ.get('CITYBIKE_DB', Path(__file__).parent / 'db.sqlite'))
 
 def init_db():
     conn = sqlite3.connect(DB_PATH)
@@ -0,0 +1,182 @@
+# parallel_stations.py
+# Ejecución por estación en varios procesos: los hechos se ordenan por
+# station_key, se publica en memoria compartida y cada proceso agrega un
+# tramo contiguo de estaciones. Los parciales se unen en orden de estación,
+# así el resultado no depende del número de procesos. El resumen por
+# estación del procesador (data_processor._resumen_estaciones_paralelo) arma
+# sus sumas con estas etapas.
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Columnas numéricas que viajan a los procesos (NaN para vacíos). La ocupación
+# va en float64 para que medias y empates de hora pico coincidan con el procesador.
+COLUMNAS = ['station_key', 'hora', 'bicis_libres', 'espacios_vacios', 'capacidad', 'ocupacion']
+
+_vistas = {}
+_bloques = []
+
+
+# ============================================================
+# Memoria compartida
+# ============================================================
+
+def _a_arrays(hechos):
+    """Arrays planos por columna, ordenados por station_key (orden estable)."""
+    orden = np.argsort(hechos['station_key'].to_numpy(), kind='stable')
+    arrays = {}
+    for c in COLUMNAS:
+        if c not in hechos.columns:
+            continue
+        s = hechos[c]
+        if c == 'station_key':
+            arrays[c] = s.to_numpy()[orden]
+        elif c == 'hora':
+            arrays[c] = s.astype('float64').fillna(-1).to_numpy(dtype='int8')[orden]
+        else:
+            dtype = 'float64' if c == 'ocupacion' else 'float32'
+            arrays[c] = s.astype('float64').to_numpy(dtype=dtype)[orden]
+    return arrays
+
+
+class MemoriaCompartida:
+    """Publica arrays numpy en bloques SharedMemory; usar como context manager."""
+
+    def __init__(self, arrays):
+        self.bloques = []
+        self.meta = {}
+        for col, arr in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+            self.bloques.append(shm)
+            self.meta[col] = (shm.name, arr.shape, arr.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for shm in self.bloques:
+            shm.close()
+            shm.unlink()
+
+
+def _iniciar_proceso(meta):
+    """Inicializador del pool: adjunta los bloques compartidos (sin copiar)."""
+    for col, (nombre, shape, dtype) in meta.items():
+        shm = shared_memory.SharedMemory(name=nombre)
+        _bloques.append(shm)
+        _vistas[col] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+# ============================================================
+# Etapas por tramo de estaciones
+# ============================================================
+
+def _tramo(inicio, fin):
+    """Vista del tramo [inicio, fin); las medidas se suman en float64."""
+    return pd.DataFrame({c: v[inicio:fin].astype('float64') if v.dtype.kind == 'f' else v[inicio:fin]
+                         for c, v in _vistas.items()})
+
+
+def _etapa_resumen(df):
+    """Sumas y conteos por estación (fusionables)."""
+    g = df.groupby('station_key', sort=True)
+    return pd.DataFrame({
+        'obs': g.size(),
+        'bicis_sum': g['bicis_libres'].sum(),
+        'bicis_n': g['bicis_libres'].count(),
+        'cap_sum': g['capacidad'].sum(),
+        'cap_n': g['capacidad'].count(),
+        'ocup_sum': g['ocupacion'].sum(),
+        'ocup_n': g['ocupacion'].count(),
+        'vacia_n': df['bicis_libres'].eq(0).groupby(df['station_key']).sum(),
+        'llena_n': df['espacios_vacios'].eq(0).groupby(df['station_key']).sum(),
+    })
+
+
+def _etapa_horas(df):
+    """Suma y conteo de ocupación por (estación, hora)."""
+    df = df[df['hora'] >= 0]
+    return df.groupby(['station_key', 'hora'], sort=True)['ocupacion'].agg(['sum', 'count'])
+
+
+ETAPAS = {
+    'resumen': _etapa_resumen,
+    'horas': _etapa_horas,
+}
+
+
+def _ejecutar_tramo(args):
+    inicio, fin, etapas = args
+    df = _tramo(inicio, fin)
+    return {e: ETAPAS[e](df) for e in etapas}
+
+
+# ============================================================
+# Particionado y ejecución
+# ============================================================
+
+def particionar(keys, n):
+    """Cortes (inicio, fin) sobre keys ordenadas, alineados a límites de estación
+    y balanceados por número de filas."""
+    if len(keys) == 0:
+        return []
+    limites = np.flatnonzero(np.diff(keys)) + 1          # inicio de cada estación
+    objetivos = np.linspace(0, len(keys), n + 1)[1:-1]
+    cortes = np.unique(limites[np.searchsorted(limites, objetivos).clip(0, len(limites) - 1)]) if len(limites) else []
+    bordes = [0, *[int(c) for c in cortes], len(keys)]
+    return [(a, b) for a, b in zip(bordes[:-1], bordes[1:]) if b > a]
+
+
+def _fusionar(parciales):
+    """Une parciales de varios tramos sumando por índice (orden determinista)."""
+    df = pd.concat(parciales)
+    return df.groupby(level=list(range(df.index.nlevels)), sort=True, observed=True).sum()
+
+
+def ejecutar_por_estacion(hechos, etapas=('resumen', 'horas'), procesos=None, tramos_por_proceso=2):
+    """Ejecuta las etapas por tramos de estaciones en un pool de procesos.
+
+    hechos: station_key entero (0..n-1) y las demás COLUMNAS. procesos=1
+    ejecuta en el proceso actual. Devuelve {etapa: DataFrame fusionado}.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    arrays = _a_arrays(hechos)
+    tramos = particionar(arrays['station_key'], procesos * tramos_por_proceso)
+    tareas = [(a, b, tuple(etapas)) for a, b in tramos]
+
+    with MemoriaCompartida(arrays) as mem:
+        if procesos == 1:
+            _iniciar_proceso(mem.meta)
+            try:
+                resultados = [_ejecutar_tramo(t) for t in tareas]
+            finally:
+                _vistas.clear()
+                while _bloques:
+                    _bloques.pop().close()
+        else:
+            with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso,
+                                     initargs=(mem.meta,)) as pool:
+                # map conserva el orden de las tareas
+                resultados = list(pool.map(_ejecutar_tramo, tareas))
+
+    return {e: _fusionar([r[e] for r in resultados]) for e in etapas}
+
+
+if __name__ == '__main__':
+    # python parallel_stations.py data/citybike_lima.csv 4 -> resumen por estación en 4 procesos
+    import sys
+    import time
+    from data_processor import _clave, _normalizar_columnas, _preparar, _resumen_estaciones_paralelo
+    from data_reader import leer_csv
+
+    ruta = sys.argv[1]
+    procesos = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    df = _preparar(_normalizar_columnas(leer_csv(ruta)), verbose=False)
+    t0 = time.perf_counter()
+    resumen = _resumen_estaciones_paralelo(df, _clave(df), procesos)
+    print(f"⚙️ {len(df)} filas, {len(resumen)} estaciones en {time.perf_counter() - t0:.2f}s")
+    print(resumen.sort_values('ocupacion_promedio').tail(10).to_string(index=False))
@@ -0,0 +1,186 @@
+# quantile_sketch.py
+# Distribuciones de ocupación y bicis libres por (estación, hora) y por día
+# de semana, en histogramas de dominio acotado que se pliegan al ingerir:
+#   - bicis_libres: entero 0..MAX_BICIS -> conteo exacto por valor
+#   - ocupacion: [0, 1] en BINS_OCUP intervalos fijos (error <= medio bin)
+# Memoria fija por estación y consultas (percentiles, histograma, boxplot)
+# que no dependen del tamaño del histórico.
+import numpy as np
+import pandas as pd
+
+from station_state import MarcasEstacion, _preparar_filas, _utc_ns
+
+MAX_BICIS = 63                 # valores mayores caen en el último bin
+BINS_OCUP = 100                # ancho 0.01
+HORAS, DIAS = 24, 7
+METRICAS = ('ocupacion', 'bicis_libres')
+
+
+def _bins(metrica, valores):
+    """Índice de bin de cada valor (NaN -> -1)."""
+    v = np.asarray(valores, dtype='float64')
+    ok = ~np.isnan(v)
+    idx = np.full(len(v), -1)
+    if metrica == 'bicis_libres':
+        idx[ok] = np.clip(np.round(v[ok]), 0, MAX_BICIS).astype(int)
+    else:
+        idx[ok] = np.clip(np.floor(v[ok] * BINS_OCUP), 0, BINS_OCUP - 1).astype(int)
+    return idx
+
+
+def _n_bins(metrica):
+    return MAX_BICIS + 1 if metrica == 'bicis_libres' else BINS_OCUP
+
+
+def bordes(metrica):
+    """Bordes de los bins (len = n_bins + 1)."""
+    if metrica == 'bicis_libres':
+        return np.arange(MAX_BICIS + 2) - 0.5
+    return np.linspace(0, 1, BINS_OCUP + 1)
+
+
+def _valores(metrica):
+    """Valor representativo de cada bin (entero exacto o centro del intervalo)."""
+    if metrica == 'bicis_libres':
+        return np.arange(MAX_BICIS + 1, dtype='float64')
+    b = bordes(metrica)
+    return (b[:-1] + b[1:]) / 2
+
+
+def percentiles(conteos, metrica, qs):
+    """Percentiles con interpolación lineal (como np.quantile) sobre el histograma.
+
+    Para bicis_libres el resultado es exacto; para ocupación, cada valor se
+    aproxima por el centro de su bin.
+    """
+    conteos = np.asarray(conteos, dtype='int64')
+    n = int(conteos.sum())
+    if n == 0:
+        return [None] * len(qs)
+    acumulado = np.cumsum(conteos)
+    vals = _valores(metrica)
+    out = []
+    for q in qs:
+        h = (n - 1) * float(q)
+        lo, hi = int(np.floor(h)), int(np.ceil(h))
+        v_lo = vals[np.searchsorted(acumulado, lo, side='right')]
+        v_hi = vals[np.searchsorted(acumulado, hi, side='right')]
+        out.append(float(v_lo + (h - lo) * (v_hi - v_lo)))
+    return out
+
+
+def boxplot(conteos, metrica):
+    """Cuartiles, bigotes (1.5·IQR, como seaborn) y extremos a partir del histograma."""
+    q1, med, q3 = percentiles(conteos, metrica, [0.25, 0.5, 0.75])
+    if med is None:
+        return None
+    vals = _valores(metrica)[np.asarray(conteos) > 0]
+    iqr = q3 - q1
+    dentro = vals[(vals >= q1 - 1.5 * iqr) & (vals <= q3 + 1.5 * iqr)]
+    return {
+        'q1': q1, 'mediana': med, 'q3': q3,
+        'bigote_inf': float(dentro.min()), 'bigote_sup': float(dentro.max()),
+        'min': float(vals.min()), 'max': float(vals.max()),
+        'n': int(np.sum(conteos)),
+    }
+
+
+class SketchDistribuciones:
+    """Histogramas por (estación, hora) y por día de semana para cada métrica."""
+
+    def __init__(self):
+        self.ids = pd.Index([], dtype=object, name='id_estacion')
+        self.por_hora = {m: np.zeros((0, HORAS, _n_bins(m)), dtype='int64') for m in METRICAS}
+        self.por_dia = {m: np.zeros((0, DIAS, _n_bins(m)), dtype='int64') for m in METRICAS}
+        self.marcas = MarcasEstacion()   # último timestamp plegado por estación (ns UTC)
+
+    @classmethod
+    def desde_df(cls, df):
+        sketch = cls()
+        sketch.plegar(df, respetar_marca=False)
+        return sketch
+
+    def _asegurar_estaciones(self, ids):
+        nuevas = pd.Index(pd.unique(ids)).difference(self.ids)
+        if len(nuevas):
+            self.ids = self.ids.append(nuevas)
+            for m in METRICAS:
+                self.por_hora[m] = np.concatenate([self.por_hora[m], np.zeros((len(nuevas), HORAS, _n_bins(m)), 'int64')])
+                self.por_dia[m] = np.concatenate([self.por_dia[m], np.zeros((len(nuevas), DIAS, _n_bins(m)), 'int64')])
+        return self.ids.get_indexer(ids)
+
+    def plegar(self, df, respetar_marca=True):
+        """Suma las filas nuevas a los histogramas (O(filas nuevas)).
+
+        Con respetar_marca se ignoran las filas con timestamp <= último plegado
+        de su estación.
+        """
+        filas = _preparar_filas(pd.DataFrame(df))
+        ts_ns = _utc_ns(filas['timestamp'])
+        validos = ts_ns != np.iinfo('int64').min
+        if respetar_marca:
+            validos &= self.marcas.nuevas(filas['id_estacion'].to_numpy(), ts_ns)
+        filas, ts_ns = filas[validos], ts_ns[validos]
+        if filas.empty:
+            return 0
+
+        pos = self._asegurar_estaciones(filas['id_estacion'].to_numpy())
+        hora = filas['hora'].to_numpy().astype(int)
+        dia = filas['dia'].to_numpy().astype(int)
+        for m in METRICAS:
+            b = _bins(m, filas[m].to_numpy())
+            ok = b >= 0
+            for destino, eje in ((self.por_hora[m], hora), (self.por_dia[m], dia)):
+                # conteo de las celdas tocadas sobre el índice plano: O(filas nuevas),
+                # no un array del tamaño del estado por métrica y snapshot
+                celdas, n = np.unique(np.ravel_multi_index((pos[ok], eje[ok], b[ok]), destino.shape),
+                                      return_counts=True)
+                destino[np.unravel_index(celdas, destino.shape)] += n   # celdas únicas: sin np.add.at
+
+        self.marcas.avanzar(filas['id_estacion'].to_numpy(), ts_ns)
+        return len(filas)
+
+    def conteos(self, metrica='ocupacion', estaciones=None, hora=None, dia_semana=None):
+        """Histograma combinado para el filtro dado (global si no se filtra)."""
+        if metrica not in METRICAS:
+            raise ValueError(f"Métrica inválida: {metrica}")
+        if hora is not None and dia_semana is not None:
+            raise ValueError("Filtra por hora o por dia_semana, no ambos")
+        sel = slice(None)
+        if estaciones is not None:
+            sel = self.ids.get_indexer([str(e) for e in estaciones])
+            sel = sel[sel >= 0]
+        if dia_semana is not None:
+            return self.por_dia[metrica][sel, int(dia_semana)].sum(axis=0)
+        h = self.por_hora[metrica][sel]
+        return (h[:, int(hora)] if hora is not None else h.sum(axis=1)).sum(axis=0)
+
+    def distribucion(self, metrica='ocupacion', qs=(0.05, 0.25, 0.5, 0.75, 0.95), **filtro):
+        """Percentiles, boxplot e histograma (bordes + conteos no vacíos)."""
+        c = self.conteos(metrica, **filtro)
+        b = bordes(metrica)
+        nz = np.flatnonzero(c)
+        return {
+            'metric': metrica,
+            'n': int(c.sum()),
+            'percentiles': dict(zip([str(q) for q in qs], percentiles(c, metrica, qs))),
+            'boxplot': boxplot(c, metrica),
+            'bins': [[float(b[i]), float(b[i + 1]), int(c[i])] for i in nz],
+        }
+
+    def guardar(self, ruta):
+        arrays = {f'hora_{m}': self.por_hora[m] for m in METRICAS}
+        arrays.update({f'dia_{m}': self.por_dia[m] for m in METRICAS})
+        np.savez_compressed(
+            ruta, ids=self.ids.to_numpy(dtype=str), **self.marcas.a_npz(), **arrays)
+
+    @classmethod
+    def cargar(cls, ruta):
+        sketch = cls()
+        with np.load(ruta, allow_pickle=False) as z:
+            sketch.ids = pd.Index(z['ids'].astype(object), name='id_estacion')
+            for m in METRICAS:
+                sketch.por_hora[m] = z[f'hora_{m}']
+                sketch.por_dia[m] = z[f'dia_{m}']
+            sketch.marcas = MarcasEstacion.desde_npz(z, sketch.ids)
+        return sketch
@@ -0,0 +1,256 @@
+# retention.py
+# Retención por niveles del histórico procesado:
+#   crudo  (data/procesado)      últimos CRUDO_DIAS días, una fila por snapshot
+#   15min  (data/rollup_15min)   hasta QUINCE_DIAS días
+#   1h     (data/rollup_1h)      sin límite
+# El job de compactación baja cada partición fecha=AAAA-MM-DD al nivel que le
+# toca según su antigüedad: escribe el rollup de la partición y recién
+# entonces borra la original. Los rollups guardan medidas fusionables (obs,
+# suma y conteo, mínimo, máximo, lecturas vacías/llenas), así uno de 15 min se
+# reagrupa por hora sin perder exactitud en medias y porcentajes.
+# Las consultas eligen el nivel por fecha (el más fino disponible) y llevan
+# todo a la resolución pedida.
+#
+# Uso:
+#   python retention.py                      # compacta con los días por defecto
+#   python retention.py --crudo-dias 14 --quince-dias 90
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from columnar_store import leer_procesado
+from data_processor import _categorizar_resumen
+from data_reader import resolver_columnas
+
+CRUDO_DIAS = int(os.environ.get('CITYBIKE_RETENCION_CRUDO_DIAS', 30))
+QUINCE_DIAS = int(os.environ.get('CITYBIKE_RETENCION_15MIN_DIAS', 365))
+LIMA_TZ = 'America/Lima'
+RESOLUCIONES = {'crudo': None, '15min': '15min', '1h': 'h'}
+# medida -> columna del histórico procesado
+MEDIDAS = {'bicis': 'bicis_libres', 'ocup': 'ocupacion', 'cap': 'capacidad'}
+ARCHIVO = 'rollup.parquet'
+
+
+# ============================================================
+# Medidas fusionables
+# ============================================================
+
+def a_medidas(df):
+    """Lecturas crudas -> una fila de medidas por lectura (obs = 1)."""
+    df = df.rename(columns=resolver_columnas(tuple(df.columns)))
+    out = pd.DataFrame({'id_estacion': df['id_estacion'].astype(str), 'timestamp': df['timestamp'],
+                        'obs': np.ones(len(df), dtype='int64')})
+    for m, col in MEDIDAS.items():
+        v = pd.to_numeric(df[col], errors='coerce') if col in df.columns else pd.Series(np.nan, index=df.index)
+        v = v.astype('float64').to_numpy()
+        out[f'{m}_sum'], out[f'{m}_n'] = np.nan_to_num(v), (~np.isnan(v)).astype('int64')
+        out[f'{m}_min'], out[f'{m}_max'] = v, v
+    for nombre, col in (('vacia_n', 'bicis_libres'), ('llena_n', 'espacios_vacios')):
+        v = pd.to_numeric(df[col], errors='coerce') if col in df.columns else pd.Series(np.nan, index=df.index)
+        out[nombre] = v.eq(0).astype('int64').to_numpy()
+    return out
+
+
+def fusionar(medidas, freq=None):
+    """Agrupa medidas por estación y cubeta de tiempo (freq) o solo por estación (freq=None)."""
+    agg = {c: ('min' if c.endswith('_min') else 'max' if c.endswith('_max') else 'sum')
+           for c in medidas.columns if c not in ('id_estacion', 'timestamp', 'fecha', 'resolucion')}
+    if freq is None:
+        return medidas.groupby('id_estacion', sort=True).agg(agg).reset_index()
+    cubeta = medidas['timestamp'].dt.floor(freq)
+    return medidas.groupby([medidas['id_estacion'], cubeta], sort=True).agg(agg).reset_index()
+
+
+def derivar(medidas):
+    """Medias y porcentajes (mismos nombres que station_summary) a partir de las medidas."""
+    obs = medidas['obs'].replace(0, np.nan)
+    out = medidas[[c for c in ('id_estacion', 'timestamp', 'resolucion') if c in medidas.columns]].copy()
+    out['obs'] = medidas['obs']
+    for m, nombre in (('bicis', 'bicis'), ('ocup', 'ocupacion'), ('cap', 'capacidad')):
+        out[f'{nombre}_promedio'] = medidas[f'{m}_sum'] / medidas[f'{m}_n'].replace(0, np.nan)
+        out[f'{nombre}_min'] = medidas[f'{m}_min']
+        out[f'{nombre}_max'] = medidas[f'{m}_max']
+    out['pct_vacia'] = medidas['vacia_n'] / obs * 100
+    out['pct_llena'] = medidas['llena_n'] / obs * 100
+    return out
+
+
+# ============================================================
+# Niveles en disco
+# ============================================================
+
+def fechas(ruta):
+    """Fechas (texto) con partición en el nivel."""
+    ruta = Path(ruta)
+    if not ruta.exists():
+        return []
+    return sorted(p.name.split('=', 1)[1] for p in ruta.glob('fecha=*') if any(p.glob('*.parquet')))
+
+
+def _leer_particion(ruta, fecha):
+    """Una partición completa (crudo o rollup) sin la columna de partición."""
+    return pq.read_table(Path(ruta) / f'fecha={fecha}').to_pandas().drop(columns='fecha', errors='ignore')
+
+
+def _escribir_particion(medidas, ruta, fecha):
+    """Reemplaza la partición del nivel (se escribe aparte y se renombra)."""
+    destino = Path(ruta) / f'fecha={fecha}'
+    tmp = Path(ruta) / f'_fecha={fecha}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    # conteos int32 y extremos float32; las sumas quedan en float64 para no acumular error
+    tipos = {c: 'int32' if c == 'obs' or c.endswith('_n') else 'float32'
+             for c in medidas.columns if c == 'obs' or c.endswith(('_n', '_min', '_max'))}
+    tabla = pa.Table.from_pandas(medidas.astype(tipos), preserve_index=False)
+    pq.write_table(tabla, tmp / ARCHIVO, compression='zstd')
+    shutil.rmtree(destino, ignore_errors=True)
+    tmp.rename(destino)
+
+
+def corte(hoy=None, dias=CRUDO_DIAS):
+    """Primera fecha (texto) que sigue en el nivel: hoy (Lima) menos `dias`."""
+    hoy = pd.Timestamp(hoy) if hoy is not None else pd.Timestamp.now(tz=LIMA_TZ).tz_localize(None)
+    return (hoy.normalize() - pd.Timedelta(days=dias)).strftime('%Y-%m-%d')
+
+
+def compactar(niveles, hoy=None, crudo_dias=CRUDO_DIAS, quince_dias=QUINCE_DIAS):
+    """Baja las particiones vencidas de cada nivel al siguiente.
+
+    niveles: {'crudo': ruta, '15min': ruta, '1h': ruta}. Una fecha cruda que ya
+    pasó ambos plazos va directo a 1h (vía 15 min, así el resultado es el mismo).
+    Devuelve cuántas particiones pasó a cada nivel.
+    """
+    corte_crudo, corte_quince = corte(hoy, crudo_dias), corte(hoy, quince_dias)
+    movidas = {'15min': 0, '1h': 0}
+
+    for fecha in fechas(niveles['crudo']):
+        if fecha >= corte_crudo:
+            continue
+        rollup = fusionar(a_medidas(_leer_particion(niveles['crudo'], fecha)), '15min')
+        if fecha < corte_quince:
+            _escribir_particion(fusionar(rollup, 'h'), niveles['1h'], fecha)
+            movidas['1h'] += 1
+        else:
+            _escribir_particion(rollup, niveles['15min'], fecha)
+            movidas['15min'] += 1
+        shutil.rmtree(Path(niveles['crudo']) / f'fecha={fecha}')
+
+    for fecha in fechas(niveles['15min']):
+        if fecha >= corte_quince:
+            continue
+        _escribir_particion(fusionar(_leer_particion(niveles['15min'], fecha), 'h'), niveles['1h'], fecha)
+        shutil.rmtree(Path(niveles['15min']) / f'fecha={fecha}')
+        movidas['1h'] += 1
+    return movidas
+
+
+# ============================================================
+# Consultas
+# ============================================================
+
+def resolucion_auto(desde, hasta):
+    """Resolución por defecto según el largo del rango (acota las filas devueltas)."""
+    if desde is None or hasta is None:
+        return '1h'
+    dias = (pd.Timestamp(hasta) - pd.Timestamp(desde)) / pd.Timedelta(days=1)
+    return 'crudo' if dias <= 2 else '15min' if dias <= 31 else '1h'
+
+
+def leer_medidas(niveles, estaciones=None, desde=None, hasta=None):
+    """Medidas de todos los niveles en el rango; cada fecha sale del nivel más fino que la tenga.
+
+    Columna 'resolucion' con el nivel de origen de cada fila. Los niveles que
+    no estén en `niveles` se saltan (p. ej. solo los rollups).
+    """
+    frames, vistas = [], set()
+    for nombre in RESOLUCIONES:
+        ruta = niveles.get(nombre)
+        if ruta is None:
+            continue
+        propias = [f for f in fechas(ruta) if f not in vistas]
+        vistas.update(propias)
+        if not propias:
+            continue
+        columnas = ['id_estacion', 'timestamp', 'fecha', 'espacios_vacios', *MEDIDAS.values()] if nombre == 'crudo' else None
+        df = leer_procesado(ruta, columnas=columnas, estaciones=estaciones, desde=desde, hasta=hasta)
+        if 'fecha' in df.columns:
+            df = df[df['fecha'].astype(str).isin(propias)]
+        if df.empty:
+            continue
+        m = a_medidas(df) if nombre == 'crudo' else df.drop(columns='fecha', errors='ignore')
+        frames.append(m.assign(resolucion=nombre))
+    if not frames:
+        return a_medidas(pd.DataFrame(columns=['id_estacion', 'timestamp'])).assign(resolucion=pd.Series(dtype=object))
+    return pd.concat(frames, ignore_index=True)
+
+
+def consultar(niveles, estaciones=None, desde=None, hasta=None, resolucion=None):
+    """Serie por estación a la resolución pedida ('crudo', '15min', '1h'; None = según el rango).
+
+    Los niveles más finos se reagrupan; las fechas que solo quedan en un
+    nivel más grueso salen a esa resolución (columna 'resolucion').
+    """
+    resolucion = resolucion or resolucion_auto(desde, hasta)
+    if resolucion not in RESOLUCIONES:
+        raise ValueError(f"resolución inválida: {resolucion} (use {', '.join(RESOLUCIONES)})")
+    medidas = leer_medidas(niveles, estaciones, desde, hasta)
+    orden = list(RESOLUCIONES)
+    partes = []
+    for nombre, g in medidas.groupby('resolucion', sort=False):
+        if orden.index(nombre) < orden.index(resolucion):
+            g = fusionar(g, RESOLUCIONES[resolucion]).assign(resolucion=resolucion)
+        partes.append(g)
+    out = pd.concat(partes, ignore_index=True) if partes else medidas
+    return derivar(out).sort_values(['id_estacion', 'timestamp'], ignore_index=True)
+
+
+def resumen(niveles, estaciones=None, desde=None, hasta=None):
+    """Resumen por estación (obs, promedios, mín/máx, % vacía/llena) sobre todos los niveles."""
+    return derivar(fusionar(leer_medidas(niveles, estaciones, desde, hasta)))
+
+
+def resumen_estaciones(medidas, nombres=None):
+    """station_summary (mismas columnas que el procesador) a partir de medidas por (estación, cubeta).
+
+    La hora pico sale de las sumas por hora local (cubetas de 15 min o 1 h
+    caen enteras en una hora), igual que en AlmacenHistorial.resumen.
+    nombres: Series id_estacion -> nombre_estacion.
+    """
+    est = derivar(fusionar(medidas))
+    hora = pd.to_datetime(medidas['timestamp'], utc=True).dt.tz_convert(LIMA_TZ).dt.hour.rename('hora')
+    por_hora = medidas.groupby([medidas['id_estacion'], hora])[['ocup_sum', 'ocup_n']].sum().reset_index()
+    por_hora['media'] = por_hora['ocup_sum'] / por_hora['ocup_n'].replace(0, np.nan)
+    # hora de mayor ocupación media; empate -> hora menor
+    pico = (por_hora.dropna(subset=['media'])
+            .sort_values(['id_estacion', 'media', 'hora'], ascending=[True, False, True])
+            .drop_duplicates('id_estacion').set_index('id_estacion')['hora'].astype('float64'))
+    resumen = pd.DataFrame({
+        'id_estacion': est['id_estacion'],
+        'nombre_estacion': est['id_estacion'].map(nombres).fillna('') if nombres is not None else '',
+        **{c: est[c] for c in ('obs', 'bicis_promedio', 'capacidad_promedio', 'ocupacion_promedio',
+                               'pct_vacia', 'pct_llena')},
+    })
+    resumen['hora_pico'] = resumen['id_estacion'].map(pico)
+    return _categorizar_resumen(resumen.sort_values('id_estacion', ignore_index=True))
+
+
+def main():
+    from data_utils import RETENTION_TIERS
+
+    ap = argparse.ArgumentParser(description="Compacta el histórico procesado en niveles de 15 min y 1 hora")
+    ap.add_argument('--crudo-dias', type=int, default=CRUDO_DIAS)
+    ap.add_argument('--quince-dias', type=int, default=QUINCE_DIAS)
+    ap.add_argument('--hoy', help="fecha de referencia (por defecto, hoy en Lima)")
+    args = ap.parse_args()
+    movidas = compactar(RETENTION_TIERS, args.hoy, args.crudo_dias, args.quince_dias)
+    print(f"🗜️ Particiones compactadas: {movidas['15min']} a 15 min, {movidas['1h']} a 1 hora")
+
+
+if __name__ == '__main__':
+    main()
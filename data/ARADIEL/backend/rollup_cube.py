@@ -0,0 +1,219 @@
+# rollup_cube.py
+# Cubo pre-agregado a nivel (estación, fecha, hora, categoría instantánea)
+# con medidas sumables (suma/conteo/mín/máx/ceros). Se materializa al
+# ingerir y todos los análisis por hora/día/periodo/categoría se resuelven
+# sumando celdas del cubo en lugar de recorrer el histórico.
+# En disco es un directorio con un Parquet por fecha (AAAA-MM-DD.parquet)
+# y las marcas de plegado por estación en _marca.parquet.
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from compact_history import PERIODOS, _periodo
+from data_processor import BINS, LABELS
+from station_state import MarcasEstacion, _preparar_filas, _utc_ns
+
+LLAVES = ['id_estacion', 'fecha', 'hora', 'categoria']
+METRICAS = ['ocupacion', 'bicis_libres']
+DIMENSIONES = ('id_estacion', 'fecha', 'hora', 'categoria', 'dia_semana', 'periodo_dia', 'categoria_estacion')
+MEDIDAS = ('mean', 'sum', 'count', 'min', 'max', 'pct_vacia', 'pct_llena', 'obs')
+MARCA = '_marca.parquet'
+
+# Cómo se combinan las columnas de dos cubos
+_COMBINAR = {'obs': 'sum', 'vacia_n': 'sum', 'llena_n': 'sum'}
+for _m in METRICAS:
+    _COMBINAR.update({f'{_m}_sum': 'sum', f'{_m}_n': 'sum', f'{_m}_min': 'min', f'{_m}_max': 'max'})
+
+
+# ============================================================
+# Construcción y plegado
+# ============================================================
+
+def _celdas(filas):
+    """Filas preparadas (_preparar_filas, con timestamp) -> celdas del cubo."""
+    if filas.empty:
+        return pd.DataFrame(columns=list(_COMBINAR))
+
+    ts = pd.Series(filas['timestamp'].to_numpy())
+    cat = pd.cut(filas['ocupacion'], bins=BINS, labels=LABELS, include_lowest=True)
+    tabla = pd.DataFrame({
+        'id_estacion': filas['id_estacion'].to_numpy(),
+        'fecha': ts.dt.strftime('%Y-%m-%d').to_numpy(),
+        'hora': filas['hora'].to_numpy().astype('int8'),
+        'categoria': cat.astype(str).where(cat.notna(), '').to_numpy(),
+        'vacia': (filas['bicis_libres'] == 0).to_numpy(),
+        'llena': (filas['espacios_vacios'] == 0).to_numpy(),
+    })
+    for m in METRICAS:
+        tabla[m] = filas[m].to_numpy(dtype='float64')
+
+    g = tabla.groupby(LLAVES, sort=True)
+    celdas = pd.DataFrame({'obs': g.size(), 'vacia_n': g['vacia'].sum(), 'llena_n': g['llena'].sum()})
+    for m in METRICAS:
+        celdas[f'{m}_sum'] = g[m].sum()
+        celdas[f'{m}_n'] = g[m].count()
+        celdas[f'{m}_min'] = g[m].min()
+        celdas[f'{m}_max'] = g[m].max()
+    return celdas[list(_COMBINAR)]
+
+
+class CuboRollup:
+    """Cubo (estación, fecha, hora, categoría) con el último timestamp plegado por estación.
+
+    Las celdas se guardan por fecha (una tabla por día): plegar un snapshot
+    solo recombina las fechas que toca y guardar solo reescribe esos archivos,
+    así la ingesta cuesta O(filas nuevas + un día) y no crece con el cubo.
+    """
+
+    def __init__(self, celdas=None, marcas=None):
+        self.fechas = {}            # 'AAAA-MM-DD' -> celdas de ese día
+        self.marcas = marcas or MarcasEstacion()   # último timestamp plegado por estación (ns UTC)
+        self._sucias = set()        # fechas plegadas que falta escribir
+        self._reescribir = True     # un cubo nuevo (no cargado) reemplaza lo que haya en disco
+        self._todas = None          # todas las celdas concatenadas (se invalida al plegar)
+        if celdas is not None:
+            self._incorporar(celdas)
+
+    @classmethod
+    def desde_df(cls, df):
+        cubo = cls()
+        cubo.plegar(df, respetar_marca=False)
+        return cubo
+
+    def _incorporar(self, nuevas):
+        """Suma las celdas nuevas a las de su fecha (las demás fechas no se tocan)."""
+        for fecha, parte in nuevas.groupby(level='fecha', sort=False):
+            actual = self.fechas.get(fecha)
+            if actual is not None:
+                parte = pd.concat([actual, parte]).groupby(level=LLAVES).agg(_COMBINAR)
+            self.fechas[fecha] = parte.sort_index()
+            self._sucias.add(fecha)
+        self._todas = None
+
+    @property
+    def celdas(self):
+        """Todas las celdas, indexadas por LLAVES y ordenadas."""
+        if self._todas is None:
+            self._todas = self._entre(None, None)
+        return self._todas
+
+    def _entre(self, desde, hasta):
+        """Celdas de las fechas en [desde, hasta] (AAAA-MM-DD; None = sin límite)."""
+        partes = [self.fechas[f] for f in sorted(self.fechas)
+                  if (desde is None or f >= desde) and (hasta is None or f <= hasta)]
+        if not partes:
+            return pd.DataFrame(columns=list(_COMBINAR), dtype='float64',
+                                index=pd.MultiIndex.from_arrays([[]] * len(LLAVES), names=LLAVES))
+        return pd.concat(partes)
+
+    def plegar(self, df, respetar_marca=True):
+        """Incorpora filas nuevas; solo se recombinan las fechas tocadas.
+
+        Con respetar_marca se ignoran las filas con timestamp <= último plegado
+        de su estación.
+        """
+        filas = _preparar_filas(pd.DataFrame(df))
+        ts_ns = _utc_ns(filas['timestamp']) if len(filas) else np.zeros(0, 'int64')
+        validos = ts_ns != np.iinfo('int64').min
+        if respetar_marca:
+            validos &= self.marcas.nuevas(filas['id_estacion'].to_numpy(), ts_ns)
+        filas, ts_ns = filas[validos], ts_ns[validos]
+        nuevas = _celdas(filas)
+        if nuevas.empty:
+            return 0
+        self._incorporar(nuevas)
+        self.marcas.avanzar(filas['id_estacion'].to_numpy(), ts_ns)
+        return int(nuevas['obs'].sum())
+
+    # --- persistencia ---
+    def guardar(self, ruta):
+        """Escribe en ruta (directorio) solo las fechas plegadas desde la última vez, más las marcas."""
+        ruta = Path(ruta)
+        if self._reescribir:
+            shutil.rmtree(ruta, ignore_errors=True)
+            self._sucias = set(self.fechas)
+        ruta.mkdir(parents=True, exist_ok=True)
+        for fecha in sorted(self._sucias):
+            tmp = ruta / f'{fecha}.parquet.tmp'
+            tabla = pa.Table.from_pandas(self.fechas[fecha].reset_index(), preserve_index=False)
+            pq.write_table(tabla, tmp, compression='zstd')
+            tmp.replace(ruta / f'{fecha}.parquet')
+        marcas = self.marcas.ns
+        pq.write_table(pa.table({'id_estacion': marcas.index.to_numpy(dtype=str), 'marca_ns': marcas.to_numpy()}),
+                       ruta / MARCA)
+        self._sucias = set()
+        self._reescribir = False
+
+    @classmethod
+    def cargar(cls, ruta):
+        ruta = Path(ruta)
+        cubo = cls()
+        if (ruta / MARCA).exists():
+            marcas = pq.read_table(ruta / MARCA).to_pandas()
+            cubo.marcas = MarcasEstacion(marcas['id_estacion'].to_numpy(), marcas['marca_ns'].to_numpy())
+        for archivo in sorted(ruta.glob('????-??-??.parquet')):
+            cubo.fechas[archivo.stem] = pq.read_table(archivo).to_pandas().set_index(LLAVES)
+        cubo._reescribir = False
+        return cubo
+
+    # --- consultas ---
+    def rollup(self, por=('hora',), metrica='ocupacion', medida='mean',
+               estaciones=None, desde=None, hasta=None):
+        """Agrega el cubo a lo largo de las dimensiones `por`.
+
+        Dimensiones: id_estacion, fecha, hora, categoria (instantánea),
+        dia_semana (0 = lunes), periodo_dia y categoria_estacion (según la
+        ocupación media de la estación). desde/hasta filtran por fecha
+        (AAAA-MM-DD). Devuelve DataFrame con columnas por + [valor, n].
+        """
+        por = [por] if isinstance(por, str) else list(por)
+        invalidas = [d for d in por if d not in DIMENSIONES]
+        if invalidas:
+            raise ValueError(f"Dimensión inválida: {invalidas}")
+        if metrica not in METRICAS:
+            raise ValueError(f"Métrica inválida: {metrica}")
+        if medida not in MEDIDAS:
+            raise ValueError(f"Medida inválida: {medida}")
+
+        # desde/hasta eligen los días antes de concatenar
+        c = self._entre(None if desde is None else pd.Timestamp(desde).strftime('%Y-%m-%d'),
+                        None if hasta is None else pd.Timestamp(hasta).strftime('%Y-%m-%d')).reset_index()
+        if estaciones is not None:
+            c = c[c['id_estacion'].isin([str(e) for e in estaciones])]
+
+        # dimensiones derivadas (sobre celdas, no sobre filas)
+        if 'dia_semana' in por:
+            c['dia_semana'] = pd.to_datetime(c['fecha']).dt.dayofweek
+        if 'periodo_dia' in por:
+            c['periodo_dia'] = pd.Categorical(_periodo(c['hora']), categories=PERIODOS)
+        if 'categoria_estacion' in por:
+            est = self.celdas.groupby(level='id_estacion')[['ocupacion_sum', 'ocupacion_n']].sum()
+            media = est['ocupacion_sum'] / est['ocupacion_n'].replace(0, np.nan)
+            cat = pd.cut(media.fillna(0), bins=BINS, labels=LABELS, include_lowest=True)
+            c['categoria_estacion'] = c['id_estacion'].map(cat.astype(str))
+        if 'categoria' in por:
+            c = c[c['categoria'] != '']
+
+        g = c.groupby(por, sort=True, observed=True) if por else c.assign(_t=0).groupby('_t')
+        s, n = g[f'{metrica}_sum'].sum(), g[f'{metrica}_n'].sum()
+        valor = {
+            'mean': lambda: s / n.replace(0, np.nan),
+            'sum': lambda: s,
+            'count': lambda: n,
+            'min': lambda: g[f'{metrica}_min'].min(),
+            'max': lambda: g[f'{metrica}_max'].max(),
+            'pct_vacia': lambda: g['vacia_n'].sum() / g['obs'].sum() * 100,
+            'pct_llena': lambda: g['llena_n'].sum() / g['obs'].sum() * 100,
+            'obs': lambda: g['obs'].sum(),
+        }[medida]()
+        out = pd.DataFrame({'valor': valor, 'n': g['obs'].sum()})
+        return out.reset_index(drop=not por)
+
+    def pivot(self, filas, columnas, **kwargs):
+        """Tabla filas x columnas (p.ej. hora x dia_semana, hora x categoria)."""
+        r = self.rollup(por=[filas, columnas], **kwargs)
+        return r.pivot(index=filas, columns=columnas, values='valor')
@@ -1,4 +1,5 @@
 # scraper.py
+import os
 import requests
 import csv
 from datetime import datetime
@@ -6,9 +7,13 @@ from bs4 import BeautifulSoup
 from math import radians, sin, cos, sqrt, atan2
 import pytz
 
+from geofence import en_zona, zonas_estaciones
+from metrics import etapa, llamada_externa
+
 # === Constantes ===
-CITYBIKES_URL = "https://api.citybik.es/v2/networks/citybike-lima"
-CLIMA_MIRAFLORES_URL = "https://www.clima.com/peru/lima/miraflores-4"
+# Las URLs se pueden cambiar por entorno (p.ej. stubs locales de loadtest.py)
+CITYBIKES_URL = os.environ.get('CITYBIKE_CITYBIKES_URL', "https://api.citybik.es/v2/networks/citybike-lima")
+CLIMA_MIRAFLORES_URL = os.environ.get('CITYBIKE_CLIMA_URL', "https://www.clima.com/peru/lima/miraflores-4")
 LIMA_TZ = pytz.timezone("America/Lima")
 
 
@@ -32,10 +37,11 @@ def now_iso():
 def try_citybikes_api():
     """Intenta obtener datos de estaciones desde la API de CityBikes."""
     try:
-        r = requests.get(CITYBIKES_URL, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        stations = data['network']['stations']
+        with llamada_externa('citybikes'):
+            r = requests.get(CITYBIKES_URL, timeout=10)
+            r.raise_for_status()
+            data = r.json()
+            stations = data['network']['stations']
         return stations
     except Exception as e:
         print("CityBikes API error:", e)
@@ -47,8 +53,9 @@ def scrape_clima_miraflores():
     """Obtiene temperatura y descripción de clima desde clima.com."""
     try:
         headers = {"User-Agent": "Mozilla/5.0"}
-        r = requests.get(CLIMA_MIRAFLORES_URL, headers=headers, timeout=12)
-        r.raise_for_status()
+        with llamada_externa('clima'):
+            r = requests.get(CLIMA_MIRAFLORES_URL, headers=headers, timeout=12)
+            r.raise_for_status()
         text = r.text
         soup = BeautifulSoup(text, 'html.parser')
 
@@ -71,29 +78,33 @@ def scrape_clima_miraflores():
 
 # === Capturar snapshot ===
 def collect_snapshot(owm_key=None):
-    """Obtiene snapshot de estaciones + clima + hora."""
-    stations = try_citybikes_api()
+    """Obtiene snapshot de estaciones + clima + hora.
+
+    Cada paso (API, clima, armado de filas) se mide como etapa 'snapshot'.
+    """
+    with etapa('snapshot', 'api'):
+        stations = try_citybikes_api()
     if not stations:
         return []
 
     ts = now_iso()
-    clima = scrape_clima_miraflores()
+    with etapa('snapshot', 'clima'):
+        clima = scrape_clima_miraflores()
 
-    rows = []
-    MIRAFLORES_CENTER = (-12.117880, -77.033043)
-    MIRAFLORES_RADIUS_KM = 2.0
+    with etapa('snapshot', 'filas', estaciones=len(stations)):
+        return _armar_filas(stations, ts, clima)
 
-    for s in stations:
-        lat = s.get('latitude') or s.get('lat')
-        lon = s.get('longitude') or s.get('lon')
-        in_miraf = False
 
-        try:
-            if lat and lon:
-                d = haversine_km(float(lat), float(lon), MIRAFLORES_CENTER[0], MIRAFLORES_CENTER[1])
-                in_miraf = d <= MIRAFLORES_RADIUS_KM
-        except:
-            in_miraf = False
+def _armar_filas(stations, ts, clima):
+    """Una fila (esquema del CSV en vivo) por estación del snapshot."""
+    rows = []
+    # Zona de todas las estaciones en una llamada (cacheada por estación)
+    coords = [(s.get('latitude') or s.get('lat'), s.get('longitude') or s.get('lon')) for s in stations]
+    zonas = zonas_estaciones([s.get('id') for s in stations],
+                             [la or None for la, _ in coords], [lo or None for _, lo in coords])
+
+    for s, (lat, lon), zona in zip(stations, coords, zonas):
+        in_miraf = en_zona(zona)
 
         temp_assigned = clima.get('temp_C') if (in_miraf and clima) else None
         clima_assigned = clima.get('clima') if (in_miraf and clima) else None
@@ -137,7 +148,7 @@ def append_to_csv(rows, csv_path):
     import os
     exists = os.path.exists(csv_path)
 
-    with open(csv_path, 'a', encoding='utf-8', newline='') as f:
+    with etapa('snapshot', 'append', filas=len(rows)), open(csv_path, 'a', encoding='utf-8', newline='') as f:
         w = csv.DictWriter(f, fieldnames=header)
         if not exists:
             w.writeheader()
@@ -0,0 +1,137 @@
+# station_asof.py
+# Estado de la red en cualquier instante ("¿cómo estaba a las 08:15 del
+# martes pasado?"). Las lecturas se ordenan una vez por (estación, timestamp)
+# y cada estación queda como un tramo contiguo con timestamps crecientes; la
+# consulta as-of (última lectura <= t) es una búsqueda binaria por estación,
+# O(estaciones · log n) para toda la red. Una secuencia de instantes
+# (reproducción en el mapa, backtesting) usa la misma búsqueda con todos los
+# instantes a la vez.
+import numpy as np
+import pandas as pd
+
+from station_health import OFFLINE_H
+from station_state import _utc_ns
+
+VALORES = ['bicis_libres', 'espacios_vacios', 'capacidad', 'ocupacion']
+MAX_ANTIGUEDAD = pd.Timedelta(hours=OFFLINE_H)   # lecturas más viejas no describen el instante
+
+
+class IndiceTemporal:
+    """Lecturas por estación en tramos ordenados (desplazamientos tipo CSR).
+
+    Las lecturas de la estación con station_key k son ns[inicio[k]:inicio[k+1]].
+    Junto a los valores se guardan sumas acumuladas de ocupación para el
+    promedio hasta el instante consultado sin recorrer el tramo.
+    """
+
+    def __init__(self, estaciones, ns, inicio, valores, tz=None):
+        self.estaciones = estaciones   # dimensión (índice station_key)
+        self.ns = ns
+        self.inicio = inicio
+        self.valores = valores
+        self.tz = tz                   # zona de los timestamps originales
+        ocup = valores['ocupacion']
+        self._ocup_sum = np.concatenate([[0.0], np.cumsum(np.nan_to_num(ocup))])
+        self._ocup_n = np.concatenate([[0], np.cumsum(~np.isnan(ocup))])
+
+    @classmethod
+    def desde_hechos(cls, hechos, estaciones):
+        """Índice a partir del histórico compacto (compact_history.compactar_historial)."""
+        ts = hechos['timestamp'] if 'timestamp' in hechos.columns else pd.Series(pd.NaT, index=hechos.index)
+        ok = ts.notna().to_numpy()
+        claves = hechos['station_key'].to_numpy()[ok].astype('int64')
+        ns = _utc_ns(ts[ok]) if ok.any() else np.zeros(0, 'int64')
+        orden = np.lexsort((ns, claves))
+        n = int(estaciones.index.max()) + 1 if len(estaciones) else 0
+        inicio = np.searchsorted(claves[orden], np.arange(n + 1))
+        valores = {}
+        for c in VALORES:
+            v = hechos[c].astype('float64').to_numpy()[ok] if c in hechos.columns else np.full(ok.sum(), np.nan)
+            valores[c] = v[orden]
+        return cls(estaciones, ns[orden], inicio, valores, getattr(ts.dt, 'tz', None))
+
+    def __len__(self):
+        return len(self.ns)
+
+    def a_ns(self, instante):
+        """Instante -> ns UTC. Sin zona se interpreta en la zona de los datos."""
+        t = pd.Timestamp(instante)
+        if t is pd.NaT:
+            raise ValueError(f"Instante inválido: {instante}")
+        if self.tz is not None and t.tzinfo is None:
+            t = t.tz_localize(self.tz)
+        elif self.tz is None and t.tzinfo is not None:
+            t = t.tz_localize(None)
+        return int(_utc_ns(pd.Series([t]))[0])
+
+    def posiciones(self, instantes_ns):
+        """Matriz (estaciones x instantes): posición de la última lectura <= t, -1 si no hay."""
+        t = np.asarray(instantes_ns, dtype='int64')
+        pos = np.full((len(self.inicio) - 1, len(t)), -1, dtype='int64')
+        for k in range(len(self.inicio) - 1):
+            a, b = self.inicio[k], self.inicio[k + 1]
+            if a < b:
+                j = a + np.searchsorted(self.ns[a:b], t, side='right') - 1
+                pos[k] = np.where(j >= a, j, -1)
+        return pos
+
+    def _leidas(self, pos):
+        """Timestamp (ns) de cada posición; las -1 quedan con un valor cualquiera."""
+        return self.ns[np.maximum(pos, 0)] if len(self.ns) else np.zeros_like(pos)
+
+    def _pedidas(self, estaciones):
+        """Máscara por station_key de las estaciones pedidas (todas si None)."""
+        n = len(self.inicio) - 1
+        if estaciones is None:
+            return np.ones(n, dtype=bool)
+        ids = self.estaciones['id_estacion'].reindex(range(n)).astype(str)
+        return ids.isin([str(e) for e in estaciones]).to_numpy()
+
+    def estado_en(self, instante, max_antiguedad=MAX_ANTIGUEDAD, estaciones=None):
+        """Red al instante: última lectura <= instante de cada estación (una fila por estación).
+
+        max_antiguedad: omite estaciones cuya última lectura es más vieja (None = sin límite).
+        ocupacion_promedio es la media de las lecturas hasta el instante (sin mirar el futuro).
+        """
+        t = self.a_ns(instante)
+        pos = self.posiciones([t])[:, 0]
+        ok = (pos >= 0) & self._pedidas(estaciones)
+        if max_antiguedad is not None:
+            ok &= (t - self._leidas(pos)) <= pd.Timedelta(max_antiguedad).value
+        claves, p = np.flatnonzero(ok), pos[ok]
+        dim = self.estaciones.reindex(claves)
+        n = self._ocup_n[p + 1] - self._ocup_n[self.inicio[claves]]
+        suma = self._ocup_sum[p + 1] - self._ocup_sum[self.inicio[claves]]
+        leido = pd.to_datetime(self.ns[p], utc=True)
+        return pd.DataFrame({
+            'id_estacion': dim['id_estacion'].to_numpy(),
+            'nombre_estacion': dim['nombre_estacion'].to_numpy(),
+            'latitud': dim['latitud'].to_numpy(),
+            'longitud': dim['longitud'].to_numpy(),
+            'timestamp': leido.tz_convert(self.tz) if self.tz is not None else leido.tz_localize(None),
+            **{c: self.valores[c][p] for c in VALORES},
+            'ocupacion_promedio': np.divide(suma, n, out=np.full(len(p), np.nan), where=n > 0),
+            'antiguedad_min': (t - self.ns[p]) / 6e10,
+        })
+
+    def reproduccion(self, desde, hasta, paso='15min', columna='bicis_libres',
+                     max_antiguedad=MAX_ANTIGUEDAD, estaciones=None):
+        """Estados en instantes regulares para animar el mapa o hacer backtesting.
+
+        Devuelve (instantes, ids, matriz instantes x estaciones de `columna`),
+        con NaN donde la estación no tenía lectura vigente.
+        """
+        if columna not in VALORES:
+            raise ValueError(f"columna debe ser una de: {', '.join(VALORES)}")
+        instantes = pd.date_range(pd.Timestamp(desde), pd.Timestamp(hasta), freq=paso)
+        if len(instantes) == 0:
+            raise ValueError("Rango vacío: desde debe ser anterior a hasta")
+        t = np.array([self.a_ns(i) for i in instantes], dtype='int64')
+        pos = self.posiciones(t)
+        vigente = pos >= 0
+        if max_antiguedad is not None:
+            vigente &= (t[None, :] - self._leidas(pos)) <= pd.Timedelta(max_antiguedad).value
+        claves = np.flatnonzero(vigente.any(axis=1) & self._pedidas(estaciones))
+        valores = self.valores[columna][np.maximum(pos[claves], 0)] if len(self.ns) else pos[claves] * np.nan
+        matriz = np.where(vigente[claves], valores, np.nan).T
+        return instantes, self.estaciones['id_estacion'].reindex(claves).tolist(), matriz
@@ -0,0 +1,158 @@
+# station_dim.py
+# Dimensión de estaciones: una fila por estación con station_key entero
+# estable y los atributos que antes se derivaban fila a fila del histórico
+# (código y avenida desde el nombre, zona por geocerca, exclusión de
+# estaciones). Al ingerir solo se procesan las estaciones que no estaban;
+# los hechos guardan la clave entera y se unen a esta tabla.
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_reader import resolver_columnas
+from geofence import geocerca_actual
+
+ESTACIONES_EXCLUIDAS = ('27042',)   # códigos fuera del análisis
+PATRON_CODIGO = r'(\d{5})'
+# Patrón de avenida del EDA (Av./Ca./Malecón/Parque + nombre)
+PATRON_AVENIDA = r'(?i)((?:Av\.|Avenida|Ca\.|Calle|Malecón|Parque)\s+[A-Za-zÁÉÍÓÚáéíóúñÑ\s]+)'
+COLUMNAS = ['id_estacion', 'nombre_estacion', 'codigo_estacion', 'avenida', 'zona',
+            'latitud', 'longitud', 'capacidad', 'excluida']
+
+
+# ============================================================
+# Atributos derivados (una vez por valor distinto, no por fila)
+# ============================================================
+
+def _por_valor_unico(valores, fn):
+    """Aplica fn a los valores distintos y lo expande a todas las filas."""
+    s = pd.Series(valores)
+    unicos = pd.Series(pd.unique(s))
+    return s.map(pd.Series(fn(unicos).to_numpy(), index=unicos))
+
+
+def codigo_desde_nombre(nombres):
+    """Código de 5 dígitos del nombre ('18027 Ov. ...' -> '18027'); NaN si no tiene."""
+    return _por_valor_unico(nombres, lambda u: u.astype(str).str.extract(PATRON_CODIGO)[0])
+
+
+def avenida_desde_nombre(nombres):
+    return _por_valor_unico(nombres, lambda u: u.astype(str).str.extract(PATRON_AVENIDA)[0].str.strip())
+
+
+def es_excluida(codigos):
+    """Máscara de códigos excluidos (tolera '27042.0' y espacios)."""
+    texto = pd.Series(codigos).astype(str).str.strip()
+    return texto.str.contains('|'.join(ESTACIONES_EXCLUIDAS), na=False, regex=True)
+
+
+# ============================================================
+# Tabla de dimensión
+# ============================================================
+
+class DimensionEstaciones:
+    """Estaciones con station_key 0..n-1 (solo se agregan, nunca se renumeran)."""
+
+    def __init__(self, tabla=None, version_zonas=None):
+        if tabla is None:
+            tabla = pd.DataFrame({c: pd.Series(dtype=object) for c in COLUMNAS})
+            tabla.index.name = 'station_key'
+        self.tabla = tabla
+        self.version_zonas = version_zonas   # geocerca con la que se asignó 'zona'
+
+    @classmethod
+    def desde_df(cls, df):
+        dim = cls()
+        dim.plegar(df)
+        return dim
+
+    def __len__(self):
+        return len(self.tabla)
+
+    def plegar(self, df):
+        """Agrega las estaciones de df que aún no existen. Devuelve cuántas se agregaron.
+
+        Los atributos se toman de la última lectura de cada estación nueva;
+        las ya conocidas no se tocan (así ingerir un snapshot es O(estaciones)).
+        """
+        df = pd.DataFrame(df)
+        df = df.rename(columns=resolver_columnas(tuple(df.columns)))
+        self.actualizar_zonas()
+        if df.empty or 'id_estacion' not in df.columns:
+            return 0
+        ids = df['id_estacion'].astype(str)
+        nuevas = ~ids.isin(self.tabla['id_estacion'])
+        if not nuevas.any():
+            return 0
+
+        base = pd.DataFrame({'id_estacion': ids[nuevas]})
+        for c in ['nombre_estacion', 'latitud', 'longitud', 'capacidad']:
+            base[c] = df.loc[nuevas, c] if c in df.columns else np.nan
+        if 'timestamp' in df.columns:
+            base = base.iloc[df.loc[nuevas, 'timestamp'].values.argsort(kind='stable')]
+        # última lectura conocida de cada estación, en orden de id
+        filas = base.groupby('id_estacion', sort=True).last().reset_index()
+
+        for c in ['latitud', 'longitud', 'capacidad']:
+            filas[c] = pd.to_numeric(filas[c], errors='coerce')
+        filas['capacidad'] = filas['capacidad'].round().astype('Int16')
+        filas['codigo_estacion'] = codigo_desde_nombre(filas['nombre_estacion']).to_numpy()
+        filas['avenida'] = avenida_desde_nombre(filas['nombre_estacion']).to_numpy()
+        filas['zona'] = geocerca_actual().clasificar(filas['latitud'], filas['longitud'])
+        filas['excluida'] = es_excluida(filas['codigo_estacion']).to_numpy()
+        filas.index = pd.RangeIndex(len(self.tabla), len(self.tabla) + len(filas), name='station_key')
+
+        self.tabla = pd.concat([self.tabla, filas[COLUMNAS]]) if len(self.tabla) else filas[COLUMNAS]
+        self.tabla.index.name = 'station_key'
+        return len(filas)
+
+    def actualizar_zonas(self):
+        """Reclasifica todas las estaciones (una llamada) si cambió la geocerca. Devuelve si cambió."""
+        geocerca = geocerca_actual()
+        if self.version_zonas == geocerca.version:
+            return False
+        if len(self.tabla):
+            self.tabla['zona'] = geocerca.clasificar(self.tabla['latitud'], self.tabla['longitud'])
+        self.version_zonas = geocerca.version
+        return True
+
+    def zonas(self):
+        """Serie id_estacion -> zona."""
+        return self.tabla.set_index('id_estacion')['zona']
+
+    # --- uso desde los hechos ---
+    def dtype_clave(self):
+        return 'int16' if len(self.tabla) < np.iinfo(np.int16).max else 'int32'
+
+    def claves(self, ids):
+        """id_estacion -> station_key (-1 si la estación no está en la dimensión)."""
+        indice = pd.Index(self.tabla['id_estacion'])
+        return indice.get_indexer(pd.Series(ids).astype(str)).astype(self.dtype_clave())
+
+    def unir(self, hechos, columnas=None):
+        """Agrega a los hechos (con station_key) las columnas pedidas de la dimensión."""
+        columnas = columnas or [c for c in COLUMNAS if c not in hechos.columns]
+        return hechos.join(self.tabla[columnas], on='station_key')
+
+    def excluidas(self):
+        """station_key de las estaciones marcadas como excluidas."""
+        return self.tabla.index[self.tabla['excluida'].astype(bool)].to_numpy()
+
+    # --- persistencia ---
+    def guardar(self, ruta):
+        tabla = self.tabla.reset_index()
+        tabla['capacidad'] = tabla['capacidad'].astype('Int16')
+        tabla['zona'] = tabla['zona'].astype(object).where(tabla['zona'].notna(), None)
+        meta = {b'version_zonas': (self.version_zonas or '').encode()}
+        arrow = pa.Table.from_pandas(tabla, preserve_index=False)
+        pq.write_table(arrow.replace_schema_metadata(meta), ruta, compression='zstd')
+
+    @classmethod
+    def cargar(cls, ruta):
+        arrow = pq.read_table(ruta)
+        version = (arrow.schema.metadata or {}).get(b'version_zonas', b'').decode() or None
+        tabla = arrow.to_pandas().set_index('station_key')
+        tabla['excluida'] = tabla['excluida'].astype(bool)
+        dim = cls(tabla, version)
+        dim.actualizar_zonas()   # p.ej. se agregó o cambió data/zonas.geojson
+        return dim
@@ -0,0 +1,237 @@
+# station_health.py
+# Detector en línea de estaciones trabadas o rotas. Se alimenta con los
+# snapshots al ingerir y guarda un estado fijo por estación (última lectura,
+# último cambio, marcas abiertas), así cada snapshot cuesta O(estaciones).
+# Marca tres motivos:
+#   estancada:     bicis/espacios sin cambiar por más de ESTANCADA_H horas
+#   inconsistente: bicis + espacios vacíos difiere de la capacidad
+#   offline:       la estación falta en snapshots por más de OFFLINE_H horas
+# Los intervalos marcados (cerrados y abiertos) quedan en una tabla chica;
+# mascara() la cruza con cualquier tabla de hechos (merge_asof) para que los
+# agregados excluyan esas filas sin releer el histórico.
+import numpy as np
+import pandas as pd
+
+from station_state import _preparar_filas, _utc_ns
+
+MOTIVOS = ('estancada', 'inconsistente', 'offline')
+ESTANCADA, INCONSISTENTE, OFFLINE = range(len(MOTIVOS))
+ESTANCADA_H = 12         # más que una noche sin movimiento
+OFFLINE_H = 2            # ~3 snapshots perdidos
+TOLERANCIA_DOCKS = 1     # un dock fuera de servicio es normal en el feed
+MARGEN_SNAPSHOT_NS = 5 * 60 * 10**9   # lecturas de un mismo snapshot difieren en segundos
+NS_HORA = 3_600 * 10**9
+_SIN_MARCA = np.iinfo('int64').min
+ABIERTO = np.iinfo('int64').max   # fin de un intervalo que sigue marcado
+
+
+class SaludEstaciones:
+    """Estado del detector por estación (índice: id_estacion como texto)."""
+
+    def __init__(self):
+        self.ids = pd.Index([], dtype=object, name='id_estacion')
+        self.visto_ns = np.zeros(0, dtype='int64')       # última lectura (ns UTC)
+        self.cambio_ns = np.zeros(0, dtype='int64')      # último cambio de bicis/espacios
+        self.bicis = np.zeros(0, dtype='float32')
+        self.vacios = np.zeros(0, dtype='float32')
+        self.desde_ns = np.zeros((0, len(MOTIVOS)), dtype='int64')   # inicio de la marca abierta
+        self.intervalos = pd.DataFrame({'pos': pd.Series(dtype='int32'), 'motivo': pd.Series(dtype='int8'),
+                                        'inicio_ns': pd.Series(dtype='int64'), 'fin_ns': pd.Series(dtype='int64')})
+        self.marca_ns = None   # última lectura de toda la red (ns UTC): el "ahora" de offline
+
+    @classmethod
+    def desde_df(cls, df):
+        salud = cls()
+        salud.plegar(df, respetar_marca=False)
+        return salud
+
+    def _asegurar_estaciones(self, ids):
+        nuevas = pd.Index(pd.unique(ids)).difference(self.ids)
+        if len(nuevas):
+            k = len(nuevas)
+            self.ids = self.ids.append(nuevas)
+            self.visto_ns = np.concatenate([self.visto_ns, np.full(k, _SIN_MARCA, 'int64')])
+            self.cambio_ns = np.concatenate([self.cambio_ns, np.full(k, _SIN_MARCA, 'int64')])
+            self.bicis = np.concatenate([self.bicis, np.full(k, np.nan, 'float32')])
+            self.vacios = np.concatenate([self.vacios, np.full(k, np.nan, 'float32')])
+            self.desde_ns = np.concatenate([self.desde_ns, np.full((k, len(MOTIVOS)), _SIN_MARCA, 'int64')])
+        return self.ids.get_indexer(ids)
+
+    # --- ingesta ---
+    def plegar(self, df, respetar_marca=True):
+        """Procesa lecturas nuevas (un snapshot o un bloque de histórico). Devuelve filas procesadas.
+
+        Cada fila se compara con la anterior de su estación (la primera, con
+        el estado guardado), todo con operaciones por grupo sobre arrays. Con
+        respetar_marca se ignoran las filas con timestamp <= última lectura de
+        su estación (visto_ns hace de marca por estación).
+        """
+        filas = _preparar_filas(pd.DataFrame(df))
+        ts = _utc_ns(filas['timestamp']) if len(filas) else np.zeros(0, 'int64')
+        ok = ts != _SIN_MARCA
+        filas, ts = filas[ok], ts[ok]
+        if filas.empty:
+            return 0
+        pos = self._asegurar_estaciones(filas['id_estacion'].to_numpy())
+        if respetar_marca:
+            ok = ts > self.visto_ns[pos]
+            filas, ts, pos = filas[ok], ts[ok], pos[ok]
+            if filas.empty:
+                return 0
+
+        orden = np.lexsort((ts, pos))
+        pos, ts = pos[orden], ts[orden]
+        bicis = filas['bicis_libres'].to_numpy(dtype='float64')[orden]
+        vacios = filas['espacios_vacios'].to_numpy(dtype='float64')[orden]
+        cap = filas['capacidad'].to_numpy(dtype='float64')[orden]
+        primera = np.r_[True, pos[1:] != pos[:-1]]
+        ultima = np.r_[pos[1:] != pos[:-1], True]
+
+        # lectura anterior de la misma estación (o la guardada)
+        previo = lambda v, guardado: np.where(primera, guardado[pos], np.r_[np.nan, v[:-1]])
+        ts_prev = np.where(primera, self.visto_ns[pos], np.r_[_SIN_MARCA, ts[:-1]])
+        cambio = ((np.nan_to_num(bicis, nan=-1) != np.nan_to_num(previo(bicis, self.bicis), nan=-1))
+                  | (np.nan_to_num(vacios, nan=-1) != np.nan_to_num(previo(vacios, self.vacios), nan=-1)))
+        cambio |= ts_prev == _SIN_MARCA
+        # ts crece dentro de cada estación: el último cambio es un máximo acumulado
+        ultimo_cambio = pd.Series(np.where(cambio, ts, _SIN_MARCA)).groupby(pos).cummax().to_numpy()
+        ultimo_cambio = np.where(ultimo_cambio == _SIN_MARCA, self.cambio_ns[pos], ultimo_cambio)
+
+        marcas = np.zeros((len(ts), len(MOTIVOS)), dtype=bool)
+        marcas[:, ESTANCADA] = ts - ultimo_cambio > ESTANCADA_H * NS_HORA
+        with np.errstate(invalid='ignore'):
+            marcas[:, INCONSISTENTE] = np.abs(bicis + vacios - cap) > TOLERANCIA_DOCKS
+
+        nuevos = [self._tramos(m, pos, ts, marcas[:, m], primera, ultima) for m in (ESTANCADA, INCONSISTENTE)]
+
+        # huecos en el feed, [lectura anterior, lectura actual): cuentan si llegó
+        # otro snapshot más de OFFLINE_H después de la lectura anterior (si el
+        # recolector estuvo caído no hubo snapshots y no es culpa de la estación)
+        # o si la marca ya venía abierta de una ingesta previa
+        tiempos = np.unique(ts)
+        limite = np.where(ts_prev == _SIN_MARCA, tiempos[-1], ts_prev + OFFLINE_H * NS_HORA)
+        i = np.searchsorted(tiempos, limite, side='right')
+        falto = (i < len(tiempos)) & (tiempos[np.minimum(i, len(tiempos) - 1)] < ts - MARGEN_SNAPSHOT_NS)
+        abierta = primera & (self.desde_ns[pos, OFFLINE] != _SIN_MARCA)
+        hueco = (ts_prev != _SIN_MARCA) & (falto | abierta)
+        nuevos.append(pd.DataFrame({'pos': pos[hueco], 'motivo': OFFLINE,
+                                    'inicio_ns': ts_prev[hueco], 'fin_ns': ts[hueco]}))
+        self.desde_ns[pos[primera], OFFLINE] = _SIN_MARCA   # volvió a aparecer
+
+        # estado por estación: su última fila
+        p = pos[ultima]
+        self.visto_ns[p] = ts[ultima]
+        self.cambio_ns[p] = ultimo_cambio[ultima]
+        self.bicis[p] = bicis[ultima]
+        self.vacios[p] = vacios[ultima]
+
+        maximo = int(ts.max())
+        self.marca_ns = maximo if self.marca_ns is None else max(self.marca_ns, maximo)
+        self._marcar_ausentes()
+        self.intervalos = pd.concat([self.intervalos, *nuevos], ignore_index=True).astype(self.intervalos.dtypes)
+        return len(filas)
+
+    def _tramos(self, motivo, pos, ts, activo, primera, ultima):
+        """Cierra/abre marcas de un motivo y devuelve los intervalos cerrados.
+
+        Una marca empieza en la primera lectura que la cumple y termina en la
+        primera que ya no (o queda abierta en desde_ns).
+        """
+        antes = self.desde_ns[pos, motivo] != _SIN_MARCA
+        previo = np.where(primera, antes, np.r_[False, activo[:-1]])
+        inicios = pd.DataFrame({'pos': pos[activo & ~previo], 'ts': ts[activo & ~previo]})
+        # las marcas que venían abiertas empiezan en su desde_ns
+        abiertas = np.unique(pos[primera & antes])
+        inicios = pd.concat([pd.DataFrame({'pos': abiertas, 'ts': self.desde_ns[abiertas, motivo]}), inicios])
+        fines = pd.DataFrame({'pos': pos[~activo & previo], 'ts': pd.array(ts[~activo & previo], dtype='Int64')})
+
+        # inicios y fines alternan por estación: el k-ésimo fin cierra el k-ésimo inicio
+        inicios = inicios.sort_values(['pos', 'ts'], kind='stable')
+        inicios['k'] = inicios.groupby('pos').cumcount()
+        fines['k'] = fines.groupby('pos').cumcount()
+        pares = inicios.merge(fines, on=['pos', 'k'], how='left', suffixes=('_ini', '_fin'))
+        cerrados = pares['ts_fin'].notna()
+
+        self.desde_ns[pos[ultima], motivo] = _SIN_MARCA
+        sigue = pares[~cerrados]
+        self.desde_ns[sigue['pos'].to_numpy(), motivo] = sigue['ts_ini'].to_numpy()
+        c = pares[cerrados]
+        return pd.DataFrame({'pos': c['pos'].to_numpy(), 'motivo': motivo,
+                             'inicio_ns': c['ts_ini'].to_numpy(), 'fin_ns': c['ts_fin'].to_numpy('int64')})
+
+    def _marcar_ausentes(self):
+        """Estaciones que no aparecen hace más de OFFLINE_H: marca offline abierta desde su última lectura."""
+        ausente = ((self.visto_ns != _SIN_MARCA) & (self.marca_ns - self.visto_ns > OFFLINE_H * NS_HORA)
+                   & (self.desde_ns[:, OFFLINE] == _SIN_MARCA))
+        self.desde_ns[ausente, OFFLINE] = self.visto_ns[ausente]
+
+    # --- consultas ---
+    def todos_intervalos(self):
+        """Intervalos cerrados + abiertos (fin_ns = máximo int64) con id y motivo como texto."""
+        pos, motivo = np.nonzero(self.desde_ns != _SIN_MARCA)
+        abiertos = pd.DataFrame({'pos': pos, 'motivo': motivo,
+                                 'inicio_ns': self.desde_ns[pos, motivo], 'fin_ns': ABIERTO})
+        t = pd.concat([self.intervalos, abiertos], ignore_index=True)
+        return pd.DataFrame({'id_estacion': self.ids[t['pos'].to_numpy()].to_numpy(),
+                             'motivo': np.array(MOTIVOS)[t['motivo'].to_numpy(dtype=int)],
+                             'inicio_ns': t['inicio_ns'].to_numpy('int64'),
+                             'fin_ns': t['fin_ns'].to_numpy('int64')})
+
+    def estado_actual(self):
+        """Una fila por estación: marcas abiertas, desde cuándo, última lectura y último cambio."""
+        abiertas = self.desde_ns != _SIN_MARCA
+        desde = np.where(abiertas, self.desde_ns, ABIERTO).min(axis=1)
+        motivos = np.array(MOTIVOS)
+        a_ts = lambda v: pd.DatetimeIndex(np.asarray(v, dtype='int64').view('datetime64[ns]')).tz_localize('UTC')
+        return pd.DataFrame({
+            'id_estacion': self.ids.to_numpy(),
+            'marcas': [list(motivos[fila]) for fila in abiertas],
+            'marcada_desde': a_ts(np.where(abiertas.any(axis=1), desde, _SIN_MARCA)),
+            'ultima_lectura': a_ts(self.visto_ns),
+            'ultimo_cambio': a_ts(self.cambio_ns),
+        })
+
+    def mascara(self, df, motivos=MOTIVOS):
+        """True en las filas de df (id_estacion + timestamp) fuera de los intervalos marcados."""
+        filas = _preparar_filas(pd.DataFrame(df))
+        t = self.todos_intervalos()
+        t = t[t['motivo'].isin(motivos)]
+        if filas.empty or t.empty:
+            return np.ones(len(filas), dtype=bool)
+        # intervalos de cada estación fusionados (sin solaparse) para el cruce asof
+        t = t.sort_values(['id_estacion', 'inicio_ns'], kind='stable')
+        fin_acum = t.groupby('id_estacion')['fin_ns'].cummax().to_numpy()
+        primera = np.r_[True, t['id_estacion'].to_numpy()[1:] != t['id_estacion'].to_numpy()[:-1]]
+        nuevo = primera | (t['inicio_ns'].to_numpy() > np.r_[_SIN_MARCA, fin_acum[:-1]])
+        t = (t.assign(bloque=np.cumsum(nuevo))
+              .groupby('bloque').agg(id_estacion=('id_estacion', 'first'),
+                                     inicio_ns=('inicio_ns', 'min'), fin_ns=('fin_ns', 'max')))
+
+        lecturas = pd.DataFrame({'id_estacion': filas['id_estacion'].to_numpy(),
+                                 'ts': _utc_ns(filas['timestamp']), 'fila': np.arange(len(filas))})
+        cruce = pd.merge_asof(lecturas.sort_values('ts'), t.sort_values('inicio_ns'),
+                              left_on='ts', right_on='inicio_ns', by='id_estacion', direction='backward')
+        dentro = (cruce['ts'] >= cruce['inicio_ns']) & (cruce['ts'] < cruce['fin_ns'])
+        valida = np.ones(len(filas), dtype=bool)
+        valida[cruce['fila'].to_numpy()] = ~dentro.to_numpy()
+        return valida
+
+    # --- persistencia ---
+    def guardar(self, ruta):
+        np.savez_compressed(
+            ruta, ids=self.ids.to_numpy(dtype=str), visto_ns=self.visto_ns, cambio_ns=self.cambio_ns,
+            bicis=self.bicis, vacios=self.vacios, desde_ns=self.desde_ns,
+            **{f'intervalos_{c}': self.intervalos[c].to_numpy() for c in self.intervalos.columns},
+            marca_ns=np.array([_SIN_MARCA if self.marca_ns is None else self.marca_ns], dtype='int64'))
+
+    @classmethod
+    def cargar(cls, ruta):
+        salud = cls()
+        with np.load(ruta, allow_pickle=False) as z:
+            salud.ids = pd.Index(z['ids'].astype(object), name='id_estacion')
+            for c in ('visto_ns', 'cambio_ns', 'bicis', 'vacios', 'desde_ns'):
+                setattr(salud, c, z[c])
+            salud.intervalos = pd.DataFrame({c: z[f'intervalos_{c}'] for c in salud.intervalos.columns})
+            marca = int(z['marca_ns'][0])
+            salud.marca_ns = None if marca == _SIN_MARCA else marca
+        return salud
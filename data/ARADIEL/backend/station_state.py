@@ -0,0 +1,257 @@
+# station_state.py
+# Estado agregado por estación, persistente y fusionable: conteos, sumas,
+# observaciones vacías/llenas e histograma 7x24 (día de semana x hora) de
+# suma/conteo de ocupación. Las filas nuevas se pliegan en O(filas nuevas);
+# el resumen (promedios, % vacía/llena, hora pico, categoría) se deriva del
+# estado sin releer el histórico.
+import numpy as np
+import pandas as pd
+
+from data_processor import _categorizar_resumen
+from data_reader import parse_timestamp, resolver_columnas
+
+# Columnas escalares del estado (todas sumables)
+ESCALARES = ['obs', 'bicis_sum', 'bicis_n', 'cap_sum', 'cap_n', 'ocup_sum', 'ocup_n', 'vacia_n', 'llena_n']
+DIAS, HORAS = 7, 24
+_SIN_MARCA = np.iinfo('int64').min
+
+
+def _preparar_filas(df):
+    """Filas crudas o procesadas -> columnas mínimas con nombres canónicos."""
+    df = df.rename(columns=resolver_columnas(tuple(df.columns)))
+    n = len(df)
+
+    def _num(c):
+        return pd.to_numeric(df[c], errors='coerce') if c in df.columns else pd.Series(np.nan, index=df.index)
+
+    bicis, cap, vacios = _num('bicis_libres'), _num('capacidad'), _num('espacios_vacios')
+    if 'espacios_vacios' not in df.columns:
+        vacios = (cap - bicis).clip(lower=0)
+    ocup = _num('ocupacion') if 'ocupacion' in df.columns else bicis / cap.replace({0: np.nan})
+
+    ts = df['timestamp'] if 'timestamp' in df.columns else pd.Series(pd.NaT, index=df.index)
+    if not pd.api.types.is_datetime64_any_dtype(ts):
+        ts = parse_timestamp(ts)
+    nombres = df['nombre_estacion'] if 'nombre_estacion' in df.columns else pd.Series("", index=df.index)
+
+    return pd.DataFrame({
+        'id_estacion': df['id_estacion'].astype(str).to_numpy() if n else [],
+        'nombre_estacion': nombres.to_numpy(),
+        'timestamp': ts.array,   # conserva la zona horaria sin pasar por objetos
+        'hora': ts.dt.hour.to_numpy(),
+        'dia': ts.dt.dayofweek.to_numpy(),   # 0 = lunes
+        'bicis_libres': bicis.to_numpy(),
+        'capacidad': cap.to_numpy(),
+        'espacios_vacios': vacios.to_numpy(),
+        'ocupacion': ocup.to_numpy(),
+    })
+
+
+def _utc_ns(ts):
+    """Timestamps (con o sin zona) -> enteros ns UTC; NaT -> mínimo int64."""
+    ts = pd.Series(ts)
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert('UTC').dt.tz_localize(None)
+    return ts.astype('datetime64[ns]').to_numpy().view('int64')
+
+
+class MarcasEstacion:
+    """Último timestamp plegado (ns) de cada estación.
+
+    Una lectura es nueva si es posterior a la última plegada de su estación:
+    un snapshot tardío o parcial no se pierde porque otras estaciones ya
+    tengan lecturas más recientes.
+    """
+
+    def __init__(self, ids=(), ns=()):
+        self.ns = pd.Series(np.asarray(ns, dtype='int64'),
+                            index=pd.Index(np.asarray(ids, dtype=object), name='id_estacion'))
+
+    @property
+    def maximo(self):
+        """Última lectura plegada de toda la red (None si no hay)."""
+        return int(self.ns.max()) if len(self.ns) else None
+
+    def nuevas(self, ids, ns):
+        """True en las lecturas posteriores a la marca de su estación."""
+        return ns > self.ns.reindex(ids, fill_value=_SIN_MARCA).to_numpy(dtype='int64')
+
+    def avanzar(self, ids, ns):
+        """Sube la marca de cada estación al máximo de sus lecturas (ns válidos)."""
+        if len(ns):
+            maximos = pd.Series(ns, dtype='int64').groupby(np.asarray(ids, dtype=object)).max()
+            self.ns = pd.concat([self.ns, maximos]).groupby(level=0).max().rename_axis('id_estacion')
+
+    # --- persistencia (.npz) ---
+    def a_npz(self):
+        return {'marca_ids': self.ns.index.to_numpy(dtype=str), 'marca_ns': self.ns.to_numpy(dtype='int64')}
+
+    @classmethod
+    def desde_npz(cls, z, ids):
+        """Marcas guardadas por a_npz; un archivo viejo (una marca global) la aplica a ids."""
+        if 'marca_ids' in z.files:
+            return cls(z['marca_ids'].astype(object), z['marca_ns'])
+        marca = int(z['marca_ns'][0])
+        return cls(ids, np.full(len(ids), marca, 'int64')) if marca >= 0 else cls()
+
+
+class EstadoEstaciones:
+    """Agregados fusionables por estación (índice: id_estacion como texto)."""
+
+    def __init__(self):
+        self.escalares = pd.DataFrame(columns=ESCALARES, dtype='float64', index=pd.Index([], dtype=object, name='id_estacion'))
+        self.hist_sum = np.zeros((0, DIAS, HORAS))
+        self.hist_n = np.zeros((0, DIAS, HORAS), dtype='int64')
+        self.nombres = pd.Series(dtype='int64', index=pd.MultiIndex.from_arrays([[], []], names=['id_estacion', 'nombre']))
+        self.marcas = MarcasEstacion()   # último timestamp plegado por estación (ns UTC)
+
+    # --- construcción ---
+    @classmethod
+    def desde_df(cls, df):
+        estado = cls()
+        estado.plegar(df, respetar_marca=False)
+        return estado
+
+    def _asegurar_estaciones(self, ids):
+        """Agrega filas vacías para estaciones nuevas; devuelve posiciones de ids."""
+        nuevas = pd.Index(pd.unique(ids)).difference(self.escalares.index)
+        if len(nuevas):
+            self.escalares = pd.concat([self.escalares, pd.DataFrame(0.0, index=nuevas, columns=ESCALARES)])
+            self.escalares.index.name = 'id_estacion'
+            extra = (len(nuevas), DIAS, HORAS)
+            self.hist_sum = np.concatenate([self.hist_sum, np.zeros(extra)])
+            self.hist_n = np.concatenate([self.hist_n, np.zeros(extra, dtype='int64')])
+        return self.escalares.index.get_indexer(ids)
+
+    def plegar(self, df, respetar_marca=True):
+        """Incorpora filas nuevas (snapshot o bloque de histórico). Devuelve filas plegadas.
+
+        Con respetar_marca, las filas con timestamp <= último plegado de su
+        estación se ignoran (reintentar el mismo snapshot no duplica conteos,
+        y uno tardío de otras estaciones sí entra), igual que las que no
+        tienen timestamp válido: no hay forma de saber si ya se plegaron. La
+        construcción completa (desde_df) sí las cuenta, como el procesador.
+        """
+        filas = _preparar_filas(pd.DataFrame(df))
+        if filas.empty:
+            return 0
+        ts_ns = _utc_ns(filas['timestamp'])
+        validos = ts_ns != _SIN_MARCA
+        if respetar_marca:
+            nuevas = validos & self.marcas.nuevas(filas['id_estacion'].to_numpy(), ts_ns)
+            filas, ts_ns, validos = filas[nuevas], ts_ns[nuevas], validos[nuevas]
+            if filas.empty:
+                return 0
+
+        pos = self._asegurar_estaciones(filas['id_estacion'].to_numpy())
+
+        # escalares: bincount por posición de estación
+        n_est = len(self.escalares)
+        suma = np.zeros((n_est, len(ESCALARES)))
+
+        def _acum(j, pesos):
+            suma[:, j] += np.bincount(pos, weights=pesos, minlength=n_est)
+
+        _acum(0, None)
+        for j, col in ((1, 'bicis_libres'), (3, 'capacidad'), (5, 'ocupacion')):
+            v = filas[col].to_numpy(dtype='float64')
+            ok = ~np.isnan(v)
+            _acum(j, np.where(ok, v, 0.0))
+            _acum(j + 1, ok.astype('float64'))
+        _acum(7, (filas['bicis_libres'].to_numpy() == 0).astype('float64'))
+        _acum(8, (filas['espacios_vacios'].to_numpy() == 0).astype('float64'))
+        self.escalares += suma
+
+        # histograma 7x24 de ocupación
+        ocup = filas['ocupacion'].to_numpy(dtype='float64')
+        h = validos & ~np.isnan(ocup)
+        idx = (pos[h], filas['dia'].to_numpy()[h].astype(int), filas['hora'].to_numpy()[h].astype(int))
+        np.add.at(self.hist_sum, idx, ocup[h])
+        np.add.at(self.hist_n, idx, 1)
+
+        # conteo de nombres (para la moda)
+        conteo = filas.groupby(['id_estacion', 'nombre_estacion'], dropna=True).size()
+        conteo.index.names = ['id_estacion', 'nombre']
+        self.nombres = self.nombres.add(conteo, fill_value=0).astype('int64')
+
+        self.marcas.avanzar(filas['id_estacion'].to_numpy()[validos], ts_ns[validos])
+        return len(filas)
+
+    def fusionar(self, otro):
+        """Suma otro estado (p.ej. de otro tramo de estaciones o de otro archivo)."""
+        pos = self._asegurar_estaciones(otro.escalares.index.to_numpy())
+        self.escalares.iloc[pos] += otro.escalares.to_numpy()
+        self.hist_sum[pos] += otro.hist_sum
+        self.hist_n[pos] += otro.hist_n
+        self.nombres = self.nombres.add(otro.nombres, fill_value=0).astype('int64')
+        self.marcas.avanzar(otro.marcas.ns.index.to_numpy(), otro.marcas.ns.to_numpy())
+        return self
+
+    # --- resultados ---
+    def hora_pico(self):
+        """Hora de mayor ocupación media (marginal sobre días); empate -> hora menor."""
+        s, n = self.hist_sum.sum(axis=1), self.hist_n.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            medias = np.where(n > 0, s / n, -np.inf)
+        hp = np.argmax(medias, axis=1).astype('float64')
+        hp[(n == 0).all(axis=1)] = np.nan
+        return pd.Series(hp, index=self.escalares.index, name='hora_pico')
+
+    def perfil(self, id_estacion):
+        """Ocupación media 7x24 (día x hora) de una estación; NaN donde no hay datos."""
+        i = self.escalares.index.get_loc(str(id_estacion))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.hist_sum[i] / np.where(self.hist_n[i] > 0, self.hist_n[i], np.nan)
+
+    def resumen(self):
+        """station_summary con las mismas columnas que el procesador."""
+        e = self.escalares
+        nombre = ''
+        if not self.nombres.empty:
+            nombre = (self.nombres.rename('n').reset_index()
+                      .sort_values(['id_estacion', 'n', 'nombre'], ascending=[True, False, True])
+                      .drop_duplicates('id_estacion').set_index('id_estacion')['nombre']
+                      .reindex(e.index).fillna(''))
+        obs = e['obs'].replace(0, np.nan)
+        resumen = pd.DataFrame({
+            'nombre_estacion': nombre,
+            'obs': e['obs'].astype('int64'),
+            'bicis_promedio': e['bicis_sum'] / e['bicis_n'].replace(0, np.nan),
+            'capacidad_promedio': e['cap_sum'] / e['cap_n'].replace(0, np.nan),
+            'ocupacion_promedio': e['ocup_sum'] / e['ocup_n'].replace(0, np.nan),
+            'pct_vacia': e['vacia_n'] / obs * 100,
+            'pct_llena': e['llena_n'] / obs * 100,
+            'hora_pico': self.hora_pico(),
+        }, index=e.index)
+        return _categorizar_resumen(resumen.sort_index().reset_index())
+
+    # --- persistencia ---
+    def guardar(self, ruta):
+        """Guarda el estado en un .npz (sin pickle)."""
+        nom = self.nombres.rename('n').reset_index()
+        np.savez_compressed(
+            ruta,
+            ids=self.escalares.index.to_numpy(dtype=str),
+            escalares=self.escalares.to_numpy(dtype='float64'),
+            hist_sum=self.hist_sum,
+            hist_n=self.hist_n,
+            nombres_id=nom['id_estacion'].to_numpy(dtype=str),
+            nombres_nombre=nom['nombre'].to_numpy(dtype=str),
+            nombres_n=nom['n'].to_numpy(dtype='int64'),
+            **self.marcas.a_npz(),
+        )
+
+    @classmethod
+    def cargar(cls, ruta):
+        estado = cls()
+        with np.load(ruta, allow_pickle=False) as z:
+            indice = pd.Index(z['ids'].astype(object), name='id_estacion')
+            estado.escalares = pd.DataFrame(z['escalares'], index=indice, columns=ESCALARES)
+            estado.hist_sum = z['hist_sum']
+            estado.hist_n = z['hist_n']
+            estado.nombres = pd.Series(
+                z['nombres_n'],
+                index=pd.MultiIndex.from_arrays([z['nombres_id'].astype(object), z['nombres_nombre'].astype(object)],
+                                                names=['id_estacion', 'nombre']))
+            estado.marcas = MarcasEstacion.desde_npz(z, indice)
+        return estado
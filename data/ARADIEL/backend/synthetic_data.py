@@ -0,0 +1,162 @@
+# synthetic_data.py
+# Generador de datos sintéticos con el mismo esquema que collect_snapshot
+# (una fila por estación y snapshot), para probar escala: estaciones x días
+# x intervalo configurables. La ocupación sigue patrones por hora según el
+# tipo de estación (residencial se vacía en la mañana, oficinas se llenan,
+# ocio se mueve los fines de semana) más un ruido AR(1) por estación.
+#
+# Uso:
+#   python synthetic_data.py -e 500 -d 365 -i 5 -o data/sintetico.csv
+import argparse
+import hashlib
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from geofence import en_zona, zonas_estaciones
+
+LIMA_TZ = 'America/Lima'
+CENTRO = (-12.1100, -77.0300)
+COLUMNAS = ['scrape_timestamp', 'station_id', 'station_name', 'lat', 'lon', 'capacity', 'free_bikes',
+            'empty_slots', 'day_of_week', 'periodo_dia', 'weather_main', 'weather_desc', 'temp_C',
+            'wind_speed', 'clima_miraflores', 'temp_miraflores', 'in_miraflores']
+DIAS_SEMANA = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+VIAS = ['Av.', 'Ca.', 'Malecón', 'Parque', 'Ov.']
+CALLES = ['Pardo', 'Larco', 'Benavides', 'Arequipa', 'José Pardo', 'Diagonal', 'Angamos', 'Comandante Espinar',
+          'Petit Thouars', 'Schell', 'Alcanfores', 'Grau', 'Cisneros', 'Reducto', 'La Paz', 'Balta']
+CAPACIDADES = [10, 12, 14, 15, 16, 18, 20, 24, 30]
+TIPOS = ['residencial', 'oficinas', 'ocio']
+PHI_RUIDO, SIGMA_RUIDO = 0.97, 0.035
+PROB_DOCK_ROTO = 0.01     # filas con un espacio menos que capacidad - bicis (como en el feed real)
+CLIMA = 'Clima: pronóstico del tiempo'
+
+
+def _campana(h, centro, ancho):
+    return np.exp(-0.5 * ((h - centro) / ancho) ** 2)
+
+
+def perfil(tipo, hora, fin_de_semana):
+    """Desvío de ocupación respecto a la media de la estación según la hora (0..24, fraccional)."""
+    viaje = np.where(fin_de_semana, 0.3, 1.0)
+    if tipo == 'residencial':
+        return viaje * (-0.30 * _campana(hora, 8.5, 1.5) - 0.10 * _campana(hora, 14, 3)
+                        + 0.20 * _campana(hora, 21, 3)) + 0.10 * _campana(hora, 3, 3)
+    if tipo == 'oficinas':
+        return viaje * (0.35 * _campana(hora, 11, 2.5) - 0.25 * _campana(hora, 19, 2)) - 0.10 * _campana(hora, 3, 3)
+    ocio = np.where(fin_de_semana, 1.0, 0.4)
+    return ocio * (-0.30 * _campana(hora, 16, 2.5) + 0.15 * _campana(hora, 10, 2))
+
+
+def estaciones_sinteticas(n, semilla=0):
+    """Tabla de estaciones: id (hex como CityBikes), nombre con código, coordenadas, capacidad y tipo."""
+    rng = np.random.default_rng(semilla)
+    radio_km = 2.5 * np.sqrt(max(n, 1) / 50)
+    r = radio_km * np.sqrt(rng.random(n))
+    ang = rng.random(n) * 2 * np.pi
+    lat = CENTRO[0] + r * np.sin(ang) / 111.32
+    lon = CENTRO[1] + r * np.cos(ang) / (111.32 * np.cos(np.radians(CENTRO[0])))
+    codigos = 18000 + np.arange(n)
+    codigos[codigos >= 27042] += 1   # 27042 es el código excluido del análisis
+    ids = [hashlib.md5(f"sintetica-{semilla}-{i}".encode()).hexdigest() for i in range(n)]
+    nombres = [f"{c:05d} {VIAS[rng.integers(len(VIAS))]} {CALLES[rng.integers(len(CALLES))]} Cdra. {rng.integers(1, 40)}"
+               for c in codigos]
+    t = pd.DataFrame({
+        'station_id': ids, 'station_name': nombres,
+        'lat': lat.round(7), 'lon': lon.round(7),
+        'capacity': rng.choice(CAPACIDADES, n),
+        'tipo': rng.choice(TIPOS, n, p=[0.5, 0.3, 0.2]),
+        'media': rng.uniform(0.3, 0.6, n),
+    })
+    t['in_miraflores'] = [en_zona(z) for z in zonas_estaciones(t['station_id'], t['lat'], t['lon'])]
+    return t
+
+
+def generar(estaciones=50, dias=10, intervalo_min=30, inicio='2025-10-01', semilla=0):
+    """Genera bloques diarios (DataFrame con COLUMNAS) ordenados por snapshot y estación."""
+    rng = np.random.default_rng(semilla + 1)
+    t = estaciones_sinteticas(estaciones, semilla)
+    n = len(t)
+    cap = t['capacity'].to_numpy()
+    media = t['media'].to_numpy()
+    miraf = t['in_miraflores'].to_numpy()
+    tipos = t['tipo'].to_numpy()
+    ruido = rng.normal(0, SIGMA_RUIDO / np.sqrt(1 - PHI_RUIDO ** 2), n)
+    por_dia = int(round(24 * 60 / intervalo_min))
+    dia0 = pd.Timestamp(inicio).tz_localize(LIMA_TZ) if pd.Timestamp(inicio).tzinfo is None else pd.Timestamp(inicio)
+
+    for d in range(dias):
+        instantes = pd.date_range(dia0 + pd.Timedelta(days=d), periods=por_dia, freq=f'{intervalo_min}min')
+        hora = (instantes.hour + instantes.minute / 60).to_numpy()
+        finde = instantes.dayofweek.to_numpy() >= 5
+        base = np.empty((por_dia, n))
+        for tipo in TIPOS:
+            sel = tipos == tipo
+            base[:, sel] = media[sel] + perfil(tipo, hora[:, None], finde[:, None])
+        ocup = np.empty((por_dia, n))
+        for k in range(por_dia):
+            ruido = PHI_RUIDO * ruido + rng.normal(0, SIGMA_RUIDO, n)
+            ocup[k] = base[k] + ruido
+        bicis = np.rint(np.clip(ocup, 0, 1) * cap).astype(int)
+        vacios = cap - bicis
+        roto = (rng.random(bicis.shape) < PROB_DOCK_ROTO) & (vacios > 0)
+        vacios = vacios - roto
+
+        temp = np.round(18 + 4 * np.sin((hora - 9) / 24 * 2 * np.pi) + rng.normal(0, 0.3), 1)
+        periodo = np.where((hora >= 5) & (hora < 12), 'mañana', np.where((hora >= 12) & (hora < 18), 'tarde', 'noche'))
+        rep = lambda v: np.repeat(np.asarray(v, dtype=object), n)
+        til = lambda v: np.tile(np.asarray(v, dtype=object), por_dia)
+        en_miraf = til(miraf).astype(bool)
+        temp_filas = rep(temp)
+        yield pd.DataFrame({
+            'scrape_timestamp': rep([i.isoformat() for i in instantes]),
+            'station_id': til(t['station_id']),
+            'station_name': til(t['station_name']),
+            'lat': til(t['lat']),
+            'lon': til(t['lon']),
+            'capacity': til(cap),
+            'free_bikes': bicis.ravel(),
+            'empty_slots': vacios.ravel(),
+            'day_of_week': rep(np.array(DIAS_SEMANA, dtype=object)[instantes.dayofweek]),
+            'periodo_dia': rep(periodo),
+            'weather_main': None,
+            'weather_desc': None,
+            'temp_C': np.where(en_miraf, temp_filas, None),
+            'wind_speed': None,
+            'clima_miraflores': np.where(en_miraf, CLIMA, None),
+            'temp_miraflores': temp_filas,
+            'in_miraflores': en_miraf,
+        }, columns=COLUMNAS)
+
+
+def escribir_csv(bloques, ruta):
+    """Escribe los bloques en un CSV (como append_to_csv). Devuelve filas escritas."""
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    filas = 0
+    with open(ruta, 'w', encoding='utf-8', newline='') as f:
+        for i, bloque in enumerate(bloques):
+            bloque.to_csv(f, header=(i == 0), index=False)
+            filas += len(bloque)
+    return filas
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Genera snapshots sintéticos con el esquema de collect_snapshot")
+    ap.add_argument('-e', '--estaciones', type=int, default=50)
+    ap.add_argument('-d', '--dias', type=int, default=10)
+    ap.add_argument('-i', '--intervalo', type=int, default=30, help="minutos entre snapshots")
+    ap.add_argument('--inicio', default='2025-10-01')
+    ap.add_argument('--semilla', type=int, default=0)
+    ap.add_argument('-o', '--salida', default=str(Path(__file__).parent / 'data' / 'sintetico.csv'))
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    filas = escribir_csv(generar(args.estaciones, args.dias, args.intervalo, args.inicio, args.semilla), args.salida)
+    print(f"🧪 {filas} filas ({args.estaciones} estaciones x {args.dias} días, cada {args.intervalo} min) "
+          f"-> {args.salida} en {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
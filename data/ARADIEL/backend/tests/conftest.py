@@ -0,0 +1,29 @@
+# conftest.py
+# Las pruebas corren contra un directorio de datos temporal (CITYBIKE_DATA_DIR /
+# CITYBIKE_DB) para no tocar los archivos reales: data_utils y models leen esas
+# variables al importarse, así que se fijan aquí, antes de cualquier import del
+# backend.
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+DATOS = Path(tempfile.mkdtemp(prefix='citybike-tests-'))
+
+os.environ['CITYBIKE_DATA_DIR'] = str(DATOS)
+os.environ['CITYBIKE_DB'] = str(DATOS / 'db.sqlite')
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def pytest_addoption(parser):
+    grupo = parser.getgroup('citybike', "Datos sintéticos de los benchmarks")
+    grupo.addoption('--estaciones', type=int, default=100)
+    grupo.addoption('--dias', type=int, default=7)
+    grupo.addoption('--intervalo', type=int, default=15, help="minutos entre snapshots")
+    grupo.addoption('--semilla', type=int, default=0)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DATOS, ignore_errors=True)
@@ -0,0 +1,54 @@
+# test_aggregates.py
+# Un snapshot tardío o parcial (estaciones que llegan después de que otras ya
+# tienen lecturas más recientes) entra en los agregados, y reintentarlo no
+# duplica nada.
+import pandas as pd
+import pytest
+
+import synthetic_data
+from flows import TablaFlujos
+from forecast import Pronostico
+from history_db import AlmacenHistorial
+from quantile_sketch import SketchDistribuciones
+from rollup_cube import CuboRollup
+from station_health import SaludEstaciones
+from station_state import EstadoEstaciones
+
+AGREGADOS = [(EstadoEstaciones, 'estado.npz'), (SketchDistribuciones, 'distribuciones.npz'), (CuboRollup, 'cubo'),
+             (Pronostico, 'pronostico.npz'), (SaludEstaciones, 'salud.npz'), (TablaFlujos, 'flujos'),
+             (AlmacenHistorial, 'historial.sqlite')]
+
+
+@pytest.fixture(scope='module')
+def lecturas():
+    df = pd.concat(list(synthetic_data.generar(10, 2, 15, semilla=3)), ignore_index=True)
+    ultimos = sorted(df['scrape_timestamp'].unique())[-2:]
+    tarde = df['scrape_timestamp'].isin(ultimos) & df['station_id'].isin(df['station_id'].unique()[:4])
+    return df, tarde
+
+
+@pytest.mark.parametrize('clase, archivo', AGREGADOS, ids=[c.__name__ for c, _ in AGREGADOS])
+def test_snapshot_tardio_entra_una_vez(clase, archivo, lecturas, tmp_path):
+    df, tarde = lecturas
+    ruta = tmp_path / archivo
+    clase.desde_df(df[~tarde]).guardar(ruta)
+    agregado = clase.cargar(ruta)
+    assert agregado.plegar(df[tarde]) == tarde.sum()
+    assert agregado.plegar(df[tarde]) == 0
+
+
+def test_estado_con_tardio_igual_al_completo(lecturas):
+    df, tarde = lecturas
+    estado = EstadoEstaciones.desde_df(df[~tarde])
+    estado.plegar(df[tarde])
+    pd.testing.assert_frame_equal(estado.resumen(), EstadoEstaciones.desde_df(df).resumen())
+
+
+def test_cubo_con_tardio_igual_al_completo(lecturas, tmp_path):
+    df, tarde = lecturas
+    CuboRollup.desde_df(df[~tarde]).guardar(tmp_path / 'cubo')
+    cubo = CuboRollup.cargar(tmp_path / 'cubo')
+    cubo.plegar(df[tarde])
+    cubo.guardar(tmp_path / 'cubo')
+    pd.testing.assert_frame_equal(CuboRollup.cargar(tmp_path / 'cubo').celdas, CuboRollup.desde_df(df).celdas,
+                                  check_dtype=False)
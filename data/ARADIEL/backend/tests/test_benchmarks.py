@@ -0,0 +1,152 @@
+# test_benchmarks.py
+# Benchmarks (pytest-benchmark) de los caminos de procesamiento y de la API
+# sobre datos sintéticos (synthetic_data.py) en el directorio temporal de
+# conftest.py. OSRM se reemplaza por un stub local (línea recta a 30 km/h).
+# Las corridas se guardan en bench_results/<máquina>/ y se comparan con una
+# anterior para detectar regresiones (las de loadtest.py van a
+# bench_results/carga/ y no se mezclan).
+#
+# Uso (desde data/ARADIEL/backend):
+#   python -m pytest tests/test_benchmarks.py --benchmark-autosave      # 100 estaciones x 7 días x 15 min
+#   python -m pytest tests/test_benchmarks.py --estaciones 500 --dias 30 --intervalo 5 --benchmark-autosave
+#   python -m pytest tests/test_benchmarks.py -k "api_stations or greedy" \
+#       --benchmark-compare --benchmark-compare-fail=median:25%
+import contextlib
+import io
+import sys
+
+import pandas as pd
+import pytest
+
+import synthetic_data
+from conftest import BACKEND_DIR, DATOS
+from geofence import haversine_km
+
+EDA_DIR = BACKEND_DIR.parents[2] / 'EDA Final'   # mapas.py (greedy del notebook)
+
+
+# ============================================================
+# Stub de OSRM (sin red)
+# ============================================================
+
+class _RespuestaOSRM:
+    def __init__(self, datos):
+        self._datos = datos
+        self.status_code = 200
+
+    def json(self):
+        return self._datos
+
+    def raise_for_status(self):
+        pass
+
+
+class OSRMStub:
+    """Reemplaza el módulo requests en app: responde rutas en línea recta."""
+
+    def __init__(self, kmh=30.0):
+        self.kmh = kmh
+        self.llamadas = 0
+
+    def get(self, url, timeout=None, **kwargs):
+        self.llamadas += 1
+        coords = url.split('/driving/')[1].split('?')[0]
+        (lon1, lat1), (lon2, lat2) = [tuple(map(float, p.split(','))) for p in coords.split(';')]
+        km = float(haversine_km(lat1, lon1, lat2, lon2))
+        return _RespuestaOSRM({'routes': [{
+            'distance': km * 1000, 'duration': km / self.kmh * 3600,
+            'geometry': {'type': 'LineString', 'coordinates': [[lon1, lat1], [lon2, lat2]]},
+        }]})
+
+
+# ============================================================
+# Datos y backend
+# ============================================================
+
+def preparar_datos(directorio, estaciones, dias, intervalo, semilla):
+    """Histórico crudo sintético + CSV en vivo (último día) en el directorio de datos."""
+    historico = directorio / 'citybike_sintetico.csv'
+    filas = synthetic_data.escribir_csv(synthetic_data.generar(estaciones, dias, intervalo, semilla=semilla), historico)
+    vivo = synthetic_data.generar(estaciones, 1, intervalo, inicio=pd.Timestamp('2025-10-01') + pd.Timedelta(days=dias),
+                                  semilla=semilla)
+    filas_vivo = synthetic_data.escribir_csv(vivo, directorio / 'citybike_live.csv')
+    return historico, filas, filas_vivo
+
+
+@pytest.fixture(scope='module')
+def datos(request):
+    """Genera los datos, deja el histórico procesado e importa el backend apuntando a ellos."""
+    opcion = request.config.getoption
+    historico, filas, filas_vivo = preparar_datos(DATOS, opcion('--estaciones'), opcion('--dias'),
+                                                  opcion('--intervalo'), opcion('--semilla'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_mod
+        from data_processor import procesar_citybike_csv
+        from data_utils import PROCESSED_DIR
+        app_mod.scheduler.shutdown(wait=False)   # sin snapshots automáticos (red) durante la medición
+        procesar_citybike_csv(historico, salida_columnar=PROCESSED_DIR)
+    osrm = OSRMStub()
+    app_mod.requests = osrm
+    return {'historico': historico, 'filas': filas, 'filas_vivo': filas_vivo, 'app': app_mod, 'osrm': osrm,
+            'crudo': pd.read_csv(historico)}
+
+
+@pytest.fixture(scope='module')
+def mapas():
+    sys.path.insert(0, str(EDA_DIR))
+    import mapas
+    return mapas
+
+
+def _silencioso(fn):
+    """fn con la salida estándar silenciada (los prints del backend no cuentan en el tiempo útil)."""
+    def _llamar(*args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn(*args, **kwargs)
+    return _llamar
+
+
+def _api(benchmark, datos, ruta):
+    cliente = datos['app'].app.test_client()
+    r = benchmark(_silencioso(lambda: cliente.get(ruta)))
+    assert r.status_code == 200, f"{ruta} -> {r.status_code}"
+
+
+# ============================================================
+# Casos
+# ============================================================
+
+def test_procesar_citybike_csv(benchmark, datos):
+    from data_processor import procesar_citybike_csv
+    from data_utils import PROCESSED_DIR
+    benchmark.extra_info['filas'] = datos['filas']
+    benchmark.pedantic(_silencioso(procesar_citybike_csv), args=(datos['historico'],),
+                       kwargs={'salida_columnar': PROCESSED_DIR}, rounds=3)
+
+
+def test_load_full_history(benchmark, datos):
+    from data_utils import load_full_history
+    historial = benchmark(_silencioso(load_full_history))
+    assert len(historial) >= datos['filas']
+
+
+def test_station_average_occupancy(benchmark, datos):
+    from data_utils import station_average_occupancy
+    benchmark.pedantic(_silencioso(station_average_occupancy), setup=lambda: ((datos['crudo'].copy(),), {}),
+                       rounds=5)
+
+
+def test_api_stations(benchmark, datos):
+    _api(benchmark, datos, '/api/stations')
+
+
+def test_api_redistribution(benchmark, datos):
+    _api(benchmark, datos, '/api/redistribution')
+    benchmark.extra_info['llamadas_osrm'] = datos['osrm'].llamadas
+
+
+def test_greedy_transferencias(benchmark, datos, mapas):
+    crudo = datos['crudo']
+    ultimo = crudo[crudo['scrape_timestamp'] == crudo['scrape_timestamp'].iloc[-1]].rename(columns=mapas.RENOMBRES)
+    snapshot = ultimo.assign(ocupacion=ultimo['bicis_libres'] / ultimo['capacidad'])
+    benchmark.pedantic(_silencioso(mapas.tabla_transferencias), setup=lambda: ((snapshot.copy(),), {}), rounds=5)
@@ -0,0 +1,59 @@
+# test_data_processor.py
+# El procesador vectorizado (en memoria, en paralelo y por bloques) contra la
+# implementación original (procesador_original.py) sobre el CSV real
+# citybike_lima (5).csv: mismo CSV de salida byte a byte y mismo resumen por
+# estación.
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import procesador_original
+from columnar_store import ruta_resumen
+from conftest import BACKEND_DIR
+from data_processor import procesar_citybike_csv, procesar_citybike_csv_por_bloques
+
+CSV_REAL = BACKEND_DIR / 'data' / 'citybike_lima (5).csv'
+
+pytestmark = pytest.mark.skipif(not CSV_REAL.exists(), reason=f"falta {CSV_REAL.name}")
+
+
+def _silencioso(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+@pytest.fixture(scope='module')
+def original(tmp_path_factory):
+    salida = tmp_path_factory.mktemp('original') / 'procesado.csv'
+    _, resumen = _silencioso(procesador_original.procesar_citybike_csv, CSV_REAL, salida)
+    return salida, resumen
+
+
+def _mismo_resumen(resumen, esperado):
+    # el Parquet guarda la categoría como texto
+    resumen = resumen.astype({'categoria_ocupacion_promedio': esperado['categoria_ocupacion_promedio'].dtype})
+    pd.testing.assert_frame_equal(resumen.reset_index(drop=True), esperado.reset_index(drop=True))
+
+
+def test_en_memoria_igual_al_original(original, tmp_path):
+    salida, esperado = original
+    _silencioso(procesar_citybike_csv, CSV_REAL, tmp_path / 'procesado.csv', salida_columnar=tmp_path / 'procesado')
+    assert (tmp_path / 'procesado.csv').read_bytes() == salida.read_bytes()
+    _mismo_resumen(pd.read_parquet(ruta_resumen(tmp_path / 'procesado')), esperado)
+
+
+def test_en_paralelo_igual_al_original(original, tmp_path):
+    salida, esperado = original
+    _silencioso(procesar_citybike_csv, CSV_REAL, tmp_path / 'procesado.csv', salida_columnar=tmp_path / 'procesado',
+                procesos=2)
+    assert (tmp_path / 'procesado.csv').read_bytes() == salida.read_bytes()
+    _mismo_resumen(pd.read_parquet(ruta_resumen(tmp_path / 'procesado')), esperado)
+
+
+def test_por_bloques_igual_al_original(original, tmp_path):
+    salida, esperado = original
+    resumen = _silencioso(procesar_citybike_csv_por_bloques, CSV_REAL, tmp_path / 'procesado.csv', chunksize=5_000)
+    assert (tmp_path / 'procesado.csv').read_bytes() == salida.read_bytes()
+    _mismo_resumen(resumen, esperado)
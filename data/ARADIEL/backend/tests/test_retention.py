@@ -0,0 +1,48 @@
+# test_retention.py
+# Tras compactar, el resumen de un rango que cruza el corte (medidas por hora
+# del almacén + rollups) da lo mismo que el resumen SQL sobre todas las lecturas.
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import retention
+import synthetic_data
+from columnar_store import leer_procesado
+from data_processor import procesar_citybike_csv
+from history_db import AlmacenHistorial
+
+HOY = '2025-10-12'   # con CRUDO_DIAS=3 y QUINCE_DIAS=6: cinco fechas a 1 h, tres a 15 min
+RANGO = dict(desde='2025-10-01', hasta='2025-10-10 23:59')
+
+
+@pytest.fixture
+def niveles(tmp_path):
+    crudo = tmp_path / 'citybike_sintetico.csv'
+    synthetic_data.escribir_csv(synthetic_data.generar(12, 10, 30, semilla=1), crudo)
+    with contextlib.redirect_stdout(io.StringIO()):
+        procesar_citybike_csv(crudo, salida_columnar=tmp_path / 'procesado')
+    return {'crudo': tmp_path / 'procesado', '15min': tmp_path / 'rollup_15min', '1h': tmp_path / 'rollup_1h'}
+
+
+def test_resumen_desde_medidas_igual_al_sql(niveles, tmp_path):
+    ruta = tmp_path / 'historial.sqlite'
+    AlmacenHistorial.desde_df(leer_procesado(niveles['crudo'])).guardar(ruta)
+    esperado = AlmacenHistorial.resumen(ruta, **RANGO)
+    nombres = esperado.set_index('id_estacion')['nombre_estacion']
+
+    pd.testing.assert_frame_equal(retention.resumen_estaciones(AlmacenHistorial.medidas(ruta, **RANGO), nombres),
+                                  esperado, check_dtype=False)
+
+    movidas = retention.compactar(niveles, HOY, crudo_dias=3, quince_dias=6)
+    assert movidas == {'15min': 3, '1h': 5}
+    almacen = AlmacenHistorial.cargar(ruta)
+    almacen.podar(retention.corte(HOY, 3))
+    almacen.guardar(ruta)
+    assert AlmacenHistorial.resumen(ruta, hasta='2025-10-08').empty
+
+    rollups = {k: v for k, v in niveles.items() if k != 'crudo'}
+    medidas = pd.concat([retention.leer_medidas(rollups, **RANGO).drop(columns='resolucion'),
+                         AlmacenHistorial.medidas(ruta, **RANGO)], ignore_index=True)
+    pd.testing.assert_frame_equal(retention.resumen_estaciones(medidas, nombres), esperado, check_dtype=False)
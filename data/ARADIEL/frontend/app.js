@@ -1,7 +1,10 @@
 // 🌍 Variable global del mapa
 let map;
 let stationData = [];
+let stationMeta = null;   // metadatos versionados de /api/stations/meta
 let activeRoutes = [];
+let heatLayer = null;
+let heatVisible = false;
 
 // 🚀 Inicializar cuando el DOM esté listo
 document.addEventListener('DOMContentLoaded', () => {
@@ -28,6 +31,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
   // Recargar cada 5 minutos
   setInterval(loadStations, 5 * 60 * 1000);
+
+  // Recalcular la rejilla de calor al cambiar de zoom
+  map.on('zoomend', () => { if (heatVisible) loadHeatmap(); });
 });
 
 // 🎨 Obtener color por nivel de ocupación
@@ -39,6 +45,40 @@ function getColor(occ) {
   return '#e74c3c';
 }
 
+// 📡 Estado de estaciones: arrays binarios + metadatos cacheados por versión
+// /api/stations/state?format=bin = int16 bicis[n] | int16 espacios[n] | uint16 ocupación x10000 [n]
+async function fetchStations() {
+  const res = await fetch('/api/stations/state?format=bin');
+  const version = res.headers.get('X-Stations-Version');
+  const buf = await res.arrayBuffer();
+
+  // Los metadatos solo se descargan si cambió la versión (y el navegador los cachea)
+  if (!stationMeta || stationMeta.version !== version) {
+    stationMeta = await (await fetch(`/api/stations/meta?v=${version}`)).json();
+  }
+
+  const n = buf.byteLength / 6;
+  const bikes = new Int16Array(buf, 0, n);
+  const slots = new Int16Array(buf, 2 * n, n);
+  const occ = new Uint16Array(buf, 4 * n, n);
+
+  const stations = [];
+  for (let i = 0; i < Math.min(n, stationMeta.station_id.length); i++) {
+    const lat = stationMeta.lat[i], lon = stationMeta.lon[i];
+    if (lat === null || lon === null || (bikes[i] < 0 && slots[i] < 0)) continue;  // sin coordenadas o sin lectura
+    stations.push({
+      station_id: stationMeta.station_id[i],
+      station_name: stationMeta.station_name[i],
+      lat, lon,
+      free_bikes: bikes[i] < 0 ? null : bikes[i],
+      empty_slots: slots[i] < 0 ? null : slots[i],
+      capacity: stationMeta.capacity[i],
+      avg_occupancy: occ[i] === 0xFFFF ? 0 : occ[i] / 10000
+    });
+  }
+  return stations;
+}
+
 // 📡 Cargar estaciones desde el backend
 async function loadStations() {
   try {
@@ -49,8 +89,7 @@ async function loadStations() {
       }
     });
 
-    const res = await fetch('/api/stations');
-    const data = await res.json();
+    const data = await fetchStations();
     stationData = data;
 
     if (!data || data.length === 0) {
@@ -106,6 +145,34 @@ async function loadStations() {
   }
 }
 
+// 🔥 Mapa de calor (rejilla pre-agregada del backend, franja = hora actual)
+async function loadHeatmap() {
+  try {
+    const hour = new Date().getHours();
+    const res = await fetch(`/api/heatmap?zoom=${map.getZoom()}&bucket=hour&value=${hour}&metric=demand`);
+    const data = await res.json();
+    const cells = (data.cells && data.cells[String(hour)]) || [];
+
+    if (heatLayer) map.removeLayer(heatLayer);
+    heatLayer = L.heatLayer(cells.map(([lat, lon, w]) => [lat, lon, w]), {
+      radius: 20, blur: 15, maxZoom: 17,
+      gradient: {0.2: 'blue', 0.4: 'lime', 0.6: 'orange', 1.0: 'red'}
+    }).addTo(map);
+  } catch (err) {
+    console.error("❌ Error al cargar mapa de calor:", err);
+  }
+}
+
+function toggleHeatmap() {
+  heatVisible = !heatVisible;
+  if (heatVisible) {
+    loadHeatmap();
+  } else if (heatLayer) {
+    map.removeLayer(heatLayer);
+    heatLayer = null;
+  }
+}
+
 // 📋 Lista de estaciones con pocas bicis
 function renderLowStations() {
   const lowList = document.getElementById('low-list');